@@ -8,12 +8,10 @@ def structured_format_forward(record):
     try:
         # 安全构造带时区的时间戳
         time_obj: datetime = record["time"]
-        # 统一格式为 "YYYY-MM-DDTHH:MM:SS+HH:MM"
-        time_str = time_obj.strftime("%Y-%m-%dT%H:%M:%S%z")
-        if len(time_str) >= 2:
-            time_str = f"{time_str[:-2]}:{time_str[-2:]}"
-        else:
-            time_str = time_obj.strftime("%Y-%m-%dT%H:%M:%S+08:00")
+        # 统一格式为 "YYYY-MM-DDTHH:MM:SS.mmm+HH:MM"，保留毫秒，watcher 以此计算转发到处理的延迟
+        if time_obj.tzinfo is None:
+            time_obj = time_obj.replace(tzinfo=timezone(timedelta(hours=8)))
+        time_str = time_obj.isoformat(timespec="milliseconds")
 
         # 构造日志字典
         log_data = {
@@ -23,6 +21,9 @@ def structured_format_forward(record):
             "caller": "ph",
             "version": "v1.0.9",
         }
+        # 关联ID作为独立的数字字段输出，watcher 可不解析 msg 直接按ID对账
+        if record["extra"].get("cid") is not None:
+            log_data["cid"] = record["extra"]["cid"]
 
         # 1. 序列化 JSON
         serialized = json.dumps(log_data, ensure_ascii=False)
@@ -39,9 +40,7 @@ def structured_format_forward(record):
     except Exception as e:
         # 兜底逻辑
         error_data = {
-            "ts": datetime.now(tz=timezone(timedelta(hours=8))).strftime(
-                "%Y-%m-%dT%H:%M:%S+08:00"
-            ),
+            "ts": datetime.now(tz=timezone(timedelta(hours=8))).isoformat(timespec="milliseconds"),
             "level": "ERROR",
             "msg": f"日志格式化异常: {str(e)} | 原消息: {record['message']}",
             "caller": "ph",
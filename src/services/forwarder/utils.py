@@ -1,10 +1,16 @@
+import itertools
 import random
 from datetime import datetime
+from typing import Optional
 
+# 关联ID低位的进程内序号位数，同一微秒内最多生成 4096 个不重复的ID
+CID_SEQUENCE_BITS = 12
+_cid_sequence = itertools.count()
 
-def generate_timestamp() -> str:
-    # 获取当前时间
-    current_time = datetime.now()
+
+def generate_timestamp(current_time: Optional[datetime] = None) -> str:
+    # 获取当前时间（可传入已读取的时间，与关联ID共用同一次时钟读取）
+    current_time = current_time or datetime.now()
 
     # 格式化为目标字符串
     current_timestamp = current_time.strftime("%Y%m%d%H%M%S%f")
@@ -15,3 +21,13 @@ def generate_timestamp() -> str:
 def generate_random_file_id() -> str:
     """生成8位随机数字ID"""
     return str(random.randint(0, 99999999)).zfill(8)
+
+
+def generate_correlation_id(current_time: datetime) -> int:
+    """
+    生成数字关联ID：文件名时间戳对应的 epoch 微秒数左移 CID_SEQUENCE_BITS 位，低位为进程内序号
+    watcher 可直接从ID中还原文件时间（cid >> CID_SEQUENCE_BITS），无需解析文件名；可用到 2041 年仍不超过 int64
+    :param current_time: 生成文件名时读取的时间
+    """
+    micros = int(current_time.replace(microsecond=0).timestamp()) * 1_000_000 + current_time.microsecond
+    return (micros << CID_SEQUENCE_BITS) | (next(_cid_sequence) & ((1 << CID_SEQUENCE_BITS) - 1))
@@ -6,6 +6,7 @@ to control transactions per second (TPS) when sending HTTP requests to a specifi
 
 Classes:
     TokenBucket: Implements a token bucket algorithm for rate limiting.
+    StepStats: Collects latency, error and timeout counts of one load step.
     LoadTester: Conducts load testing by sending HTTP requests at a controlled rate.
 
 Usage:
@@ -13,6 +14,11 @@ Usage:
     then run the script. It will create a LoadTester instance and start sending requests
     to the specified target URL at the defined TPS.
 
+    With APP_MODE=capacity the tester instead searches for the processor's capacity:
+    it raises the rate additively step by step, backs off multiplicatively when p99
+    latency, error rate or timeout rate cross their thresholds (APP_CAPACITY_*), and
+    reports the highest sustainable TPS together with the per-step latency curve.
+
 Dependencies:
     - asyncio: For asynchronous programming.
     - httpx: For making HTTP requests.
@@ -31,13 +37,16 @@ Note:
 """
 
 import asyncio
+import json
+import math
 import os
 import time
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, List, Optional
 
 import httpx
 from forwarder.log import logger
-from forwarder.utils import generate_timestamp, generate_random_file_id
+from forwarder.utils import generate_timestamp, generate_random_file_id, generate_correlation_id
 from public.models import Payload
 
 
@@ -57,6 +66,20 @@ class TokenBucket:
         self.last_update = time.monotonic()
         self._lock = asyncio.Lock()
 
+    def set_rate(self, rate: float, capacity: Optional[float] = None, drain: bool = False):
+        """
+        调整令牌生成速率，调整前按旧速率结算已生成的令牌
+        :param rate: 新的令牌生成速率
+        :param capacity: 新的桶容量，默认与速率相同（允许1秒内的突发）
+        :param drain: 是否清空已积累的令牌，避免以新速率开始时出现突发
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_update) * self.rate)
+        self.last_update = now
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = 0 if drain else min(self.tokens, self.capacity)
+
     async def acquire(self):
         """
         尝试获取令牌。如果桶空了，则异步等待直到有令牌可用。
@@ -82,6 +105,39 @@ class TokenBucket:
             await asyncio.sleep(wait_time)
 
 
+class StepStats:
+    """
+    一个负载阶梯内发出的请求的结果统计
+    """
+
+    def __init__(self, target_tps: float):
+        self.target_tps = target_tps
+        self.sent = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latencies: List[float] = []
+        self.started = time.monotonic()
+        self.finished = self.started
+
+    def percentile_ms(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return round(ordered[max(0, math.ceil(q * len(ordered)) - 1)] * 1000, 1)
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = max(self.finished - self.started, 1e-9)
+        sent = max(self.sent, 1)
+        return {
+            "target_tps": round(self.target_tps, 1),
+            "sent_tps": round(self.sent / elapsed, 1),
+            "p50_ms": self.percentile_ms(0.5),
+            "p99_ms": self.percentile_ms(0.99),
+            "error_rate": self.errors / sent,
+            "timeout_rate": self.timeouts / sent,
+        }
+
+
 class LoadTester:
     """
     Load testing utility for sending HTTP requests at a controlled rate.
@@ -105,7 +161,12 @@ class LoadTester:
         are properly awaited before closing the client connection.
     """
 
-    def __init__(self, target_url: str, tps: int):
+    def __init__(self, target_url: str, tps: int, max_tps: Optional[int] = None):
+        """
+        :param target_url: 请求的目标地址
+        :param tps: 目标 TPS（容量测试模式下为起始 TPS）
+        :param max_tps: 运行期间可能达到的最大 TPS，用于确定连接池大小，默认与 tps 相同
+        """
         self.target_url = target_url
         self.tps = tps
         # 初始化令牌桶，容量设为TPS相同，允许1秒内的突发，但在持续压力下会平滑到TPS
@@ -114,7 +175,8 @@ class LoadTester:
         # 优化 httpx 连接池配置
         # max_connections: 允许的最大并发连接数 (应大于 TPS 以防止连接耗尽)
         # max_keepalive_connections: 保持活跃的连接数
-        limits = httpx.Limits(max_keepalive_connections=tps, max_connections=tps * 2)
+        pool_tps = max(tps, max_tps or tps)
+        limits = httpx.Limits(max_keepalive_connections=pool_tps, max_connections=pool_tps * 2)
         self.client = httpx.AsyncClient(limits=limits, timeout=10.0)
 
         self.running = False
@@ -129,33 +191,131 @@ class LoadTester:
         """
         base_path = "/cacheproxy/proxy/map/tz01/log/"
 
+        # 文件名时间戳、关联ID和 ts 来自同一次时钟读取
+        now = datetime.now()
         file_path = (
-            f"{base_path}{generate_timestamp()}_tz01_{generate_random_file_id()}_.log"
+            f"{base_path}{generate_timestamp(now)}_tz01_{generate_random_file_id()}_.log"
         )
-        logger.info(f"Read {file_path}")
-        payload = Payload(ts=time.time(), file=file_path)
+        cid = generate_correlation_id(now)
+        logger.bind(cid=cid).info(f"Read {file_path}")
+        payload = Payload(ts=now.timestamp(), file=file_path, cid=cid)
         return payload
 
-    async def _send_request(self, payload: Dict[str, Any]):
+    async def _send_request(self, payload: Dict[str, Any], stats: Optional[StepStats] = None):
         """
         实际发送 HTTP 请求的 Worker。
+        :param stats: 容量测试模式下记录本请求结果的阶梯统计
         """
+        started = time.monotonic()
         try:
             # 发起 POST 请求
             # 这里的 await 只是等待网络IO，不会阻塞主循环的发送频率
-            await self.client.post(self.target_url, json=payload)
+            response = await self.client.post(self.target_url, json=payload)
 
             # 这里可以添加简单的日志，或者直接忽略
             # print(f"Status: {response.status_code}")
-
-        except (httpx.RequestError, httpx.HTTPError, asyncio.TimeoutError) as e:
+            if stats is not None:
+                stats.latencies.append(time.monotonic() - started)
+                if response.status_code >= 400:
+                    stats.errors += 1
+
+        except (httpx.TimeoutException, asyncio.TimeoutError) as e:
+            if stats is not None:
+                stats.timeouts += 1
+            else:
+                print(f"Request failed: {e}")
+        except (httpx.RequestError, httpx.HTTPError) as e:
             # 捕获网络异常，防止单个请求失败导致程序崩溃
-            print(f"Request failed: {e}")
+            if stats is not None:
+                stats.errors += 1
+            else:
+                print(f"Request failed: {e}")
         finally:
             # 任务完成后，从集合中移除自身引用（可选，用于清理）
 
             pass
 
+    def _dispatch(self, stats: Optional[StepStats] = None) -> asyncio.Task:
+        """
+        准备一个请求，写转发日志，并以 Fire-and-Forget 方式发送
+        """
+        payload = self.prepare_payload()
+        logger.bind(cid=payload.cid).info(f"Rename trigger hard link {payload.file} to process")
+        task = asyncio.create_task(self._send_request(payload.model_dump(), stats))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _run_step(self, rate: float, seconds: float) -> StepStats:
+        """
+        以固定速率发送一个阶梯的请求，并等待本阶梯的请求全部返回
+        """
+        # 阶梯之间等待请求返回时积累的令牌不计入新阶梯，保证实际发送速率接近目标
+        self.limiter.set_rate(rate, drain=True)
+        stats = StepStats(rate)
+        step_tasks = []
+        deadline = stats.started + seconds
+        while time.monotonic() < deadline:
+            await self.limiter.acquire()
+            step_tasks.append(self._dispatch(stats))
+            stats.sent += 1
+        stats.finished = time.monotonic()
+        await asyncio.gather(*step_tasks, return_exceptions=True)
+        return stats
+
+    async def search_capacity(self,
+                              step_tps: float,
+                              max_tps: float,
+                              step_seconds: float,
+                              backoff: float,
+                              max_backoffs: int,
+                              p99_ms: float,
+                              error_rate: float,
+                              timeout_rate: float) -> Dict[str, Any]:
+        """
+        AIMD 容量搜索：健康时 TPS 加性增加 step_tps，p99 延迟、错误率或超时率越过阈值时乘以 backoff 回退，
+        回退 max_backoffs 次或超过 max_tps 后结束。
+        发送端本身达不到目标速率（实际发送低于目标 90%）时提前结束，此时结果受限于压测端。
+        :return: 最高可持续 TPS（健康阶梯中实际发送速率的最大值）及每个阶梯的统计
+        """
+        print(f"Starting capacity search: Target={self.target_url}, start TPS={self.tps}, "
+              f"step +{step_tps}, backoff x{backoff}, thresholds p99<={p99_ms}ms "
+              f"errors<={error_rate:.2%} timeouts<={timeout_rate:.2%}")
+        rate = float(self.tps)
+        steps = []
+        best_tps = 0.0
+        backoffs = 0
+        client_limited = False
+        try:
+            while backoffs < max_backoffs and rate <= max_tps:
+                summary = (await self._run_step(rate, step_seconds)).summary()
+                p99 = summary["p99_ms"]
+                summary["healthy"] = (p99 is not None and p99 <= p99_ms
+                                      and summary["error_rate"] <= error_rate
+                                      and summary["timeout_rate"] <= timeout_rate)
+                steps.append(summary)
+                print(f"[capacity] target {summary['target_tps']} TPS, sent {summary['sent_tps']} TPS, "
+                      f"p50 {summary['p50_ms']}ms, p99 {p99}ms, errors {summary['error_rate']:.2%}, "
+                      f"timeouts {summary['timeout_rate']:.2%} -> "
+                      f"{'healthy' if summary['healthy'] else 'degraded'}")
+                if summary["sent_tps"] < 0.9 * rate:
+                    client_limited = True
+                    print("[capacity] Load generator cannot reach the target rate, stopping")
+                    break
+                if summary["healthy"]:
+                    best_tps = max(best_tps, summary["sent_tps"])
+                    rate += step_tps
+                else:
+                    backoffs += 1
+                    rate = max(float(self.tps), rate * backoff)
+        finally:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            await self.client.aclose()
+
+        result = {"max_sustainable_tps": best_tps, "client_limited": client_limited, "steps": steps}
+        print(f"Capacity search finished. Max sustainable TPS: {best_tps}")
+        return result
+
     async def start(self):
         """
         Start the load test and send requests at a controlled rate.
@@ -186,17 +346,10 @@ class LoadTester:
                 # 1. 获取令牌 (限流)
                 await self.limiter.acquire()
 
-                # 2. 准备数据
-                payload = self.prepare_payload()
-
-                # 3. Fire-and-Forget (并行发送)
+                # 2. 准备数据并 Fire-and-Forget (并行发送)
                 # create_task 会立即调度协程执行，不会阻塞当前循环
-                logger.info(f"Rename trigger hard link {payload.file} to process")
-                task = asyncio.create_task(self._send_request(payload.model_dump()))
-
-                # 保存任务引用以防被 Python GC 意外回收（针对极高并发场景的防御性编程）
-                self.tasks.add(task)
-                task.add_done_callback(self.tasks.discard)
+                # 任务引用保存在 self.tasks 中以防被 Python GC 意外回收（针对极高并发场景的防御性编程）
+                self._dispatch()
 
                 request_count += 1
 
@@ -222,8 +375,29 @@ if __name__ == "__main__":
     os.makedirs("/var/log/app", exist_ok=True)
     TARGET_URL = os.getenv("APP_PROCESSOR_URL", "http://app-processor:8000/receive")
     TARGET_TPS = int(os.getenv("APP_TPS", "10"))
-
-    tester = LoadTester(TARGET_URL, TARGET_TPS)
-
-    # 运行异步主程序
-    asyncio.run(tester.start())
+    # 运行模式：fixed 按 APP_TPS 持续发送；capacity 从 APP_TPS 起自动搜索处理服务的最大可持续 TPS
+    APP_MODE = os.getenv("APP_MODE", "fixed")
+
+    if APP_MODE == "capacity":
+        CAPACITY_MAX_TPS = int(os.getenv("APP_CAPACITY_MAX_TPS", "2000"))
+        tester = LoadTester(TARGET_URL, TARGET_TPS, max_tps=CAPACITY_MAX_TPS)
+        result = asyncio.run(tester.search_capacity(
+            step_tps=float(os.getenv("APP_CAPACITY_STEP_TPS", "10")),
+            max_tps=CAPACITY_MAX_TPS,
+            step_seconds=float(os.getenv("APP_CAPACITY_STEP_SECONDS", "30")),
+            backoff=float(os.getenv("APP_CAPACITY_BACKOFF", "0.7")),
+            max_backoffs=int(os.getenv("APP_CAPACITY_MAX_BACKOFFS", "3")),
+            p99_ms=float(os.getenv("APP_CAPACITY_P99_MS", "1000")),
+            error_rate=float(os.getenv("APP_CAPACITY_ERROR_RATE", "0.01")),
+            timeout_rate=float(os.getenv("APP_CAPACITY_TIMEOUT_RATE", "0.001")),
+        ))
+        # 结果（含每个阶梯的延迟曲线）写入日志目录，便于压测结束后查看
+        report_path = os.getenv("APP_CAPACITY_REPORT", "/var/log/app/capacity.json")
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Capacity report written to {report_path}")
+    else:
+        tester = LoadTester(TARGET_URL, TARGET_TPS)
+
+        # 运行异步主程序
+        asyncio.run(tester.start())
@@ -1,14 +1,15 @@
 import asyncio
+import json
 import uvicorn
-from fastapi import FastAPI
+from fastapi import Body, FastAPI, HTTPException
 from starlette.responses import Response
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
 from public.models import Payload
 import time
 from processor.log import logger
+from processor.simulation import Simulator
 import os
-import random
 
 
 # 全局计数器，用于统计接收到的请求数量
@@ -18,6 +19,15 @@ class RequestStats:
 
 stats = RequestStats()
 LOSS_RATE = float(os.getenv("APP_LOSS_RATE", "0.2"))
+# 延迟/失败模型配置（JSON，格式见 processor/simulation.py），缺省为 50~500ms 均匀延迟 + 按 LOSS_RATE 独立失败
+SIM_MODEL = os.getenv("APP_SIM_MODEL", "")
+
+simulator = Simulator.from_config({
+    "latency": {"type": "uniform", "min_ms": 50, "max_ms": 500},
+    "failure": {"type": "bernoulli", "rate": LOSS_RATE},
+})
+if SIM_MODEL:
+    simulator.configure(json.loads(SIM_MODEL))
 
 
 async def monitor_tps():
@@ -66,15 +76,41 @@ async def receive_data(payload: Payload) -> Response:
 
     # 3. 模拟业务处理
     file_name = payload.file
-    duration_ms = random.randint(50, 500)
-    await asyncio.sleep(duration_ms / 1000.0)
+    duration_ms = simulator.begin()
+    try:
+        await asyncio.sleep(duration_ms / 1000.0)
+    finally:
+        failed = simulator.end()
+    # 关联ID以 cid=<数字> 的形式追加在行尾，watcher 可不解析文件路径直接按ID对账
+    cid_suffix = f" cid={payload.cid}" if payload.cid is not None else ""
     logger.info(
-        f"处理文件filePath={file_name}{"成功" if random.random() >= LOSS_RATE else "失败"}，耗时{duration_ms}毫秒"
+        f"处理文件filePath={file_name}{"失败" if failed else "成功"}，耗时{duration_ms}毫秒{cid_suffix}"
     )
     # 4. 快速返回，不阻塞客户端
     return Response(status_code=200)
 
 
+@app.get("/admin/model")
+async def get_model() -> dict:
+    """
+    查询当前的延迟/失败模型及在途请求数
+    """
+    return simulator.describe()
+
+
+@app.put("/admin/model")
+async def put_model(config: dict = Body(...)) -> dict:
+    """
+    运行时替换延迟/失败模型，只给出 latency 或 failure 时另一个保持不变
+    """
+    try:
+        simulator.configure(config)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    print(f"⚙️ [Server] 模型已更新: {simulator.describe()}")
+    return simulator.describe()
+
+
 if __name__ == "__main__":
     # 使用 uvicorn 启动服务
     # log_level="warning" 可以减少控制台日志输出，提高性能测试时的观察体验
@@ -0,0 +1,235 @@
+"""
+Pluggable latency and failure models of the processor simulator.
+
+延迟模型（毫秒）：
+- uniform:   min_ms ~ max_ms 均匀分布（默认 50~500，与原实现一致）
+- lognormal: 中位数 median_ms、对数标准差 sigma 的对数正态分布，右侧长尾
+- pareto:    最小值 scale_ms、形状参数 alpha 的帕累托分布，alpha 越小尾部越重（alpha <= 2 时方差无穷）
+以上模型都可叠加负载相关项：在途请求数超过 load_knee 后，延迟按超出比例线性增长
+
+失败模型：
+- bernoulli: 每个请求以固定概率 rate 失败（默认 APP_LOSS_RATE，与原实现一致）
+- markov:    两状态马尔可夫调制（Gilbert-Elliott）：正常状态失败率 good_rate，故障状态失败率 bad_rate，
+             每个请求后按 p_enter_bad / p_exit_bad 切换状态，故障期平均持续 1 / p_exit_bad 个请求
+
+配置格式（GET/PUT /admin/model 以及环境变量 APP_SIM_MODEL 使用同一格式）：
+    {"latency": {"type": "lognormal", "median_ms": 120, "sigma": 0.8, "cap_ms": 30000, "load_knee": 100},
+     "failure": {"type": "markov", "good_rate": 0.01, "bad_rate": 0.5, "p_enter_bad": 0.001, "p_exit_bad": 0.02}}
+"""
+
+import abc
+import math
+import random
+from typing import Any, Dict, Optional
+
+
+def _number(params: Dict[str, Any], name: str, default: float, minimum: float = 0.0,
+            maximum: float = math.inf) -> float:
+    """
+    读取并校验数值参数，不合法时抛出 ValueError
+    """
+    value = params.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not minimum <= value <= maximum:
+        raise ValueError(f"{name} must be a number in [{minimum}, {maximum}], got {value!r}")
+    return float(value)
+
+
+class LatencyModel(abc.ABC):
+    """
+    延迟模型基类：sample() 返回基础延迟，delay_ms() 叠加负载项并截断到 cap_ms
+    """
+    name = ""
+
+    def __init__(self, params: Dict[str, Any]):
+        """
+        :param params: 模型参数，公共参数 cap_ms（延迟上限，避免重尾分布产生过长的请求）和
+                       load_knee（在途请求数的拐点，0 表示延迟与负载无关）
+        """
+        self.cap_ms = _number(params, "cap_ms", 30000, minimum=1)
+        self.load_knee = _number(params, "load_knee", 0)
+
+    @abc.abstractmethod
+    def sample(self, rng: random.Random) -> float:
+        """
+        采样一次基础延迟（毫秒），不含负载项和上限截断
+        """
+
+    def delay_ms(self, rng: random.Random, in_flight: int) -> int:
+        """
+        :param in_flight: 包含当前请求在内的在途请求数
+        """
+        delay = self.sample(rng)
+        if self.load_knee and in_flight > self.load_knee:
+            delay *= in_flight / self.load_knee
+        return int(round(min(delay, self.cap_ms)))
+
+    def describe(self) -> Dict[str, Any]:
+        return {"type": self.name, "cap_ms": self.cap_ms, "load_knee": self.load_knee}
+
+
+class UniformLatency(LatencyModel):
+    name = "uniform"
+
+    def __init__(self, params: Dict[str, Any]):
+        super().__init__(params)
+        self.min_ms = _number(params, "min_ms", 50)
+        self.max_ms = _number(params, "max_ms", 500, minimum=self.min_ms)
+
+    def sample(self, rng: random.Random) -> float:
+        return rng.uniform(self.min_ms, self.max_ms)
+
+    def describe(self) -> Dict[str, Any]:
+        return {**super().describe(), "min_ms": self.min_ms, "max_ms": self.max_ms}
+
+
+class LogNormalLatency(LatencyModel):
+    name = "lognormal"
+
+    def __init__(self, params: Dict[str, Any]):
+        super().__init__(params)
+        self.median_ms = _number(params, "median_ms", 150, minimum=1e-3)
+        self.sigma = _number(params, "sigma", 0.6, maximum=5)
+
+    def sample(self, rng: random.Random) -> float:
+        return rng.lognormvariate(math.log(self.median_ms), self.sigma)
+
+    def describe(self) -> Dict[str, Any]:
+        return {**super().describe(), "median_ms": self.median_ms, "sigma": self.sigma}
+
+
+class ParetoLatency(LatencyModel):
+    name = "pareto"
+
+    def __init__(self, params: Dict[str, Any]):
+        super().__init__(params)
+        self.scale_ms = _number(params, "scale_ms", 50, minimum=1e-3)
+        self.alpha = _number(params, "alpha", 2.0, minimum=0.1)
+
+    def sample(self, rng: random.Random) -> float:
+        return self.scale_ms * rng.paretovariate(self.alpha)
+
+    def describe(self) -> Dict[str, Any]:
+        return {**super().describe(), "scale_ms": self.scale_ms, "alpha": self.alpha}
+
+
+class FailureModel(abc.ABC):
+    """
+    失败模型基类：failed() 决定当前请求是否处理失败
+    """
+    name = ""
+
+    @abc.abstractmethod
+    def failed(self, rng: random.Random) -> bool:
+        """
+        决定当前请求是否失败，有状态的模型同时推进状态
+        """
+
+    def describe(self) -> Dict[str, Any]:
+        return {"type": self.name}
+
+
+class BernoulliFailure(FailureModel):
+    name = "bernoulli"
+
+    def __init__(self, params: Dict[str, Any]):
+        self.rate = _number(params, "rate", 0.2, maximum=1)
+
+    def failed(self, rng: random.Random) -> bool:
+        return rng.random() < self.rate
+
+    def describe(self) -> Dict[str, Any]:
+        return {**super().describe(), "rate": self.rate}
+
+
+class MarkovFailure(FailureModel):
+    name = "markov"
+
+    def __init__(self, params: Dict[str, Any]):
+        self.good_rate = _number(params, "good_rate", 0.01, maximum=1)
+        self.bad_rate = _number(params, "bad_rate", 0.5, maximum=1)
+        self.p_enter_bad = _number(params, "p_enter_bad", 0.001, maximum=1)
+        self.p_exit_bad = _number(params, "p_exit_bad", 0.02, maximum=1)
+        self.bad = False
+
+    def failed(self, rng: random.Random) -> bool:
+        failed = rng.random() < (self.bad_rate if self.bad else self.good_rate)
+        if rng.random() < (self.p_exit_bad if self.bad else self.p_enter_bad):
+            self.bad = not self.bad
+        return failed
+
+    def stationary_rate(self) -> float:
+        """
+        长期平均失败率
+        """
+        total = self.p_enter_bad + self.p_exit_bad
+        bad_share = self.p_enter_bad / total if total else float(self.bad)
+        return bad_share * self.bad_rate + (1 - bad_share) * self.good_rate
+
+    def describe(self) -> Dict[str, Any]:
+        return {**super().describe(), "good_rate": self.good_rate, "bad_rate": self.bad_rate,
+                "p_enter_bad": self.p_enter_bad, "p_exit_bad": self.p_exit_bad,
+                "state": "bad" if self.bad else "good", "stationary_rate": self.stationary_rate()}
+
+
+LATENCY_MODELS = {model.name: model for model in (UniformLatency, LogNormalLatency, ParetoLatency)}
+FAILURE_MODELS = {model.name: model for model in (BernoulliFailure, MarkovFailure)}
+
+
+def _build(registry: Dict[str, type], kind: str, params: Dict[str, Any]):
+    if not isinstance(params, dict):
+        raise ValueError(f"{kind} must be an object")
+    model = registry.get(params.get("type"))
+    if model is None:
+        raise ValueError(f"{kind}.type must be one of {sorted(registry)}, got {params.get('type')!r}")
+    return model(params)
+
+
+class Simulator:
+    """
+    处理服务的模拟器：持有当前的延迟/失败模型和在途请求数，模型可在运行时整体替换
+    """
+
+    def __init__(self, latency: LatencyModel, failure: FailureModel, seed: Optional[int] = None):
+        self.latency = latency
+        self.failure = failure
+        self.rng = random.Random(seed)
+        self.in_flight = 0
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], seed: Optional[int] = None) -> "Simulator":
+        """
+        :param config: {"latency": {...}, "failure": {...}}，缺省的部分使用 uniform / bernoulli 的默认参数
+        """
+        if not isinstance(config, dict):
+            raise ValueError("model config must be an object")
+        latency = _build(LATENCY_MODELS, "latency", config.get("latency", {"type": "uniform"}))
+        failure = _build(FAILURE_MODELS, "failure", config.get("failure", {"type": "bernoulli"}))
+        return cls(latency, failure, seed)
+
+    def configure(self, config: Dict[str, Any]):
+        """
+        校验并替换模型，只给出 latency 或 failure 时另一个保持不变；参数不合法时抛出 ValueError，当前模型不变
+        """
+        if not isinstance(config, dict):
+            raise ValueError("model config must be an object")
+        latency = _build(LATENCY_MODELS, "latency", config["latency"]) if "latency" in config else self.latency
+        failure = _build(FAILURE_MODELS, "failure", config["failure"]) if "failure" in config else self.failure
+        self.latency, self.failure = latency, failure
+
+    def begin(self) -> int:
+        """
+        请求开始：在途数加一并返回本次请求的延迟（毫秒）
+        """
+        self.in_flight += 1
+        return self.latency.delay_ms(self.rng, self.in_flight)
+
+    def end(self) -> bool:
+        """
+        请求结束：在途数减一并返回本次请求是否失败
+        """
+        self.in_flight -= 1
+        return self.failure.failed(self.rng)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"latency": self.latency.describe(), "failure": self.failure.describe(),
+                "in_flight": self.in_flight}
@@ -1,6 +1,11 @@
+from typing import Optional
+
 from pydantic import BaseModel, Field
 
 
 class Payload(BaseModel):
     ts: float = Field(..., description="Timestamp of the payload")
     file: str = Field(..., description="Path to the log file")
+    cid: Optional[int] = Field(
+        None, description="Correlation ID: epoch microseconds of the file name timestamp << 12 | sequence"
+    )
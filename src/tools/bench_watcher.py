@@ -0,0 +1,168 @@
+"""
+Scalability benchmark of the watcher's run_audit against the local Loki stand-in and an SQLite DAO.
+
+每个规模启动一个 loki_stub 子进程（合成数据不计入 watcher 的内存），然后对同一个窗口：
+1. 计时运行 run_audit 并同步写入 SQLite，记录墙钟时间和各阶段 CPU 时间（来自 log_audit_phase_cpu_seconds_total）
+2. 在 tracemalloc 下再运行一次，记录 Python 内存峰值（tracemalloc 会拖慢运行，因此不与计时混在一起）
+
+用法：
+    python src/tools/bench_watcher.py                          # 10k / 100k / 1M，exact 模式
+    python src/tools/bench_watcher.py --sizes 10000,100000 --modes exact,partitioned --join-keys file,cid --json bench.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from urllib.request import urlopen
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TOOLS_DIR), "watcher"))
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import main as watcher  # noqa: E402
+from dao import Base  # noqa: E402
+from metrics import COUNTER_PHASE_CPU  # noqa: E402
+from persistence import ReportWriter  # noqa: E402
+from pipelines import Pipeline  # noqa: E402
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub(files: int, window_start: float, window_seconds: int, loss: float):
+    """
+    启动 loki_stub 子进程并等待就绪
+    :return: (子进程, 地址)
+    """
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(TOOLS_DIR, "loki_stub.py"), "--port", str(port),
+         "--files", str(files), "--window-start", str(window_start),
+         "--window-seconds", str(window_seconds), "--loss", str(loss)],
+        stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"loki_stub exited with code {process.returncode}")
+        try:
+            with urlopen(f"{url}/ready", timeout=1):
+                return process, url
+        except OSError:
+            time.sleep(0.2)
+
+
+def phase_cpu(pipeline: str) -> dict:
+    """
+    读取一条流水线各阶段累计的 CPU 时间
+    """
+    cpu = {}
+    for metric in COUNTER_PHASE_CPU.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_total") and sample.labels["pipeline"] == pipeline:
+                cpu[sample.labels["phase"]] = sample.value
+    return cpu
+
+
+def run_case(files: int, mode: str, join_key: str, loss: float, window_seconds: int, measure_memory: bool,
+             workdir: str) -> dict:
+    window_start = (time.time() // window_seconds - 2) * window_seconds
+    window_start_dt = datetime.fromtimestamp(window_start)
+    window_end_dt = datetime.fromtimestamp(window_start + window_seconds)
+    process, url = start_stub(files, window_start, window_seconds, loss)
+    try:
+        watcher.LOKI_URL = url
+        watcher.RECONCILE_MODE = mode
+        case = f"bench-{files}-{mode}-{join_key}"
+        engine = create_engine(f"sqlite:///{workdir}/{case}.db")
+        Base.metadata.create_all(engine)
+        writer = ReportWriter(sessionmaker(bind=engine), spool_path=f"{workdir}/{case}.spool.jsonl",
+                              dead_letter_path=f"{workdir}/{case}.dead_letter.jsonl")
+
+        pipeline = Pipeline(name=case, join_key=join_key)
+        cpu_before = phase_cpu(pipeline.name)
+        started = time.perf_counter()
+        watcher.run_audit(writer, pipeline, window_start_dt, window_end_dt)
+        audit_seconds = time.perf_counter() - started
+        persist_started = time.perf_counter()
+        if not writer.write_pending():
+            raise RuntimeError("Failed to write the report to SQLite")
+        persist_seconds = time.perf_counter() - persist_started
+        cpu = {phase: value - cpu_before.get(phase, 0.0)
+               for phase, value in phase_cpu(pipeline.name).items()}
+
+        peak_mb = None
+        if measure_memory:
+            tracemalloc.start()
+            watcher.run_audit(writer, pipeline, window_start_dt, window_end_dt)
+            writer.write_pending()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+        engine.dispose()
+    finally:
+        process.terminate()
+        process.wait()
+
+    return {
+        "files": files,
+        "mode": mode,
+        "join_key": join_key,
+        "audit_seconds": round(audit_seconds, 3),
+        "persist_seconds": round(persist_seconds, 3),
+        "phase_cpu_seconds": {phase: round(value, 3) for phase, value in sorted(cpu.items())},
+        "peak_memory_mb": None if peak_mb is None else round(peak_mb, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma separated files per window")
+    parser.add_argument("--modes", default="exact", help="comma separated RECONCILE_MODE values")
+    parser.add_argument("--join-keys", default="file", help="comma separated pipeline join_key values")
+    parser.add_argument("--partition-keys", type=int,
+                        help="RECONCILE_PARTITION_KEYS of the partitioned mode (keys kept in memory per pass)")
+    parser.add_argument("--loss", type=float, default=0.01)
+    parser.add_argument("--window-seconds", type=int, default=300)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the watcher's INFO logs")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    if args.partition_keys:
+        watcher.RECONCILE_PARTITION_KEYS = args.partition_keys
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for files in (int(size) for size in args.sizes.split(",")):
+            for mode in args.modes.split(","):
+                for join_key in args.join_keys.split(","):
+                    result = run_case(files, mode, join_key, args.loss, args.window_seconds,
+                                      not args.no_memory, workdir)
+                    results.append(result)
+                    phases = " ".join(f"{phase}={value:.2f}"
+                                      for phase, value in result["phase_cpu_seconds"].items())
+                    print(f"{files:>9} files  {mode:<11} {join_key:<4}  audit {result['audit_seconds']:8.2f}s  "
+                          f"persist {result['persist_seconds']:6.2f}s  peak {result['peak_memory_mb']} MB  "
+                          f"cpu[{phases}]", flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
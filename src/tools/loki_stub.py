@@ -0,0 +1,236 @@
+"""
+Local stand-in for Loki's query_range API, serving synthetic or recorded forward/process streams.
+
+合成数据与真实服务的日志格式一致：
+- forward_svc: {"ts": "...", "level": "INFO", "msg": "Rename trigger hard link <path> to process", ..., "cid": <关联ID>}
+- process_svc: 2026-01-28 10:16:47.964 [Log-Producer] INFO  ... - 处理文件filePath=<path>成功，耗时123毫秒 cid=<关联ID>
+
+用法：
+    # 合成 100k 文件、1% 丢失的窗口，窗口开始时间默认为当前时间对齐到 5 分钟前
+    python src/tools/loki_stub.py --files 100000 --loss 0.01 --port 3100
+    # 回放录制的数据，每行 {"service": "forward_svc", "ts": 纳秒时间戳, "line": "..."}
+    python src/tools/loki_stub.py --fixture recorded.jsonl --port 3100
+然后把 watcher 的 LOKI_URL 指向 http://127.0.0.1:3100
+"""
+
+import argparse
+import bisect
+import json
+import random
+import re
+import time
+from array import array
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+FORWARD_SERVICE = "forward_svc"
+PROCESS_SERVICE = "process_svc"
+BASE_PATH = "/cacheproxy/proxy/map/tz01/log/"
+# 与 forwarder.utils.CID_SEQUENCE_BITS 一致
+CID_SEQUENCE_BITS = 12
+
+_SELECTOR_PATTERN = re.compile(r'service="([^"]+)"')
+_LINE_FILTER_PATTERN = re.compile(r'\|=\s*"([^"]*)"')
+
+
+class LogStream:
+    """
+    按时间戳升序排列的一条日志流，日志行在查询时才生成，百万级文件也只占用几十MB
+    """
+
+    def __init__(self, timestamps: array, render: Callable[[int], str]):
+        """
+        :param timestamps: 升序的纳秒时间戳
+        :param render: 根据下标生成日志行
+        """
+        self.timestamps = timestamps
+        self.render = render
+
+    def query(self, start_ns: int, end_ns: int, limit: int, line_filters: List[str],
+              backward: bool = False) -> List[List[str]]:
+        """
+        返回 [start_ns, end_ns) 内包含全部过滤关键字的日志行，最多 limit 条
+        """
+        lo = bisect.bisect_left(self.timestamps, start_ns)
+        hi = bisect.bisect_left(self.timestamps, end_ns)
+        indexes = range(hi - 1, lo - 1, -1) if backward else range(lo, hi)
+        values = []
+        for i in indexes:
+            line = self.render(i)
+            if all(keyword in line for keyword in line_filters):
+                values.append([str(self.timestamps[i]), line])
+                if len(values) >= limit:
+                    break
+        return values
+
+
+def _file_name(file_us: int, file_id: int) -> str:
+    file_time = datetime.fromtimestamp(file_us // 1_000_000).replace(microsecond=file_us % 1_000_000)
+    return f"{file_time.strftime('%Y%m%d%H%M%S%f')}_tz01_{file_id:08d}_.log"
+
+
+def _forward_line(ts_ns: int, file_name: str, cid: int) -> str:
+    return json.dumps({
+        "ts": datetime.fromtimestamp(ts_ns / 1e9).astimezone().isoformat(timespec="milliseconds"),
+        "level": "INFO",
+        "msg": f"Rename trigger hard link {BASE_PATH}{file_name} to process",
+        "caller": "ph",
+        "version": "v1.0.9",
+        "cid": cid,
+    }, ensure_ascii=False)
+
+
+def _process_line(ts_ns: int, file_name: str, delay_ms: int, ok: bool, cid: int) -> str:
+    ts = datetime.fromtimestamp(ts_ns / 1e9).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    return (f"{ts} [Log-Producer] INFO  com.bigdata.tz.monitor.LogMonitor - "
+            f"处理文件filePath={BASE_PATH}{file_name}{'成功' if ok else '失败'}，耗时{delay_ms}毫秒 cid={cid}")
+
+
+def synthesize_streams(files: int, window_start: float, window_seconds: float = 300,
+                       loss_rate: float = 0.01, min_delay_ms: int = 50, max_delay_ms: int = 500,
+                       seed: int = 0) -> Dict[str, LogStream]:
+    """
+    生成一个窗口内均匀分布的 files 个文件的转发/处理日志，按 loss_rate 生成处理失败的文件
+    :return: 服务名 -> 日志流
+    """
+    rng = random.Random(seed)
+    step_us = window_seconds * 1_000_000 / files
+    start_us = int(window_start * 1_000_000)
+    file_us = array("q", (start_us + int(i * step_us) for i in range(files)))
+    file_ids = array("l", (rng.randint(0, 99999999) for _ in range(files)))
+    delays = array("l", (rng.randint(min_delay_ms, max_delay_ms) for _ in range(files)))
+    failed = bytearray(rng.random() < loss_rate for _ in range(files))
+
+    # 转发日志与文件名时间戳取自同一次时钟读取
+    forward_ts = array("q", (us * 1000 for us in file_us))
+    # 处理日志按处理完成时间排序
+    process_order = sorted(range(files), key=lambda i: forward_ts[i] + delays[i] * 1_000_000)
+    process_ts = array("q", (forward_ts[i] + delays[i] * 1_000_000 for i in process_order))
+    process_index = array("l", process_order)
+
+    def cid_of(i: int) -> int:
+        return (file_us[i] << CID_SEQUENCE_BITS) | (i & ((1 << CID_SEQUENCE_BITS) - 1))
+
+    def render_forward(i: int) -> str:
+        return _forward_line(forward_ts[i], _file_name(file_us[i], file_ids[i]), cid_of(i))
+
+    def render_process(j: int) -> str:
+        i = process_index[j]
+        return _process_line(process_ts[j], _file_name(file_us[i], file_ids[i]), delays[i],
+                             not failed[i], cid_of(i))
+
+    return {
+        FORWARD_SERVICE: LogStream(forward_ts, render_forward),
+        PROCESS_SERVICE: LogStream(process_ts, render_process),
+    }
+
+
+def load_fixture(path: str) -> Dict[str, LogStream]:
+    """
+    加载录制的日志，每行 {"service": "...", "ts": 纳秒时间戳, "line": "..."}
+    """
+    records: Dict[str, list] = {}
+    with open(path, encoding="utf-8") as f:
+        for raw in f:
+            if raw.strip():
+                record = json.loads(raw)
+                records.setdefault(record["service"], []).append((int(record["ts"]), record["line"]))
+    streams = {}
+    for service, entries in records.items():
+        entries.sort()
+        lines = [line for _, line in entries]
+        streams[service] = LogStream(array("q", (ts for ts, _ in entries)), lines.__getitem__)
+    return streams
+
+
+class LokiStub:
+    """
+    提供 /loki/api/v1/query_range 和 /ready 的 HTTP 服务
+    只支持 {service="..."} 选择器和 |= 行过滤，足以覆盖 watcher 的查询
+    """
+
+    def __init__(self, streams: Dict[str, LogStream]):
+        self.streams = streams
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    def query_range(self, query: str, start_ns: int, end_ns: int, limit: int,
+                    direction: str = "FORWARD") -> dict:
+        selector = _SELECTOR_PATTERN.search(query)
+        stream = self.streams.get(selector.group(1)) if selector else None
+        result = []
+        if stream is not None:
+            values = stream.query(start_ns, end_ns, limit, _LINE_FILTER_PATTERN.findall(query),
+                                  backward=direction.upper() == "BACKWARD")
+            if values:
+                result.append({"stream": {"service": selector.group(1)}, "values": values})
+        return {"status": "success", "data": {"resultType": "streams", "result": result}}
+
+    def serve(self, host: str = "127.0.0.1", port: int = 3100):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/ready":
+                    return self._reply(200, b"ready")
+                if url.path != "/loki/api/v1/query_range":
+                    return self._reply(404, b"not found")
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                now_ns = time.time_ns()
+                body = stub.query_range(
+                    params.get("query", ""),
+                    int(params.get("start", now_ns - 3600 * 10 ** 9)),
+                    int(params.get("end", now_ns)),
+                    int(params.get("limit", 100)),
+                    params.get("direction", "BACKWARD"),
+                )
+                self._reply(200, json.dumps(body, ensure_ascii=False).encode("utf-8"),
+                            "application/json")
+
+            def _reply(self, status: int, body: bytes, content_type: str = "text/plain"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3100)
+    parser.add_argument("--fixture", help="recorded JSON Lines file instead of synthetic data")
+    parser.add_argument("--files", type=int, default=10000, help="files per window")
+    parser.add_argument("--window-start", type=float,
+                        help="unix timestamp of the window start (default: 2 windows ago, aligned)")
+    parser.add_argument("--window-seconds", type=float, default=300)
+    parser.add_argument("--loss", type=float, default=0.01, help="fraction of files that fail processing")
+    parser.add_argument("--min-delay-ms", type=int, default=50)
+    parser.add_argument("--max-delay-ms", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.fixture:
+        streams = load_fixture(args.fixture)
+    else:
+        window_start = args.window_start
+        if window_start is None:
+            window_start = (time.time() // args.window_seconds - 2) * args.window_seconds
+        streams = synthesize_streams(args.files, window_start, args.window_seconds, args.loss,
+                                     args.min_delay_ms, args.max_delay_ms, args.seed)
+    print(f"Loki stub listening on http://{args.host}:{args.port} "
+          f"({', '.join(f'{name}: {len(s.timestamps)} lines' for name, s in streams.items())})",
+          flush=True)
+    LokiStub(streams).serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
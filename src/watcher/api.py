@@ -0,0 +1,170 @@
+"""
+HTTP server of the watcher: serves Prometheus metrics and the lost-file lookup API on the same port.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from http.server import ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from prometheus_client import MetricsHandler
+from sqlalchemy.orm import Session
+
+from dao import WatcherDao
+
+# 热点查询结果缓存：条目数上限与过期时间
+LOOKUP_CACHE_SIZE = int(os.getenv("LOOKUP_CACHE_SIZE", "1024"))
+LOOKUP_CACHE_TTL_SECONDS = float(os.getenv("LOOKUP_CACHE_TTL_SECONDS", "30"))
+# 单次查询返回条数上限
+LOOKUP_MAX_LIMIT = int(os.getenv("LOOKUP_MAX_LIMIT", "1000"))
+
+logger = logging.getLogger(__name__)
+
+
+class LookupCache:
+    """
+    线程安全的 LRU + TTL 缓存，用于保存热点查询结果
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        """
+        :param max_size: 最多缓存的查询条目数
+        :param ttl_seconds: 条目过期时间（秒），过期后重新查库
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._items: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Tuple, value: Any):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+def _to_local_naive(value: datetime) -> datetime:
+    """
+    带时区的时间转换为本地时间并去掉时区，与 lost_files.file_ts（文件名中的本地时间）可比较
+    """
+    if value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+class WatcherRequestHandler(MetricsHandler):
+    """
+    在 Prometheus MetricsHandler 基础上增加丢失文件查询接口：
+        GET /lost_files?name=<file_name>
+        GET /lost_files?start=<ISO时间>&end=<ISO时间>&limit=<条数>
+    其余路径保持原有的 metrics 输出
+    """
+
+    session_factory: Optional[Callable[[], Session]] = None
+    cache = LookupCache(LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL_SECONDS)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/lost_files":
+            super().do_GET()
+            return
+
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            key = self._parse_lookup(params)
+        except (TypeError, ValueError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        if self.session_factory is None:
+            self._send_json(503, {"error": "database not ready"})
+            return
+
+        items = self.cache.get(key)
+        if items is None:
+            try:
+                items = self._lookup(*key)
+            except Exception:
+                # 查询失败不能当作"没有丢失文件"返回，也不缓存
+                logger.exception(f"Lost file lookup {key} failed")
+                self._send_json(503, {"error": "database unavailable"})
+                return
+            self.cache.put(key, items)
+        self._send_json(200, {"count": len(items), "items": items})
+
+    @staticmethod
+    def _parse_lookup(params: Dict[str, str]) -> Tuple:
+        """
+        校验查询参数，返回 (name, start, end, limit) 作为查询和缓存的键
+        """
+        limit = int(params.get("limit", "100"))
+        if not 0 < limit <= LOOKUP_MAX_LIMIT:
+            raise ValueError(f"limit must be in (0, {LOOKUP_MAX_LIMIT}]")
+        name = params.get("name")
+        if name:
+            return name, None, None, limit
+        if "start" not in params or "end" not in params:
+            raise ValueError("either name or both start and end are required")
+        start = _to_local_naive(datetime.fromisoformat(params["start"]))
+        end = _to_local_naive(datetime.fromisoformat(params["end"]))
+        if start >= end:
+            raise ValueError("start must be earlier than end")
+        return None, start, end, limit
+
+    def _lookup(self, name, start, end, limit):
+        # HTTP 线程与审计循环不共享 Session，每次查询使用独立的短生命周期 Session
+        db_session = self.session_factory()
+        try:
+            return WatcherDao(db_session).find_lost_files(
+                file_name=name, start=start, end=end, limit=limit)
+        finally:
+            db_session.close()
+
+    def _send_json(self, status: int, body: Dict[str, Any]):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # 避免 Prometheus 抓取请求刷屏
+        return
+
+
+def start_api_server(port: int) -> ThreadingHTTPServer:
+    """
+    在后台线程中启动 metrics + 查询接口服务
+    :param port: 监听端口
+    :return: HTTP server 对象
+    """
+    server = ThreadingHTTPServer(("0.0.0.0", port), WatcherRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def set_session_factory(session_factory: Callable[[], Session]):
+    """
+    数据库就绪后注册 Session 工厂，此前查询接口返回 503
+    """
+    WatcherRequestHandler.session_factory = staticmethod(session_factory)
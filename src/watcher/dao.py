@@ -2,12 +2,20 @@
 Codes to connect and operate on the database.
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, text, ForeignKey, DateTime, func, CHAR, desc
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, text, ForeignKey, DateTime, func, CHAR, desc, Index
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship, Session, joinedload
 from sqlalchemy.exc import SQLAlchemyError
-from typing import List, Optional, Dict, Any
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Set, Tuple
+import re
 import uuid
 import logging
+
+# 文件名示例: 20260128101647964993_tz01_91458258_.log
+# 提取文件名中的时间戳 (前14位: YYYYMMDDHHmmss) 与随机文件ID，作为 lost_files 的索引列
+LOST_FILE_NAME_PATTERN = re.compile(r"^(\d{14})\d*_[^_]+_(\d+)_")
+# file_id 列为 BIGINT，超出范围的文件ID存为空，避免整条报告因 DataError 写入失败
+MAX_FILE_ID = 2 ** 63 - 1
 # Models to define database tables
 
 Base = declarative_base()
@@ -19,6 +27,8 @@ class Reports(Base):
     The delaration of the Reports table in the database.
     Schema:
     report_data = {
+        "pipeline": pipeline.name,
+        "shard": pipeline.shard,
         "audit_window_start": window_start_dt.isoformat(),
         "audit_window_end": window_end_dt.isoformat(),
         "forward_count": len(forward_files),
@@ -36,10 +46,14 @@ class Reports(Base):
     id = Column(
         CHAR(36),
         primary_key=True,
-        default=lambda: uuid.uuid4(),  # 自动生成唯一UUID4（随机UUID，无业务含义，推荐）
+        default=lambda: str(uuid.uuid4()),  # 自动生成唯一UUID4（随机UUID，无业务含义，推荐）
         comment="Primary Key of the report (UUID format)"
     )
 
+    pipeline = Column(String(64), nullable=False, default="default", index=True,
+                      comment="Name of the audited forward/process pipeline")
+    shard = Column(String(64), nullable=True,
+                   comment="Shard/zone tag of the pipeline")
     audit_window_start = Column(
         String(50), nullable=False, comment="Audit window start time in ISO format")
     audit_window_end = Column(
@@ -50,6 +64,18 @@ class Reports(Base):
                            comment="Number of processed files")
     lost_count = Column(Integer, nullable=False,
                         comment="Number of lost files")
+    # 转发到处理的端到端延迟分位数（毫秒），窗口内无匹配文件时为空
+    latency_p50_ms = Column(Integer, nullable=True,
+                            comment="p50 forward-to-process delay in milliseconds")
+    latency_p90_ms = Column(Integer, nullable=True,
+                            comment="p90 forward-to-process delay in milliseconds")
+    latency_p99_ms = Column(Integer, nullable=True,
+                            comment="p99 forward-to-process delay in milliseconds")
+    latency_max_ms = Column(Integer, nullable=True,
+                            comment="Max forward-to-process delay in milliseconds")
+    # 按天分桶（YYYYMMDD），保留策略按桶批量清理
+    bucket = Column(Integer, nullable=True, index=True,
+                    comment="Daily bucket (YYYYMMDD) of the audit window start")
     # A list of foreign key to table lost_files and point to the id column of it
     lost_files = relationship(
         "LostFiles", back_populates="report", lazy="dynamic")
@@ -66,7 +92,7 @@ class LostFiles(Base):
     id = Column(
         CHAR(36),
         primary_key=True,
-        default=lambda: uuid.uuid4(),  # 自动生成唯一UUID4（随机UUID，无业务含义，推荐）
+        default=lambda: str(uuid.uuid4()),  # 自动生成唯一UUID4（随机UUID，无业务含义，推荐）
         comment="Primary Key of the lost file record (UUID format)"
     )
 
@@ -82,9 +108,19 @@ class LostFiles(Base):
 
     # 3. 丢失文件的核心业务字段（根据你的业务补充，必备且实用）
 
-    file_name = Column(String(100), nullable=False,
+    # 文件名无法解析出 file_ts 时（cid=<n> 形式的名称、其他 filename_pattern 的文件名）按文件名索引查询
+    file_name = Column(String(100), nullable=False, index=True,
                        comment="Base name of the lost file")
 
+    # 从文件名中解析出的时间戳和文件ID，用于按文件名/时间范围的索引查询
+    file_ts = Column(DateTime, nullable=True,
+                     comment="Timestamp embedded in the file name (second precision)")
+    file_id = Column(BigInteger, nullable=True,
+                     comment="Numeric file ID embedded in the file name")
+    # 与所属报告相同的按天分桶，清理时无需关联 reports
+    bucket = Column(Integer, nullable=True, index=True,
+                    comment="Daily bucket (YYYYMMDD) of the owning report")
+
     # 4. 审计字段（可选，最佳实践，方便追溯记录创建/更新时间）
     created_at = Column(DateTime, default=func.now(),
                         nullable=False, comment="Record creation time")
@@ -95,6 +131,61 @@ class LostFiles(Base):
     report = relationship(
         "Reports", back_populates="lost_files")
 
+    # 按文件名查询时先定位 (file_ts, file_id)，按时间范围查询时走 file_ts 前缀
+    __table_args__ = (
+        Index("ix_lost_files_file_ts_file_id", "file_ts", "file_id"),
+    )
+
+
+class DailyRollups(Base):
+    """
+    The declaration of the DailyRollups table in the database.
+    Daily aggregated counts of reports, kept after the detailed buckets are purged.
+    """
+    __tablename__ = "daily_rollups"
+
+    day = Column(Integer, primary_key=True, autoincrement=False,
+                 comment="Daily bucket (YYYYMMDD)")
+    report_count = Column(Integer, nullable=False,
+                          comment="Number of reports in the day")
+    forward_count = Column(BigInteger, nullable=False,
+                           comment="Sum of forwarded files in the day")
+    process_count = Column(BigInteger, nullable=False,
+                           comment="Sum of processed files in the day")
+    lost_count = Column(BigInteger, nullable=False,
+                        comment="Sum of lost files in the day")
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(
+    ), nullable=False, comment="Record last update time")
+
+
+def bucket_of(window_start: Optional[str]) -> Optional[int]:
+    """
+    计算审计窗口开始时间所属的天级分桶
+    :param window_start: ISO 格式的时间字符串
+    :return: YYYYMMDD 形式的整数，无法解析时返回None
+    """
+    try:
+        return int(datetime.fromisoformat(window_start).strftime("%Y%m%d"))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_lost_file_name(file_name: str) -> Tuple[Optional[datetime], Optional[int]]:
+    """
+    解析丢失文件名中内嵌的时间戳和文件ID
+    :param file_name: 文件基础名称，例如 20260128101647964993_tz01_91458258_.log
+    :return: (file_ts, file_id)，无法解析时对应位置返回None；文件ID超出 BIGINT 范围时 file_id 为None
+    """
+    match = LOST_FILE_NAME_PATTERN.match(file_name)
+    if not match:
+        return None, None
+    try:
+        file_ts = datetime.strptime(match.group(1), "%Y%m%d%H%M%S")
+    except ValueError:
+        return None, None
+    file_id = int(match.group(2))
+    return file_ts, file_id if file_id <= MAX_FILE_ID else None
+
 
 class WatcherDao:
     """
@@ -110,22 +201,37 @@ class WatcherDao:
         self.db_session = db_session
 
     # ------------------------------ Reports 表 操作 ------------------------------
+    @staticmethod
+    def _build_report(report_data: Dict[str, Any]) -> Reports:
+        """
+        由报告数据字典构建Reports对象
+        """
+        return Reports(
+            pipeline=report_data.get("pipeline", "default"),
+            shard=report_data.get("shard"),
+            audit_window_start=report_data.get("audit_window_start"),
+            audit_window_end=report_data.get("audit_window_end"),
+            forward_count=report_data.get("forward_count"),
+            process_count=report_data.get("process_count"),
+            lost_count=report_data.get("lost_count"),
+            latency_p50_ms=report_data.get("latency_p50_ms"),
+            latency_p90_ms=report_data.get("latency_p90_ms"),
+            latency_p99_ms=report_data.get("latency_p99_ms"),
+            latency_max_ms=report_data.get("latency_max_ms"),
+            bucket=bucket_of(report_data.get("audit_window_start"))
+        )
+
     def create_report(self, report_data: Dict[str, Any]) -> Optional[Reports]:
         """
         插入单条报告记录
         :param report_data: 报告数据字典，需包含以下必填字段：
                             audit_window_start, audit_window_end, forward_count, process_count, lost_count
+                            可选字段：pipeline, latency_p50_ms, latency_p90_ms, latency_p99_ms, latency_max_ms
         :return: 创建成功的Reports对象（含自动生成的id），失败返回None
         """
         try:
             # 构建Reports对象
-            new_report = Reports(
-                audit_window_start=report_data.get("audit_window_start"),
-                audit_window_end=report_data.get("audit_window_end"),
-                forward_count=report_data.get("forward_count"),
-                process_count=report_data.get("process_count"),
-                lost_count=report_data.get("lost_count")
-            )
+            new_report = self._build_report(report_data)
             # 添加到session并提交（调用方可选择外部统一提交，此处为单条操作便捷性提交）
             self.db_session.add(new_report)
             self.db_session.commit()
@@ -146,13 +252,7 @@ class WatcherDao:
         try:
             report_list = []
             for data in reports_data_list:
-                report = Reports(
-                    audit_window_start=data.get("audit_window_start"),
-                    audit_window_end=data.get("audit_window_end"),
-                    forward_count=data.get("forward_count"),
-                    process_count=data.get("process_count"),
-                    lost_count=data.get("lost_count")
-                )
+                report = self._build_report(data)
                 report_list.append(report)
             # 批量添加
             self.db_session.add_all(report_list)
@@ -192,6 +292,7 @@ class WatcherDao:
                                     audit_window_start_ge: 审计开始时间大于等于
                                     audit_window_end_le: 审计结束时间小于等于
                                     lost_count_gt: 丢失文件数大于
+                                    pipeline: 流水线名称
         :return: 分页结果字典，包含total（总条数）和items（当前页数据列表）
         """
         try:
@@ -208,6 +309,9 @@ class WatcherDao:
             if "lost_count_gt" in filter_conditions:
                 query = query.filter(Reports.lost_count >
                                      filter_conditions["lost_count_gt"])
+            if "pipeline" in filter_conditions:
+                query = query.filter(
+                    Reports.pipeline == filter_conditions["pipeline"])
 
             # 统计总条数
             total = query.count()
@@ -227,6 +331,40 @@ class WatcherDao:
             logging.error(f"分页查询报告列表失败：{str(e)}")
             return {"total": 0, "items": []}
 
+    def get_first_window_ends(self) -> Dict[str, datetime]:
+        """
+        查询每条流水线已落库的最早审计窗口结束时间，重启补跑时不会早于流水线开始审计的时间
+        :return: 流水线名称 -> 最早窗口结束时间
+        :raises Exception: 查询失败时抛出，避免把"查询失败"当作"没有历史记录"
+        """
+        try:
+            rows = self.db_session.query(Reports.pipeline, func.min(Reports.audit_window_end)) \
+                                  .group_by(Reports.pipeline) \
+                                  .all()
+            return {pipeline: datetime.fromisoformat(window_end) for pipeline, window_end in rows}
+        except Exception as e:
+            logging.error(f"查询最早审计窗口失败：{str(e)}")
+            raise
+
+    def get_audited_windows(self, since: datetime) -> Dict[str, Set[datetime]]:
+        """
+        查询每条流水线在 since 之后（包含）已落库的审计窗口结束时间，用于重启后找出补跑范围内缺失的窗口
+        :param since: 窗口结束时间下限
+        :return: 流水线名称 -> 窗口结束时间集合
+        :raises Exception: 查询失败时抛出
+        """
+        try:
+            rows = self.db_session.query(Reports.pipeline, Reports.audit_window_end) \
+                                  .filter(Reports.audit_window_end >= since.isoformat()) \
+                                  .all()
+            windows: Dict[str, Set[datetime]] = {}
+            for pipeline, window_end in rows:
+                windows.setdefault(pipeline, set()).add(datetime.fromisoformat(window_end))
+            return windows
+        except Exception as e:
+            logging.error(f"查询已审计窗口失败：{str(e)}")
+            raise
+
     def delete_report(self, report_id: int) -> bool:
         """
         根据ID删除报告记录（触发级联删除，关联的LostFiles记录也会被删除）
@@ -247,6 +385,29 @@ class WatcherDao:
             logging.error(f"删除报告（ID：{report_id}）失败：{str(e)}")
             return False
 
+    def _add_report_with_lost_files(self, report_data: Dict[str, Any], lost_files_list: List[str]) -> Reports:
+        """
+        在当前事务中添加报告及其丢失文件记录（不提交）
+        """
+        new_report = self._build_report(report_data)
+        self.db_session.add(new_report)
+        self.db_session.flush()  # 刷新以获取new_report.id
+
+        # 批量创建LostFiles记录
+        lost_files_objs = []
+        for file_name in lost_files_list:
+            file_ts, file_id = parse_lost_file_name(file_name)
+            lost_file = LostFiles(
+                report_id=new_report.id,
+                file_name=file_name,
+                file_ts=file_ts,
+                file_id=file_id,
+                bucket=new_report.bucket
+            )
+            lost_files_objs.append(lost_file)
+        self.db_session.add_all(lost_files_objs)
+        return new_report
+
     def create_report_with_lost_files(self, report_data: Dict[str, Any], lost_files_list: List[str]) -> Optional[Reports]:
         """
         创建报告记录并批量插入关联的丢失文件记录，支持事务操作
@@ -257,29 +418,228 @@ class WatcherDao:
         """
         try:
             # 开启事务
-            new_report = Reports(
-                audit_window_start=report_data.get("audit_window_start"),
-                audit_window_end=report_data.get("audit_window_end"),
-                forward_count=report_data.get("forward_count"),
-                process_count=report_data.get("process_count"),
-                lost_count=report_data.get("lost_count")
-            )
-            self.db_session.add(new_report)
-            self.db_session.flush()  # 刷新以获取new_report.id
-
-            # 批量创建LostFiles记录
-            lost_files_objs = []
-            for file_name in lost_files_list:
-                lost_file = LostFiles(
-                    report_id=new_report.id,
-                    file_name=file_name
-                )
-                lost_files_objs.append(lost_file)
-
-            self.db_session.add_all(lost_files_objs)
+            new_report = self._add_report_with_lost_files(report_data, lost_files_list)
             self.db_session.commit()  # 提交事务
             return new_report
         except Exception as e:
             self.db_session.rollback()  # 异常回滚
             logging.error(f"创建报告及丢失文件记录失败：{str(e)}")
             return None
+
+    def batch_create_reports_with_lost_files(self, items: List[Tuple[Dict[str, Any], List[str]]]) -> bool:
+        """
+        在同一个事务中批量创建报告及其丢失文件记录，全部成功或全部回滚
+        :param items: (报告数据字典, 丢失文件名列表) 列表，格式同create_report_with_lost_files
+        :return: 批量创建成功返回True
+        :raises Exception: 失败时回滚并重新抛出原始异常，由调用方区分暂时性错误（可重试）和数据错误
+        """
+        try:
+            for report_data, lost_files_list in items:
+                self._add_report_with_lost_files(report_data, lost_files_list)
+            self.db_session.commit()
+            return True
+        except Exception as e:
+            self.db_session.rollback()
+            logging.error(f"批量创建报告及丢失文件记录失败：{str(e)}")
+            raise
+
+    # ------------------------------ 保留策略 操作 ------------------------------
+    def get_latest_rollup_day(self) -> Optional[int]:
+        """
+        查询已汇总的最新一天
+        :return: YYYYMMDD 形式的整数，无汇总数据或失败返回None
+        """
+        try:
+            return self.db_session.query(func.max(DailyRollups.day)).scalar()
+        except Exception as e:
+            logging.error(f"查询最新汇总日期失败：{str(e)}")
+            return None
+
+    def rollup_buckets(self, before_bucket: int, since_bucket: Optional[int] = None) -> int:
+        """
+        将 [since_bucket, before_bucket) 内的报告按天汇总写入 daily_rollups（存在则覆盖）
+        :param before_bucket: 汇总截止的分桶（不包含），通常为今天
+        :param since_bucket: 汇总起始的分桶（包含），None表示从最早的分桶开始
+        :return: 写入的汇总行数，失败返回-1
+        """
+        try:
+            query = self.db_session.query(
+                Reports.bucket,
+                func.count(Reports.id),
+                func.coalesce(func.sum(Reports.forward_count), 0),
+                func.coalesce(func.sum(Reports.process_count), 0),
+                func.coalesce(func.sum(Reports.lost_count), 0)
+            ).filter(Reports.bucket < before_bucket)
+            if since_bucket is not None:
+                query = query.filter(Reports.bucket >= since_bucket)
+            rows = query.group_by(Reports.bucket).all()
+
+            for day, report_count, forward_count, process_count, lost_count in rows:
+                self.db_session.merge(DailyRollups(
+                    day=day,
+                    report_count=report_count,
+                    forward_count=forward_count,
+                    process_count=process_count,
+                    lost_count=lost_count
+                ))
+            self.db_session.commit()
+            return len(rows)
+        except Exception as e:
+            self.db_session.rollback()
+            logging.error(f"汇总分桶（< {before_bucket}）失败：{str(e)}")
+            return -1
+
+    def purge_buckets(self, before_bucket: int, batch_size: int = 5000) -> Dict[str, int]:
+        """
+        按分桶批量删除过期的丢失文件和报告（先子表后主表，每批独立提交，避免长事务和逐行ORM删除）
+        :param before_bucket: 删除该分桶之前（不包含）的数据
+        :param batch_size: 每批删除的行数
+        :return: 各表删除的行数，例如 {"lost_files": 10000, "reports": 240}
+        """
+        deleted = {"lost_files": 0, "reports": 0}
+        for table_name, model in (("lost_files", LostFiles), ("reports", Reports)):
+            try:
+                while True:
+                    # MySQL 不支持 IN 子查询中带 LIMIT，先取出一批主键再删除
+                    ids = [row[0] for row in self.db_session.query(model.id)
+                           .filter(model.bucket < before_bucket)
+                           .limit(batch_size)
+                           .all()]
+                    if not ids:
+                        break
+                    self.db_session.query(model) \
+                        .filter(model.id.in_(ids)) \
+                        .delete(synchronize_session=False)
+                    self.db_session.commit()
+                    deleted[table_name] += len(ids)
+            except Exception as e:
+                self.db_session.rollback()
+                logging.error(f"清理 {table_name} 分桶（< {before_bucket}）失败：{str(e)}")
+                break
+        return deleted
+
+    # ------------------------------ 表结构迁移 回填 ------------------------------
+    def backfill_derived_columns(self, batch_size: int = 5000) -> Dict[str, int]:
+        """
+        为迁移新增的派生列回填旧数据（幂等，启动时执行；已回填的行不会被再次扫描）：
+        - reports.bucket: 由 audit_window_start 的日期计算
+        - lost_files.bucket: 取所属报告的分桶
+        - lost_files.file_ts / file_id: 由文件名解析
+        lost_files 按主键分批回填，每批独立提交，避免长事务；失败时回滚并抛出异常
+        :param batch_size: 每批回填的行数
+        :return: 各列回填的行数，例如 {"reports.bucket": 240, "lost_files.bucket": 10000, "lost_files.file_ts": 10000}
+        """
+        filled = {"reports.bucket": 0, "lost_files.bucket": 0, "lost_files.file_ts": 0}
+        try:
+            # 2026-01-28T10:15:00 -> 20260128
+            filled["reports.bucket"] = self.db_session.query(Reports) \
+                .filter(Reports.bucket.is_(None)) \
+                .update({Reports.bucket: func.replace(func.substr(Reports.audit_window_start, 1, 10), "-", "")
+                         .cast(Integer)}, synchronize_session=False)
+            self.db_session.commit()
+
+            report_bucket = self.db_session.query(Reports.bucket) \
+                .filter(Reports.id == LostFiles.report_id) \
+                .scalar_subquery()
+            last_id = ""
+            while True:
+                # 按主键推进，所属报告分桶仍为空的行不会被重复扫描
+                ids = [row[0] for row in self.db_session.query(LostFiles.id)
+                       .filter(LostFiles.bucket.is_(None), LostFiles.id > last_id)
+                       .order_by(LostFiles.id)
+                       .limit(batch_size)
+                       .all()]
+                if not ids:
+                    break
+                self.db_session.query(LostFiles) \
+                    .filter(LostFiles.id.in_(ids)) \
+                    .update({LostFiles.bucket: report_bucket}, synchronize_session=False)
+                self.db_session.commit()
+                filled["lost_files.bucket"] += len(ids)
+                last_id = ids[-1]
+
+            last_id = ""
+            while True:
+                rows = self.db_session.query(LostFiles.id, LostFiles.file_name) \
+                    .filter(LostFiles.file_ts.is_(None), LostFiles.id > last_id) \
+                    .order_by(LostFiles.id) \
+                    .limit(batch_size) \
+                    .all()
+                if not rows:
+                    break
+                mappings = []
+                for lost_file_id, file_name in rows:
+                    file_ts, file_id = parse_lost_file_name(file_name)
+                    if file_ts is not None:
+                        mappings.append({"id": lost_file_id, "file_ts": file_ts, "file_id": file_id})
+                if mappings:
+                    self.db_session.bulk_update_mappings(LostFiles, mappings)
+                self.db_session.commit()
+                filled["lost_files.file_ts"] += len(mappings)
+                last_id = rows[-1].id
+        except Exception as e:
+            self.db_session.rollback()
+            logging.error(f"回填派生列失败：{str(e)}")
+            raise
+        return filled
+
+    # ------------------------------ LostFiles 表 查询 ------------------------------
+    def find_lost_files(self,
+                        file_name: Optional[str] = None,
+                        start: Optional[datetime] = None,
+                        end: Optional[datetime] = None,
+                        limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        按文件名精确查询或按文件时间范围查询丢失文件，并附带所属报告的审计窗口
+        查询命中 (file_ts, file_id) 索引，无法解析的文件名命中 file_name 索引，不会全表扫描 lost_files
+        :param file_name: 文件基础名称（精确匹配），优先于时间范围
+        :param start: 文件时间范围起点（包含）
+        :param end: 文件时间范围终点（不包含）
+        :param limit: 最多返回条数
+        :return: 丢失文件记录字典列表，参数无效返回空列表
+        :raises Exception: 查询失败时抛出，由调用方区分"无结果"和"查询失败"
+        """
+        try:
+            query = self.db_session.query(
+                LostFiles.file_name,
+                LostFiles.file_ts,
+                LostFiles.report_id,
+                Reports.pipeline,
+                Reports.shard,
+                Reports.audit_window_start,
+                Reports.audit_window_end
+            ).join(Reports, LostFiles.report_id == Reports.id)
+
+            if file_name is not None:
+                file_ts, file_id = parse_lost_file_name(file_name)
+                if file_ts is None:
+                    # 入库时同样解析不出 file_ts（cid=<n>、其他流水线的文件名格式），按文件名查询
+                    query = query.filter(LostFiles.file_name == file_name)
+                else:
+                    query = query.filter(LostFiles.file_ts == file_ts,
+                                         LostFiles.file_id == file_id,
+                                         LostFiles.file_name == file_name)
+            elif start is not None or end is not None:
+                if start is not None:
+                    query = query.filter(LostFiles.file_ts >= start)
+                if end is not None:
+                    query = query.filter(LostFiles.file_ts < end)
+            else:
+                return []
+
+            rows = query.order_by(LostFiles.file_ts).limit(limit).all()
+            return [
+                {
+                    "file_name": row.file_name,
+                    "file_ts": row.file_ts.isoformat() if row.file_ts else None,
+                    "report_id": row.report_id,
+                    "pipeline": row.pipeline,
+                    "shard": row.shard,
+                    "audit_window_start": row.audit_window_start,
+                    "audit_window_end": row.audit_window_end,
+                }
+                for row in rows
+            ]
+        except Exception as e:
+            logging.error(f"查询丢失文件失败：{str(e)}")
+            raise
@@ -0,0 +1,79 @@
+"""
+Fixed-memory latency digest for the forward-to-process delay of one audit window.
+"""
+
+import math
+from typing import List, Optional
+
+# 细粒度分桶：下界 1ms，每个桶上界为前一个的 2^(1/8) 倍（误差约 9%），最大约 1.2 小时
+DIGEST_BASE_SECONDS = 0.001
+DIGEST_STEPS_PER_DOUBLING = 8
+DIGEST_BUCKETS = DIGEST_STEPS_PER_DOUBLING * 22
+
+# Prometheus 导出的粗粒度分桶（细粒度分桶上界的子集，1ms ~ 约262s 的 2 的幂）
+EXPORT_BUCKET_BOUNDS = [DIGEST_BASE_SECONDS * 2 ** k for k in range(19)]
+
+
+def _upper_bound(index: int) -> float:
+    return DIGEST_BASE_SECONDS * 2 ** (index / DIGEST_STEPS_PER_DOUBLING)
+
+
+class LatencyDigest:
+    """
+    对数分桶的延迟统计，内存占用与样本数无关，可用于百万级文件的窗口
+    """
+
+    def __init__(self):
+        self.counts: List[int] = [0] * (DIGEST_BUCKETS + 1)  # 最后一个桶为溢出桶
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        """
+        记录一个延迟样本，负值（时钟偏差）按 0 处理
+        """
+        seconds = max(seconds, 0.0)
+        if seconds <= DIGEST_BASE_SECONDS:
+            index = 0
+        else:
+            index = math.ceil(math.log2(seconds / DIGEST_BASE_SECONDS) * DIGEST_STEPS_PER_DOUBLING)
+            index = min(index, DIGEST_BUCKETS)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        估算分位数，返回所在分桶的上界（溢出桶返回最大值）
+        :param q: 分位数，取值 (0, 1]
+        :return: 延迟秒数，无样本返回None
+        """
+        if self.count == 0:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                if index == DIGEST_BUCKETS:
+                    return self.max
+                return min(_upper_bound(index), self.max)
+        return self.max
+
+    def export_buckets(self) -> List[int]:
+        """
+        按 EXPORT_BUCKET_BOUNDS 汇总的累计计数（不含 +Inf）
+        """
+        cumulative = []
+        seen = 0
+        index = 0
+        for bound_index in range(len(EXPORT_BUCKET_BOUNDS)):
+            last = bound_index * DIGEST_STEPS_PER_DOUBLING
+            while index <= last:
+                seen += self.counts[index]
+                index += 1
+            cumulative.append(seen)
+        return cumulative
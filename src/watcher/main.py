@@ -1,16 +1,42 @@
 import os
+import signal
+import sys
 import time
 import json
-import re
 import logging
+import re
+import threading
 import requests
-from datetime import datetime, timedelta
-from prometheus_client import start_http_server, Gauge
+from requests.adapters import HTTPAdapter
+from datetime import datetime
 from pathlib import Path
+from typing import Optional
 from sqlalchemy import create_engine, text, desc
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
 from dao import Base, WatcherDao
+from api import start_api_server, set_session_factory
+from retention import RetentionManager
+from persistence import ReportWriter
+from scheduler import AuditScheduler
+from readiness import wait_until_ready, probe_database, probe_loki, ensure_schema
+from pipelines import CID_SEQUENCE_BITS, Pipeline, load_pipelines
+from tail import TailSource
+from latency import LatencyDigest
+from metrics import (
+    GAUGE_LOST_FILES,
+    GAUGE_TOTAL_FORWARD,
+    GAUGE_TOTAL_PROCESS,
+    GAUGE_AUDIT_LAG,
+    GAUGE_RECONCILE_PASSES,
+    COUNTER_LOST_NAMES_DROPPED,
+    GAUGE_PIPELINE_INFO,
+    COUNTER_LOKI_LINES,
+    COUNTER_LOKI_BYTES,
+    COUNTER_PARSE_ERRORS,
+    LATENCY_COLLECTOR,
+    observe_phase,
+)
 
 # --- 配置部分 ---
 LOKI_URL = os.getenv("LOKI_URL", "http://loki:3100")
@@ -25,17 +51,31 @@ WINDOW_EXTEND_SECONDS = int(os.getenv("WINDOW_EXTEND_SECONDS", "120"))
 assert (
     WINDOW_EXTEND_SECONDS <= WINDOW_OFFSET_SECONDS
 )  # To sure will not query the future messages
-
-# --- Prometheus Metrics ---
-GAUGE_LOST_FILES = Gauge(
-    "log_audit_lost_files_count", "Number of files forwarded but not processed"
-)
-GAUGE_TOTAL_FORWARD = Gauge(
-    "log_audit_forward_count", "Total files forwarded in the window"
-)
-GAUGE_TOTAL_PROCESS = Gauge(
-    "log_audit_process_count", "Total files processed in the window"
-)
+# 启动时等待数据库 / Loki 就绪的最长时间（指数退避探测）
+STARTUP_DB_TIMEOUT_SECONDS = float(os.getenv("STARTUP_DB_TIMEOUT_SECONDS", "120"))
+STARTUP_LOKI_TIMEOUT_SECONDS = float(os.getenv("STARTUP_LOKI_TIMEOUT_SECONDS", "60"))
+# 启动时自动迁移表结构（补齐新增的列和索引并回填旧数据）；关闭时表结构过旧则拒绝启动
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() in ("1", "true", "yes")
+# 重启后的补跑范围（窗口数，含最新的就绪窗口）：范围内每条流水线缺少报告的窗口都会补跑，默认约一天
+RESUME_MAX_WINDOWS = int(os.getenv("RESUME_MAX_WINDOWS", "288"))
+# 同时执行的审计数上限（多条流水线、积压窗口补跑共用）
+AUDIT_MAX_CONCURRENCY = int(os.getenv("AUDIT_MAX_CONCURRENCY", "8"))
+# 审计失败的任务按指数退避重试：首次等待 AUDIT_RETRY_MIN_SECONDS，每次失败翻倍，不超过 AUDIT_RETRY_MAX_SECONDS
+AUDIT_RETRY_MIN_SECONDS = float(os.getenv("AUDIT_RETRY_MIN_SECONDS", "5"))
+AUDIT_RETRY_MAX_SECONDS = float(os.getenv("AUDIT_RETRY_MAX_SECONDS", "600"))
+# 日志获取方式：loki 通过 Loki query_range 查询；tail 直接读取本地日志文件（需挂载两个服务的日志卷）
+INGEST_BACKEND = os.getenv("INGEST_BACKEND", "loki")
+# 流水线定义文件（JSON），未设置时只审计默认的 forward_svc/process_svc 流水线
+PIPELINES_CONFIG = os.getenv("PIPELINES_CONFIG", "")
+# Loki 单次查询返回的最大行数（不超过 Loki 的 max_entries_limit_per_query），超出时自动分页
+LOKI_QUERY_LIMIT = int(os.getenv("LOKI_QUERY_LIMIT", "5000"))
+# 对账方式：exact 一次关联整个窗口，内存中保存处理侧完整的 键->时间戳 映射；partitioned 按键的哈希分成多轮，
+# 每轮重新流式读取两侧日志、只关联一个分区，内存有界，结果与 exact 完全一致（bloom 为 partitioned 的旧名称）
+RECONCILE_MODE = os.getenv("RECONCILE_MODE", "exact")
+# partitioned 模式每一轮在内存中保留的键数上限（处理侧映射与丢失文件合计），超出时加倍分区数重新对账
+RECONCILE_PARTITION_KEYS = int(os.getenv("RECONCILE_PARTITION_KEYS", "1000000"))
+# partitioned 模式一个窗口最多保存的丢失文件名数，超出的只计入 lost_count，不写入 lost_files
+RECONCILE_MAX_LOST_NAMES = int(os.getenv("RECONCILE_MAX_LOST_NAMES", "100000"))
 
 # --- 日志配置 ---
 logging.basicConfig(
@@ -43,44 +83,96 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# --- 正则表达式 ---
-# 文件名示例: 20260128101647964993_tz01_91458258_.log
-# 提取文件名中的时间戳 (前14位: YYYYMMDDHHmmss)
-FILENAME_TS_PATTERN = re.compile(r"(\d{14})\d*_.+")
+# 关联ID的数字部分
+_DIGITS = re.compile(r"\d+")
 
-# Process Service: filePath=/cacheproxy/.../xxx.log成功
-PROCESS_PATTERN = re.compile(r"filePath=([\w/.-]+)成功")
+# 共享的 Loki HTTP 连接池，所有流水线的并发审计复用
+_http_session = requests.Session()
+_http_session.mount("http://", HTTPAdapter(pool_maxsize=AUDIT_MAX_CONCURRENCY * 2))
+_http_session.mount("https://", HTTPAdapter(pool_maxsize=AUDIT_MAX_CONCURRENCY * 2))
 
-# Forward Service: Rename trigger hard link /cacheproxy/.../xxx.log to process
-FORWARD_PATTERN = re.compile(r"Rename trigger hard link ([\w/.-]+) to process")
+# 每条流水线已完成审计的最新窗口结束时间；补跑的旧窗口晚于新窗口完成时，不覆盖流水线级别的 Gauge
+_latest_window_ends = {}
+_latest_window_lock = threading.Lock()
 
 
-def get_loki_logs(query, start_ts, end_ts, limit=5000):
-    """从Loki获取日志"""
+def get_loki_logs(query, start_ns, end_ns, limit=LOKI_QUERY_LIMIT, pipeline="default", stream="unknown"):
+    """从Loki获取一页日志（纳秒时间戳），pipeline 和 stream 用于区分指标标签"""
     url = f"{LOKI_URL}/loki/api/v1/query_range"
-    # Loki API 使用纳秒时间戳
     params = {
         "query": query,
-        "start": int(start_ts * 1e9),
-        "end": int(end_ts * 1e9),
+        "start": start_ns,
+        "end": end_ns,
         "limit": limit,
         "direction": "FORWARD",
     }
 
     try:
-        response = requests.get(url, params=params, timeout=30)
+        response = _http_session.get(url, params=params, timeout=30)
         response.raise_for_status()
+        COUNTER_LOKI_BYTES.labels(pipeline=pipeline, stream=stream).inc(
+            len(response.content))
         data = response.json()
         return data.get("data", {}).get("result", [])
     except Exception as e:
+        # 查询失败时抛出，由调度器重试该窗口，避免把空结果当作审计结果
         logger.error(f"Error querying Loki: {e}")
-        return []
+        raise
 
 
-def extract_filename_and_ts(filepath):
+def iter_loki_entries(query, start_ts, end_ts, limit=LOKI_QUERY_LIMIT, pipeline="default", stream="unknown"):
+    """
+    分页查询 Loki，按时间顺序逐条产出 (日志时间戳纳秒, 文本)，内存中只保留一页
+    下一页从本页最后一个时间戳开始，与上一页末尾时间戳相同的日志行去重
+    """
+    start_ns = int(start_ts * 1e9)
+    end_ns = int(end_ts * 1e9)
+    boundary = set()
+    while start_ns < end_ns:
+        result = get_loki_logs(query, start_ns, end_ns, limit, pipeline=pipeline, stream=stream)
+        # value[0] is timestamp (ns), value[1] is line
+        page = sorted((int(value[0]), value[1]) for item in result for value in item["values"])
+        for entry in page:
+            if entry not in boundary:
+                yield entry
+        if len(page) < limit:
+            return
+        last_ns = page[-1][0]
+        if page[0][0] == last_ns:
+            # 整页都是同一纳秒的日志，无法再按时间戳切分，跳过该时间点以免死循环
+            logger.warning(f"[{pipeline}] More than {limit} {stream} lines at {last_ns}ns, some may be skipped")
+            start_ns = last_ns + 1
+            boundary = set()
+        else:
+            start_ns = last_ns
+            boundary = {entry for entry in page if entry[0] == last_ns}
+
+
+# tail 模式下的本地日志源，在启动时初始化
+tail_source: TailSource = None
+
+
+def iter_logs(pipeline: Pipeline, stream: str, start_ts: float, end_ts: float):
+    """
+    按配置的获取方式拉取一条流水线 forward/process 日志，逐条产出 (日志时间戳纳秒, 文本)
+    :raises TailCoverageError: tail 模式下内存缓冲已不再完整覆盖 start_ts 之后的日志行（调度器放弃该窗口）
+    """
+    if INGEST_BACKEND == "tail":
+        if stream == "forward":
+            entries = tail_source.query(pipeline.forward_log_path, pipeline.forward_keywords,
+                                        start_ts, end_ts)
+        else:
+            entries = tail_source.query(pipeline.process_log_path, pipeline.process_keywords,
+                                        start_ts, end_ts)
+        return iter(entries)
+    query = pipeline.forward_query if stream == "forward" else pipeline.process_query
+    return iter_loki_entries(query, start_ts, end_ts, pipeline=pipeline.name, stream=stream)
+
+
+def extract_filename_and_ts(filepath, filename_pattern):
     """从完整路径提取文件名和基于文件名的datetime对象"""
     basename = os.path.basename(filepath)
-    match = FILENAME_TS_PATTERN.match(basename)
+    match = filename_pattern.match(basename)
     if match:
         ts_str = match.group(1)
         try:
@@ -90,108 +182,325 @@ def extract_filename_and_ts(filepath):
     return basename, None
 
 
-def run_audit(dao_handler: WatcherDao):
+def _iter_window_files(entries, pattern, filename_pattern, window_start_dt, window_end_dt, errors):
+    """
+    用正则从日志行中提取文件路径，只产出文件名时间戳落在目标窗口内的文件
+    :param entries: (日志时间戳纳秒, 文本) 序列
+    :param errors: 错误计数字典，累加 no_match（未匹配正则）和 filename（文件名中无时间戳）
+    :return: 生成 (文件名, 日志时间戳纳秒)
+    """
+    for ts, text in entries:
+        match = pattern.search(text)
+        if not match:
+            errors["no_match"] += 1
+            continue
+        fname, ftime = extract_filename_and_ts(match.group(1), filename_pattern)
+        if ftime is None:
+            errors["filename"] += 1
+        # 关键逻辑：只统计文件名时间戳落在目标窗口内的文件
+        elif window_start_dt <= ftime < window_end_dt:
+            yield fname, ts
+
+
+def _iter_window_cids(entries, marker, window_start_dt, window_end_dt, errors):
+    """
+    按关联ID对账：在日志行中定位 marker 后的整数关联ID，不做 JSON 和正则解析
+    文件时间由ID高位直接还原（epoch 微秒），只产出文件时间落在目标窗口内的日志
+    :param entries: (日志时间戳纳秒, 文本) 序列
+    :param marker: 关联ID前的标记
+    :param errors: 错误计数字典，累加 no_cid（日志中没有关联ID）
+    :return: 生成 (关联ID, 原始的 (日志时间戳纳秒, 文本))
+    """
+    start_us = int(window_start_dt.timestamp()) * 1_000_000
+    end_us = int(window_end_dt.timestamp()) * 1_000_000
+    offset = len(marker)
+    for entry in entries:
+        text = entry[1]
+        pos = text.find(marker)
+        match = _DIGITS.match(text, pos + offset) if pos >= 0 else None
+        if match is None:
+            errors["no_cid"] += 1
+            continue
+        cid = int(match.group())
+        if start_us <= cid >> CID_SEQUENCE_BITS < end_us:
+            yield cid, entry
+
+
+def _forward_file_name(pipeline: Pipeline, line: str, cid) -> str:
+    """
+    从一条转发日志中解析文件名，cid 对账方式下只对丢失文件调用；无法解析时以关联ID代替
+    """
+    try:
+        match = pipeline.forward_pattern.search(json.loads(line).get("msg", ""))
+    except (json.JSONDecodeError, AttributeError):
+        match = None
+    return os.path.basename(match.group(1)) if match else f"cid={cid}"
+
+
+def _iter_forward_msgs(entries, name, errors):
+    """
+    解析转发日志的 JSON，产出 (日志时间戳纳秒, msg)
+    :param errors: 错误计数字典，累加 json（非JSON行）
+    """
+    for ts, log_line in entries:
+        try:
+            yield ts, json.loads(log_line).get("msg", "")
+        except json.JSONDecodeError:
+            errors["json"] += 1  # 忽略非JSON行
+        except Exception as e:
+            errors["json"] += 1
+            logger.warning(f"[{name}] Error parsing forward log: {e}")
+
+
+def _count_lines(entries, counts, stream):
+    """边产出日志行边计数，流式处理时用于统计获取的行数"""
+    for entry in entries:
+        counts[stream] += 1
+        yield entry
+
+
+def _add_parse_errors(name, stream, errors):
+    for reason, count in errors.items():
+        COUNTER_PARSE_ERRORS.labels(pipeline=name, stream=stream, reason=reason).inc(count)
+
+
+def _to_ms(seconds):
+    return None if seconds is None else int(round(seconds * 1000))
+
+
+def _stream_keys(pipeline: Pipeline, stream: str, window_start_dt: datetime, window_end_dt: datetime,
+                 query_start: float, query_end: float, lines):
     """
-    run_audit 的 Docstring
+    流式读取一侧日志并解析出关联键：文件名方式下为文件名，cid 方式下为整数关联ID（不做 JSON 和正则解析）
+    :param lines: 行数计数字典，按 stream 累加读取的日志行数
+    :return: (生成 (键, 日志时间戳纳秒, 转发日志文本或None) 的生成器, 错误计数字典)；
+             转发日志文本只在 cid 方式下提供，用于解析丢失文件的文件名
+    """
+    entries = _count_lines(iter_logs(pipeline, stream, query_start, query_end), lines, stream)
+    if pipeline.join_key == "cid":
+        errors = {"no_cid": 0}
+        marker = pipeline.forward_cid_marker if stream == "forward" else pipeline.process_cid_marker
+        keys = ((cid, ts, text if stream == "forward" else None)
+                for cid, (ts, text) in _iter_window_cids(entries, marker, window_start_dt, window_end_dt, errors))
+        return keys, errors
+    if stream == "forward":
+        errors = {"json": 0, "no_match": 0, "filename": 0}
+        entries = _iter_forward_msgs(entries, pipeline.name, errors)
+        pattern = pipeline.forward_pattern
+    else:
+        errors = {"no_match": 0, "filename": 0}
+        pattern = pipeline.process_pattern
+    keys = ((fname, ts, None) for fname, ts in _iter_window_files(
+        entries, pattern, pipeline.filename_pattern, window_start_dt, window_end_dt, errors))
+    return keys, errors
+
+
+# 处理侧 键->时间戳 字典中已与转发日志关联过的键
+_MATCHED = -1
+
+
+class _PartitionOverflow(Exception):
+    """
+    一轮关联在内存中保留的键数超过上限
+    """
+
 
-    :param dao_handler: 数据库操作对象
-    :type dao_handler: WatcherDao
+def _join_window(pipeline: Pipeline, window_start_dt: datetime, window_end_dt: datetime,
+                 query_start: float, query_end: float, latency: LatencyDigest, accept=None,
+                 max_keys: Optional[int] = None):
     """
-    now = datetime.now()
-    # 定义我们要审计的“文件时间”窗口
-    # 比如现在是 10:10，间隔5分钟，偏移5分钟。
-    # window_end = 10:05, window_start = 10:00
-    window_end_dt = now - timedelta(seconds=WINDOW_OFFSET_SECONDS)
-    window_start_dt = window_end_dt - timedelta(seconds=CHECK_INTERVAL_SECONDS)
+    流式关联一个窗口两侧的日志：
+    - 先流式读取处理日志，只保留 键->首条处理日志时间戳 的紧凑字典
+    - 再流式读取转发日志逐条关联：已处理的文件计入延迟分布，没有处理日志的文件即为丢失
+    内存中不保留任何一侧的原始日志行；cid 方式下丢失文件的文件名由手中的转发日志行当场解析
+    :param latency: 匹配文件的延迟写入该分布
+    :param accept: 键过滤函数，只关联返回 True 的键（分区对账时每一轮只处理一个分区），None 表示全部
+    :param max_keys: 内存中保留的键数上限（处理侧映射与丢失文件合计），None 表示不限制
+    :return: (转发文件数, 处理文件数, 丢失文件 键->文件名)
+    :raises _PartitionOverflow: 保留的键数超过 max_keys
+    """
+    name = pipeline.name
+    lines = {"forward": 0, "process": 0}
+
+    processed = {}
+    process_keys, errors = _stream_keys(pipeline, "process", window_start_dt, window_end_dt,
+                                        query_start, query_end, lines)
+    with observe_phase(name, "join_process"):
+        for key, ts, _ in process_keys:
+            if key not in processed and (accept is None or accept(key)):
+                processed[key] = ts
+                if max_keys is not None and len(processed) > max_keys:
+                    raise _PartitionOverflow()
+    COUNTER_LOKI_LINES.labels(pipeline=name, stream="process").inc(lines["process"])
+    _add_parse_errors(name, "process", errors)
+
+    matched = 0
+    lost = {}
+    forward_keys, errors = _stream_keys(pipeline, "forward", window_start_dt, window_end_dt,
+                                        query_start, query_end, lines)
+    with observe_phase(name, "join_forward"):
+        for key, ts, text in forward_keys:
+            process_ts = processed.get(key)
+            if process_ts is None:
+                if key not in lost and (accept is None or accept(key)):
+                    lost[key] = key if text is None else _forward_file_name(pipeline, text, key)
+                    if max_keys is not None and len(processed) + len(lost) > max_keys:
+                        raise _PartitionOverflow()
+            elif process_ts != _MATCHED:
+                # 以每个文件的首条转发日志和首条处理日志计算延迟
+                latency.add((process_ts - ts) / 1e9)
+                processed[key] = _MATCHED
+                matched += 1
+    COUNTER_LOKI_LINES.labels(pipeline=name, stream="forward").inc(lines["forward"])
+    _add_parse_errors(name, "forward", errors)
+    return matched + len(lost), len(processed), lost
+
+
+def reconcile_exact(pipeline: Pipeline, window_start_dt: datetime, window_end_dt: datetime,
+                    query_start: float, query_end: float):
+    """
+    精确对账：按文件名或关联ID（pipeline.join_key）流式关联转发与处理日志，同时计算延迟分布
+    :return: (转发文件数, 处理文件数, 丢失文件数, 丢失文件名集合, LatencyDigest)
+    """
+    latency = LatencyDigest()
+    forward_count, process_count, lost = _join_window(
+        pipeline, window_start_dt, window_end_dt, query_start, query_end, latency)
+    return forward_count, process_count, len(lost), set(lost.values()), latency
+
+
+# partitioned 模式下每条流水线上一窗口一轮关联所需的键数（处理文件数 + 丢失文件数），用于估算下一个窗口的分区数
+_expected_partition_keys = {}
 
+
+def reconcile_partitioned(pipeline: Pipeline, window_start_dt: datetime, window_end_dt: datetime,
+                          query_start: float, query_end: float):
+    """
+    内存有界的精确对账：按键的哈希把窗口分成 P 个分区，每一轮重新流式读取两侧日志、只关联一个分区，
+    内存中只保留约 1/P 的键。计数、丢失文件和延迟分布与 exact 完全一致，代价是日志读取 P 次。
+    分区数按上一窗口的键数估算，一轮超过 RECONCILE_PARTITION_KEYS 时分区数加倍，从头重新对账。
+    丢失文件名最多保存 RECONCILE_MAX_LOST_NAMES 个，超出的只计入丢失文件数
+    :return: (转发文件数, 处理文件数, 丢失文件数, 丢失文件名集合, LatencyDigest)
+    """
+    name = pipeline.name
+    max_keys = max(1, RECONCILE_PARTITION_KEYS)
+    partitions = max(1, -(-int(_expected_partition_keys.get(name, 0) * 1.2) // max_keys))
+    while True:
+        latency = LatencyDigest()
+        forward_count = process_count = lost_count = 0
+        lost_files = set()
+        try:
+            for partition in range(partitions):
+                pass_forward, pass_process, lost = _join_window(
+                    pipeline, window_start_dt, window_end_dt, query_start, query_end, latency,
+                    accept=None if partitions == 1 else lambda key: hash(key) % partitions == partition,
+                    max_keys=max_keys)
+                forward_count += pass_forward
+                process_count += pass_process
+                lost_count += len(lost)
+                for file_name in lost.values():
+                    if len(lost_files) >= RECONCILE_MAX_LOST_NAMES:
+                        break
+                    lost_files.add(file_name)
+        except _PartitionOverflow:
+            partitions *= 2
+            logger.warning(f"[{name}] More than {max_keys} keys in one partition, retrying with {partitions} partitions")
+            continue
+        break
+
+    _expected_partition_keys[name] = process_count + lost_count
+    GAUGE_RECONCILE_PASSES.labels(pipeline=name).set(partitions)
+    if lost_count > len(lost_files):
+        COUNTER_LOST_NAMES_DROPPED.labels(pipeline=name).inc(lost_count - len(lost_files))
+        logger.warning(
+            f"[{name}] {lost_count} lost files, only the first {len(lost_files)} names are stored "
+            f"(RECONCILE_MAX_LOST_NAMES)")
+    return forward_count, process_count, lost_count, lost_files, latency
+
+
+def update_window_gauges(name: str, window_end_ts: float, forward_count: int, process_count: int,
+                         lost_count: int) -> bool:
+    """
+    用一个窗口的审计结果更新流水线级别的 Gauge，只有窗口结束时间不早于已完成的最新窗口时才更新
+    :param name: 流水线名称
+    :param window_end_ts: 窗口结束时间（秒）
+    :return: 是否更新了 Gauge
+    """
+    with _latest_window_lock:
+        if window_end_ts < _latest_window_ends.get(name, float("-inf")):
+            return False
+        _latest_window_ends[name] = window_end_ts
+        GAUGE_LOST_FILES.labels(pipeline=name).set(lost_count)
+        GAUGE_TOTAL_FORWARD.labels(pipeline=name).set(forward_count)
+        GAUGE_TOTAL_PROCESS.labels(pipeline=name).set(process_count)
+        GAUGE_AUDIT_LAG.labels(pipeline=name).set(time.time() - window_end_ts)
+    return True
+
+
+def run_audit(report_writer: ReportWriter, pipeline: Pipeline,
+              window_start_dt: datetime, window_end_dt: datetime):
+    """
+    审计一条流水线在一个“文件时间”窗口 [window_start_dt, window_end_dt) 内的丢失情况
+    窗口由 AuditScheduler 在固定网格上计算，比如间隔5分钟，偏移5分钟，
+    10:10 时审计的窗口为 10:00 ~ 10:05
+
+    :param report_writer: 报告写入器
+    :type report_writer: ReportWriter
+    :param pipeline: 待审计的流水线
+    :param window_start_dt: 窗口开始时间（包含）
+    :param window_end_dt: 窗口结束时间（不包含）
+    """
+    name = pipeline.name
     logger.info(
-        f"Starting audit for file time window: {window_start_dt} to {window_end_dt}"
+        f"[{name}] Starting audit for file time window: {window_start_dt} to {window_end_dt}"
     )
 
-    # --- 1. 获取 Forward Service 日志 ---
+    # --- 1. 获取日志并比对 ---
     # 为了确保不漏掉日志，Loki查询的时间范围要比文件时间窗口宽一点 (前后各加WINDOW_EXTEND_SECONDS秒buffer)
     loki_query_start = window_start_dt.timestamp() - WINDOW_EXTEND_SECONDS
     loki_query_end = window_end_dt.timestamp() + WINDOW_EXTEND_SECONDS
-
-    forward_files = set()
-
-    # 查询 Forward Service
-    q_forward = '{service="forward_svc"} |= "Rename trigger hard link"'
-    logs = get_loki_logs(q_forward, loki_query_start, loki_query_end)
-
-    for stream in logs:
-        for value in stream["values"]:
-            log_line = value[1]  # value[0] is timestamp, value[1] is line
-            try:
-                # 解析 JSON
-                log_json = json.loads(log_line)
-                msg = log_json.get("msg", "")
-
-                # 正则提取路径
-                match = FORWARD_PATTERN.search(msg)
-                if match:
-                    filepath = match.group(1)
-                    fname, ftime = extract_filename_and_ts(filepath)
-
-                    # 关键逻辑：只统计文件名时间戳落在目标窗口内的文件
-                    if ftime and window_start_dt <= ftime < window_end_dt:
-                        forward_files.add(fname)
-            except json.JSONDecodeError:
-                continue  # 忽略非JSON行
-            except Exception as e:
-                logger.warning(f"Error parsing forward log: {e}")
-
-    # --- 2. 获取 Process Service 日志 ---
-    process_files = set()
-    q_process = '{service="process_svc"} |= "处理文件" |= "成功"'
-    logs = get_loki_logs(q_process, loki_query_start, loki_query_end)
-
-    for stream in logs:
-        for value in stream["values"]:
-            log_line = value[1]
-            # 正则提取路径 (非JSON格式)
-            match = PROCESS_PATTERN.search(log_line)
-            if match:
-                filepath = match.group(1)
-                fname, ftime = extract_filename_and_ts(filepath)
-
-                if ftime and window_start_dt <= ftime < window_end_dt:
-                    process_files.add(fname)
-
-    # --- 3. 比对与统计 ---
-    lost_files = forward_files - process_files
-    lost_count = len(lost_files)
-
+    # bloom 为 partitioned 的旧名称
+    reconcile = reconcile_partitioned if RECONCILE_MODE in ("partitioned", "bloom") else reconcile_exact
+    forward_count, process_count, lost_count, lost_files, latency = reconcile(
+        pipeline, window_start_dt, window_end_dt, loki_query_start, loki_query_end)
+
+    latency_fields = {
+        "latency_p50_ms": _to_ms(latency.percentile(0.5)),
+        "latency_p90_ms": _to_ms(latency.percentile(0.9)),
+        "latency_p99_ms": _to_ms(latency.percentile(0.99)),
+        "latency_max_ms": _to_ms(latency.max if latency.count else None),
+    }
     logger.info(
-        f"Audit Result: Forwarded={len(forward_files)}, Processed={len(process_files)}, Lost={lost_count}"
+        f"[{name}] Audit Result: Forwarded={forward_count}, Processed={process_count}, Lost={lost_count}, "
+        f"Delay p50/p99={latency_fields['latency_p50_ms']}/{latency_fields['latency_p99_ms']}ms"
     )
 
-    # --- 4. 更新 Prometheus Metrics ---
-    GAUGE_LOST_FILES.set(lost_count)
-    GAUGE_TOTAL_FORWARD.set(len(forward_files))
-    GAUGE_TOTAL_PROCESS.set(len(process_files))
-    # --- 5. 生成审计报告 ---
+    # --- 2. 更新 Prometheus Metrics ---
+    update_window_gauges(name, window_end_dt.timestamp(), forward_count, process_count, lost_count)
+    LATENCY_COLLECTOR.observe_digest(name, latency)
+    # --- 3. 生成审计报告 ---
     # 只有当有丢失文件时，或者强制生成报告时写入
     report_data = {
+        "pipeline": name,
+        "shard": pipeline.shard or None,
         "audit_window_start": window_start_dt.isoformat(),
         "audit_window_end": window_end_dt.isoformat(),
-        "forward_count": len(forward_files),
-        "process_count": len(process_files),
-        "lost_count": lost_count
+        "forward_count": forward_count,
+        "process_count": process_count,
+        "lost_count": lost_count,
+        **latency_fields,
     }
 
-    dao_handler.create_report_with_lost_files(
-        report_data=report_data, lost_files_list=list(lost_files)
-    )
+    # 报告交给写入线程异步落库，数据库慢或不可用时不阻塞后续审计
+    report_writer.submit(report_data, list(lost_files))
     logger.info(
-        f"Audit report: {len(forward_files)} forwarded, {len(process_files)} processed, {lost_count} lost. Report saved."
+        f"[{name}] Audit report: {forward_count} forwarded, {process_count} processed, {lost_count} lost. Report queued."
     )
 
 
 if __name__ == "__main__":
-    # 启动 Prometheus Metrics Server
-    start_http_server(8000)
-    logger.info("Metrics server started on port 8000")
+    # 启动 Prometheus Metrics Server（同端口提供丢失文件查询接口 /lost_files）
+    start_api_server(8000)
+    logger.info("Metrics and lookup API server started on port 8000")
     # Create the default db session
     db_root_password = os.getenv('DB_ROOT_PASSWORD', '')
     db_user = os.getenv('DB_USER', 'root')
@@ -201,82 +510,129 @@ if __name__ == "__main__":
     db_name = os.getenv('DB_NAME', 'watcher_db')
     user_pass_part = f"{db_user}:{db_password}" if db_password else db_user
 
-    # 首次连接：使用mysql系统数据库（用于创建目标数据库）
-    DB_URL = f"mysql+pymysql://root:{db_root_password}@{db_host}:{db_port}/test_db?charset=utf8mb4"
-    logger.info(f"Connecting to the base database by {DB_URL} for setup")
+    # 使用mysql系统数据库创建目标数据库并授权，只在目标数据库不可用时执行
+    ROOT_DB_URL = f"mysql+pymysql://root:{db_root_password}@{db_host}:{db_port}/test_db?charset=utf8mb4"
 
-    base_engine = create_engine(DB_URL, echo=False)
-    # 创建目标数据库（如果不存在）
-    max_retries = 20  # 最多重试20次
-    retry_interval = 3  # 每次重试间隔3秒
-    retry_count = 0
-
-    # 测试连接，若失败则重试
-    while retry_count < max_retries:
+    def bootstrap_database():
+        logger.info(f"Connecting to the base database by {ROOT_DB_URL} for setup")
+        base_engine = create_engine(ROOT_DB_URL, echo=False)
         try:
-            base_engine = create_engine(DB_URL, echo=False)
-            with base_engine.connect():
-                logger.info("[root] 成功连接到MySQL基础数据库！")
-                break
-        except SQLAlchemyError as e:
-            retry_count += 1
-            logger.warning(
-                f"[root] root user连接MySQL失败（{retry_count}/{max_retries}）：{e}")
-            if retry_count >= max_retries:
-                logger.error("[root] 重试次数耗尽，无法连接MySQL，退出程序")
-                raise
-            time.sleep(retry_interval)
-    # 连接成功，创建目标数据库
-    try:
-        with base_engine.connect() as conn:
-            # 执行创建数据库的原生 SQL（IF NOT EXISTS 避免已存在时报错）
-            # 指定字符集 utf8mb4，避免后续中文乱码
-            create_db_sql = text(
-                f"CREATE DATABASE IF NOT EXISTS {db_name} DEFAULT CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci;")
-            conn.execute(create_db_sql)
-            # DDL 操作（创建数据库/表）自动提交，无需手动 commit
-            grant_sql = text(
-                f"GRANT ALL PRIVILEGES ON {db_name}.* TO 'user'@'%' WITH GRANT OPTION;"
-            )
-            conn.execute(grant_sql)
-            conn.commit()  # 提交权限修改
-            logger.info(
-                f"[root] 目标数据库 {db_name} 检测/创建完成（存在则跳过，不存在则创建）")
-    except SQLAlchemyError as e:
-        logger.error(
-            f"[root] 创建数据库失败：{str(e)}")
-    finally:
-        # 关闭基础引擎，释放连接
-        base_engine.dispose()
+            with base_engine.connect() as conn:
+                # 执行创建数据库的原生 SQL（IF NOT EXISTS 避免已存在时报错）
+                # 指定字符集 utf8mb4，避免后续中文乱码
+                create_db_sql = text(
+                    f"CREATE DATABASE IF NOT EXISTS {db_name} DEFAULT CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci;")
+                conn.execute(create_db_sql)
+                # DDL 操作（创建数据库/表）自动提交，无需手动 commit
+                grant_sql = text(
+                    f"GRANT ALL PRIVILEGES ON {db_name}.* TO 'user'@'%' WITH GRANT OPTION;"
+                )
+                conn.execute(grant_sql)
+                conn.commit()  # 提交权限修改
+                logger.info(
+                    f"[root] 目标数据库 {db_name} 检测/创建完成（存在则跳过，不存在则创建）")
+        finally:
+            # 关闭基础引擎，释放连接
+            base_engine.dispose()
 
-    # Reconnect to the target database
     DB_URL = f"mysql+pymysql://{user_pass_part}@{db_host}:{db_port}/{db_name}?charset=utf8mb4"
     engine = create_engine(DB_URL, echo=True,
-                           pool_size=5,
-                           max_overflow=10)
-    # 若表未创建，先创建表（仅首次执行）
-    Base.metadata.create_all(engine)
+                           pool_size=AUDIT_MAX_CONCURRENCY,
+                           max_overflow=10,
+                           pool_pre_ping=True)
+
+    def probe_target_database():
+        try:
+            probe_database(engine)
+        except OperationalError as e:
+            # 1049: 目标数据库不存在；1044: 用户尚未获得授权，用 root 初始化后再探测
+            if e.orig is None or not e.orig.args or e.orig.args[0] not in (1044, 1049):
+                raise
+            bootstrap_database()
+            probe_database(engine)
+
+    # 按指数退避探测数据库就绪，代替固定间隔、固定次数的重试
+    wait_until_ready(probe_target_database, "Database", STARTUP_DB_TIMEOUT_SECONDS)
+    # 建表并补齐旧表缺少的列和索引，迁移失败或仍缺少列时拒绝启动
+    ensure_schema(engine, Base.metadata, migrate=DB_AUTO_MIGRATE)
     Session = sessionmaker(bind=engine)
+    set_session_factory(Session)
     db_session = Session()
     dao = WatcherDao(db_session)
+    if DB_AUTO_MIGRATE:
+        filled = dao.backfill_derived_columns()
+        if any(filled.values()):
+            logger.info(f"Backfilled derived columns of existing rows: {filled}")
     logger.info("[user] 数据库连接成功，WatcherDao 初始化完成")
+    retention = RetentionManager()
+
+    if INGEST_BACKEND == "loki":
+        try:
+            wait_until_ready(lambda: probe_loki(LOKI_URL), "Loki", STARTUP_LOKI_TIMEOUT_SECONDS)
+        except Exception:
+            # Loki 未就绪时审计会失败并由调度器重试，不阻止启动
+            logger.warning("Starting without a ready Loki, failed audits will be retried")
 
-    # 首次启动立即运行一次，或者先sleep
     logger.info(f"Service started. Interval: {CHECK_INTERVAL_SECONDS}s")
-    logger.info(
-        f"Sleep {CHECK_INTERVAL_SECONDS} secs first to wait for enough datas")
-    time.sleep(CHECK_INTERVAL_SECONDS)
-    logger.info(
-        f"Sleep {WINDOW_EXTEND_SECONDS}*2 secs to wait for enough extend window"
+    if RECONCILE_MODE == "bloom":
+        logger.warning("RECONCILE_MODE=bloom is deprecated and now runs the exact partitioned reconcile, "
+                       "set RECONCILE_MODE=partitioned")
+    elif RECONCILE_MODE not in ("exact", "partitioned"):
+        raise ValueError(f"Unknown RECONCILE_MODE {RECONCILE_MODE!r}, expected exact or partitioned")
+
+    pipelines = {pipeline.name: pipeline for pipeline in load_pipelines(PIPELINES_CONFIG)}
+    logger.info(f"Loaded {len(pipelines)} pipelines: {list(pipelines)}")
+    for pipeline in pipelines.values():
+        GAUGE_PIPELINE_INFO.labels(pipeline=pipeline.name, shard=pipeline.shard).set(1)
+
+    if INGEST_BACKEND == "tail":
+        # 内存中保留足够覆盖积压窗口的日志行：窗口 + 偏移 + 前后扩展，再留一个窗口的余量
+        tail_source = TailSource(retention_seconds=2 * CHECK_INTERVAL_SECONDS
+                                 + WINDOW_OFFSET_SECONDS + 2 * WINDOW_EXTEND_SECONDS)
+        for pipeline in pipelines.values():
+            tail_source.add(pipeline.forward_log_path, pipeline.forward_keywords)
+            tail_source.add(pipeline.process_log_path, pipeline.process_keywords)
+        # 先同步读取一次恢复缓冲，保证启动后立即执行的审计能看到重启前的日志
+        tail_source.poll_all()
+        tail_source.start()
+        logger.info(f"Tailing {len(tail_source.tailers)} log files directly, Loki is not queried")
+
+    # 报告写入线程使用独立的 Session，先补写上次退出前遗留在本地缓冲文件中的报告
+    report_writer = ReportWriter(Session)
+    report_writer.start()
+    # docker stop 发送 SIGTERM，转换为 SystemExit 以便把未写入的报告写入缓冲文件
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    def audit_window(pipeline_name: str, window_start_dt: datetime, window_end_dt: datetime):
+        run_audit(report_writer, pipelines[pipeline_name], window_start_dt, window_end_dt)
+
+    scheduler = AuditScheduler(
+        audit_fn=audit_window,
+        keys=list(pipelines),
+        interval_seconds=CHECK_INTERVAL_SECONDS,
+        offset_seconds=WINDOW_OFFSET_SECONDS,
+        max_concurrency=AUDIT_MAX_CONCURRENCY,
+        retry_delay_seconds=AUDIT_RETRY_MIN_SECONDS,
+        retry_max_delay_seconds=AUDIT_RETRY_MAX_SECONDS,
+        on_idle=lambda: retention.maybe_run(dao),
     )
-    time.sleep(WINDOW_EXTEND_SECONDS * 2)
-
-    while True:
-        logger.info(f"Start to run an audit")
-        try:
-            run_audit(dao)
-        except Exception as e:
-            logger.error(f"Audit loop failed: {e}")
-        logger.info(
-            f"Audit completed. Sleeping for {CHECK_INTERVAL_SECONDS} seconds.")
-        time.sleep(CHECK_INTERVAL_SECONDS)
+    # 补跑范围内缺少报告（未落库，也不在本地缓冲文件中）的所有窗口，首次启动的流水线立即审计最新的就绪窗口
+    # tail 模式的内存缓冲只覆盖最新的就绪窗口，更早的窗口无法补跑
+    resume_windows = 1 if INGEST_BACKEND == "tail" else RESUME_MAX_WINDOWS
+    resume_since = datetime.fromtimestamp(
+        scheduler.latest_ready_end() - (resume_windows - 1) * CHECK_INTERVAL_SECONDS)
+    audited_windows = dao.get_audited_windows(resume_since)
+    first_window_ends = dao.get_first_window_ends()
+    for pipeline_name, window_ends in report_writer.spooled_windows().items():
+        audited_windows.setdefault(pipeline_name, set()).update(window_ends)
+        first_end = min(window_ends)
+        if pipeline_name not in first_window_ends or first_end < first_window_ends[pipeline_name]:
+            first_window_ends[pipeline_name] = first_end
+    scheduler.resume({name: {window_end.timestamp() for window_end in window_ends}
+                      for name, window_ends in audited_windows.items()},
+                     {name: window_end.timestamp() for name, window_end in first_window_ends.items()},
+                     resume_windows)
+    try:
+        scheduler.run_forever()
+    finally:
+        report_writer.close()
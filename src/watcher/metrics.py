@@ -0,0 +1,191 @@
+"""
+Prometheus metrics exported by the watcher.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import HistogramMetricFamily
+
+from latency import EXPORT_BUCKET_BOUNDS, LatencyDigest
+
+# --- 审计结果 ---
+GAUGE_LOST_FILES = Gauge(
+    "log_audit_lost_files_count", "Number of files forwarded but not processed", ["pipeline"]
+)
+GAUGE_TOTAL_FORWARD = Gauge(
+    "log_audit_forward_count", "Total files forwarded in the window", ["pipeline"]
+)
+GAUGE_TOTAL_PROCESS = Gauge(
+    "log_audit_process_count", "Total files processed in the window", ["pipeline"]
+)
+
+# --- 审计过程 ---
+# 分阶段耗时：获取日志（Loki 分页查询或 tail 模式的本地缓冲）、解析与关联流式进行，join_process 为读取处理侧并建立 键->时间戳 映射，
+# join_forward 为读取转发侧并逐条关联、记录丢失文件（报告落库由 ReportWriter 异步完成，见 log_audit_persist_*）；
+# partitioned 模式下为各轮之和
+HISTOGRAM_PHASE_DURATION = Histogram(
+    "log_audit_phase_duration_seconds",
+    "Wall time spent in each phase of run_audit",
+    ["pipeline", "phase"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+COUNTER_PHASE_CPU = Counter(
+    "log_audit_phase_cpu_seconds_total",
+    "CPU time spent in each phase of run_audit",
+    ["pipeline", "phase"],
+)
+COUNTER_LOKI_LINES = Counter(
+    "log_audit_loki_lines_total", "Log lines fetched from Loki", ["pipeline", "stream"]
+)
+COUNTER_LOKI_BYTES = Counter(
+    "log_audit_loki_bytes_total", "Response bytes fetched from Loki", ["pipeline", "stream"]
+)
+COUNTER_PARSE_ERRORS = Counter(
+    "log_audit_parse_errors_total",
+    "Log lines skipped while parsing (json: invalid JSON, no_match: pattern not found, "
+    "filename: no timestamp in file name, no_cid: no correlation ID)",
+    ["pipeline", "stream", "reason"],
+)
+COUNTER_DB_ROWS = Counter(
+    "log_audit_db_rows_written_total", "Rows written to the database", ["pipeline", "table"]
+)
+GAUGE_RECONCILE_PASSES = Gauge(
+    "log_audit_reconcile_passes",
+    "Partitions (passes over both streams) used by the last window in partitioned reconcile mode",
+    ["pipeline"],
+)
+COUNTER_LOST_NAMES_DROPPED = Counter(
+    "log_audit_lost_names_dropped_total",
+    "Lost files counted in lost_count but not stored by name (over RECONCILE_MAX_LOST_NAMES)",
+    ["pipeline"],
+)
+GAUGE_AUDIT_LAG = Gauge(
+    "log_audit_lag_seconds",
+    "Wall-clock time minus the end of the latest audited file-time window",
+    ["pipeline"],
+)
+# 流水线 -> 分片的映射（值恒为1），查询时按 pipeline 标签关联即可按分片聚合
+GAUGE_PIPELINE_INFO = Gauge(
+    "log_audit_pipeline_info",
+    "Shard tag of each audited pipeline (always 1), join on the pipeline label to group by shard",
+    ["pipeline", "shard"],
+)
+
+
+class ForwardToProcessLatencyCollector:
+    """
+    转发到处理的端到端延迟直方图
+    每个窗口的延迟先在 LatencyDigest 中汇总，再整体并入累计分桶，避免逐文件调用 Histogram.observe
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, List[int]] = {}
+        self._sums: Dict[str, float] = {}
+
+    def observe_digest(self, pipeline: str, digest: LatencyDigest):
+        exported = digest.export_buckets() + [digest.count]
+        with self._lock:
+            buckets = self._buckets.setdefault(pipeline, [0] * len(exported))
+            for i, value in enumerate(exported):
+                buckets[i] += value
+            self._sums[pipeline] = self._sums.get(pipeline, 0.0) + digest.total
+
+    def collect(self):
+        family = HistogramMetricFamily(
+            "log_audit_forward_to_process_seconds",
+            "Delay between the forward log line and the process log line of the same file",
+            labels=["pipeline"],
+        )
+        with self._lock:
+            for pipeline, buckets in self._buckets.items():
+                bounds = [str(bound) for bound in EXPORT_BUCKET_BOUNDS] + ["+Inf"]
+                family.add_metric([pipeline], list(zip(bounds, buckets)), self._sums[pipeline])
+        yield family
+
+
+LATENCY_COLLECTOR = ForwardToProcessLatencyCollector()
+REGISTRY.register(LATENCY_COLLECTOR)
+
+# --- 报告写入 ---
+GAUGE_PERSIST_QUEUE = Gauge(
+    "log_audit_persist_queue_size", "Reports waiting in memory to be written to the database"
+)
+GAUGE_PERSIST_SPOOLED = Gauge(
+    "log_audit_persist_spooled_reports",
+    "Reports buffered in the local spool file until the database accepts writes again",
+)
+HISTOGRAM_PERSIST_BATCH = Histogram(
+    "log_audit_persist_batch_seconds",
+    "Wall time of one batched report transaction",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+COUNTER_PERSIST_FAILURES = Counter(
+    "log_audit_persist_failures_total", "Report batches that failed to commit and were spooled"
+)
+COUNTER_PERSIST_DEAD_LETTERS = Counter(
+    "log_audit_persist_dead_letters_total",
+    "Reports moved to the dead letter file (rejected: the database refused the report itself, "
+    "unparseable: a corrupt spool line)",
+    ["reason"],
+)
+
+# --- 本地日志直读 ---
+COUNTER_TAIL_BYTES = Counter(
+    "log_audit_tail_bytes_total", "Bytes read from tailed log files", ["path"]
+)
+COUNTER_TAIL_ROTATIONS = Counter(
+    "log_audit_tail_rotations_total", "Rotations detected on tailed log files", ["path"]
+)
+
+# --- 调度器 ---
+GAUGE_SCHEDULER_PENDING = Gauge(
+    "log_audit_scheduler_pending_jobs",
+    "Audit jobs (window x pipeline) that are ready but not yet audited successfully",
+)
+GAUGE_SCHEDULER_RUNNING = Gauge(
+    "log_audit_scheduler_running_jobs",
+    "Audit jobs currently running, bounded by the audit concurrency",
+)
+GAUGE_SCHEDULER_BEHIND = Gauge(
+    "log_audit_scheduler_behind_seconds",
+    "File time between the newest ready window and the oldest pending window",
+)
+COUNTER_SCHEDULER_MISSED = Counter(
+    "log_audit_scheduler_missed_windows_total",
+    "Windows that became ready before the scheduler could enqueue them",
+)
+COUNTER_SCHEDULER_OVERRUNS = Counter(
+    "log_audit_scheduler_overruns_total",
+    "Audit jobs that took longer than the check interval",
+)
+COUNTER_SCHEDULER_FAILURES = Counter(
+    "log_audit_scheduler_failed_audits_total",
+    "Audit jobs that raised and were queued for retry",
+)
+COUNTER_SCHEDULER_ABANDONED = Counter(
+    "log_audit_scheduler_abandoned_windows_total",
+    "Audit jobs dropped without a report because the log source no longer covers the window",
+)
+
+
+@contextmanager
+def observe_phase(pipeline: str, phase: str):
+    """
+    统计代码块的耗时与CPU时间，分别记入阶段耗时直方图和CPU计数器
+    :param pipeline: 流水线名称
+    :param phase: 阶段名称
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        HISTOGRAM_PHASE_DURATION.labels(pipeline=pipeline, phase=phase).observe(
+            time.perf_counter() - wall_start)
+        COUNTER_PHASE_CPU.labels(pipeline=pipeline, phase=phase).inc(
+            time.thread_time() - cpu_start)
@@ -0,0 +1,390 @@
+"""
+Asynchronous report persistence: a bounded queue drained by a batching writer thread,
+with a local spool file while the database is unavailable.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, SQLAlchemyError, StatementError
+from sqlalchemy.orm import Session
+
+from dao import WatcherDao
+from metrics import (
+    COUNTER_DB_ROWS,
+    COUNTER_PERSIST_DEAD_LETTERS,
+    COUNTER_PERSIST_FAILURES,
+    GAUGE_PERSIST_QUEUE,
+    GAUGE_PERSIST_SPOOLED,
+    HISTOGRAM_PERSIST_BATCH,
+)
+
+# 待写入报告队列的容量，队列满时直接写入本地缓冲文件，不阻塞审计
+PERSIST_QUEUE_SIZE = int(os.getenv("PERSIST_QUEUE_SIZE", "1000"))
+# 单个事务写入的报告数上限
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "50"))
+# 写入失败后的重试间隔（指数退避，从 PERSIST_RETRY_MIN_SECONDS 翻倍到 PERSIST_RETRY_MAX_SECONDS）
+PERSIST_RETRY_MIN_SECONDS = float(os.getenv("PERSIST_RETRY_MIN_SECONDS", "1"))
+PERSIST_RETRY_MAX_SECONDS = float(os.getenv("PERSIST_RETRY_MAX_SECONDS", "60"))
+# 数据库不可用时报告的本地缓冲文件（JSON Lines），恢复后按顺序补写
+PERSIST_SPOOL_PATH = os.getenv("PERSIST_SPOOL_PATH", "/data/reports/report_spool.jsonl")
+# 死信文件（JSON Lines）：数据本身有问题、重试也无法写入的报告，以及缓冲文件中无法解析的行
+PERSIST_DEAD_LETTER_PATH = os.getenv("PERSIST_DEAD_LETTER_PATH", "/data/reports/report_dead_letter.jsonl")
+
+logger = logging.getLogger(__name__)
+
+ReportItem = Tuple[Dict[str, Any], List[str]]
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """
+    判断写入错误是否为数据本身的问题（重试也不会成功）：
+    - 数据库拒绝的数据（DataError：超长、类型不符等；IntegrityError：约束冲突）
+    - 发送到数据库之前的参数处理失败，以及构建报告对象时的异常（报告字段有问题）
+    其余数据库错误（连接断开、超时、表结构尚未迁移等）视为暂时性错误，退避后重试
+    """
+    if isinstance(error, (DataError, IntegrityError)):
+        return True
+    if isinstance(error, DBAPIError):
+        return False
+    if isinstance(error, StatementError):
+        return True
+    return not isinstance(error, SQLAlchemyError)
+
+
+def _encode(report_data: Dict[str, Any], lost_files_list: List[str]) -> str:
+    return json.dumps({"report": report_data, "lost_files": lost_files_list}, ensure_ascii=False) + "\n"
+
+
+def _read_spool(path: str) -> Tuple[List[ReportItem], List[str]]:
+    """
+    读取缓冲文件
+    :return: (可解析的报告列表, 无法解析的原始行列表)；文件不存在时均为空
+    """
+    items, bad_lines = [], []
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    items.append((dict(record["report"]), list(record["lost_files"])))
+                except (ValueError, KeyError, TypeError):
+                    # 进程在追加写入时崩溃会留下不完整的行
+                    bad_lines.append(line.rstrip("\n"))
+    except FileNotFoundError:
+        pass
+    return items, bad_lines
+
+
+class ReportWriter:
+    """
+    审计报告的异步写入器：
+    - run_audit 通过 submit() 把报告放入有界队列后立即返回，审计节奏不受数据库延迟影响
+    - 后台线程把队列中的报告按批在一个事务中写入（每批使用新的 Session）
+    - 暂时性错误时整批追加到本地缓冲文件并按指数退避重试；退避期间新的报告直接写入缓冲文件，
+      数据库恢复后先补写缓冲文件再写新报告，报告不会因数据库故障而丢失
+    - 数据错误时逐条重写找出有问题的报告，移入死信文件，不阻塞后续报告
+    - 启动时补写上次退出前遗留的缓冲文件，无法解析的行（例如崩溃时写了一半的行）移入死信文件
+    - 写入线程中的任何异常都只记录日志并重试，线程不会退出
+    补写过程中进程崩溃时，已提交但尚未从缓冲文件移除的一批报告可能被重复写入
+    """
+
+    def __init__(self,
+                 session_factory: Callable[[], Session],
+                 queue_size: int = PERSIST_QUEUE_SIZE,
+                 batch_size: int = PERSIST_BATCH_SIZE,
+                 spool_path: str = PERSIST_SPOOL_PATH,
+                 retry_min_seconds: float = PERSIST_RETRY_MIN_SECONDS,
+                 retry_max_seconds: float = PERSIST_RETRY_MAX_SECONDS,
+                 dead_letter_path: str = PERSIST_DEAD_LETTER_PATH):
+        """
+        :param session_factory: 创建数据库 Session 的工厂（sessionmaker）
+        :param queue_size: 队列容量
+        :param batch_size: 单个事务写入的报告数上限
+        :param spool_path: 本地缓冲文件路径
+        :param retry_min_seconds: 首次重试的等待时间
+        :param retry_max_seconds: 重试等待时间上限
+        :param dead_letter_path: 死信文件路径
+        """
+        self.session_factory = session_factory
+        self.batch_size = max(1, batch_size)
+        self.spool_path = spool_path
+        self.dead_letter_path = dead_letter_path
+        self.retry_min_seconds = retry_min_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self._queue: "queue.Queue[ReportItem]" = queue.Queue(maxsize=queue_size)
+        self._spool_lock = threading.Lock()
+        self._terminate_torn_line()
+        self._spooled = self._count_spooled()
+        self._backoff = 0.0
+        self._next_attempt = 0.0
+        # 写入线程出错时尚未处理完的一批报告，下一轮重试，关闭时写入缓冲文件
+        self._held: List[ReportItem] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        GAUGE_PERSIST_SPOOLED.set(self._spooled)
+
+    def submit(self, report_data: Dict[str, Any], lost_files_list: List[str]):
+        """
+        提交一份报告等待写入，不阻塞；队列已满时直接写入本地缓冲文件
+        """
+        item = (report_data, list(lost_files_list))
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            logger.warning("Report queue is full, spooling report to disk")
+            self._spool([item])
+        GAUGE_PERSIST_QUEUE.set(self._queue.qsize())
+
+    def start(self):
+        """
+        启动后台写入线程
+        """
+        self._thread = threading.Thread(target=self._run, name="report-writer", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 10):
+        """
+        停止写入线程，尚未写入的报告写入本地缓冲文件，下次启动时补写
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        remaining = self._held + self._drain(block=False)
+        self._held = []
+        if remaining:
+            self._spool(remaining)
+            logger.info(f"Spooled {len(remaining)} unwritten reports on shutdown")
+
+    def write_pending(self) -> bool:
+        """
+        在当前线程中同步写入队列中的所有报告（用于未启动写入线程的场景，例如基准测试）
+        :return: 全部写入成功返回True，暂时性失败的报告写入本地缓冲文件并返回False
+        """
+        ok = True
+        while True:
+            batch = self._drain(block=False)
+            if not batch:
+                return ok
+            rest = self._write(batch)
+            if rest:
+                self._spool(rest)
+                ok = False
+
+    def spooled_windows(self) -> Dict[str, Set[datetime]]:
+        """
+        本地缓冲文件中每条流水线的审计窗口结束时间（这些报告尚未落库，重启后补跑时需一并视为已审计）
+        无法解析的行会被跳过，补写时再移入死信文件
+        """
+        windows: Dict[str, Set[datetime]] = {}
+        with self._spool_lock:
+            for path in (self.spool_path, f"{self.spool_path}.replay"):
+                for report_data, _ in _read_spool(path)[0]:
+                    try:
+                        window_end = datetime.fromisoformat(report_data["audit_window_end"])
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    windows.setdefault(report_data.get("pipeline", "default"), set()).add(window_end)
+        return windows
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if not self._held:
+                    self._held = self._drain(block=True)
+                if self._spooled and time.monotonic() >= self._next_attempt:
+                    self._replay_spool()
+                if self._held:
+                    self._persist(self._held)
+                    self._held = []
+            except Exception as e:
+                # 写入线程不能退出，否则后续报告会永远留在队列中；保留当前批次，稍后重试
+                logger.exception(f"Report writer failed with {len(self._held)} reports in hand, "
+                                 f"retrying in {self.retry_min_seconds}s: {e}")
+                self._stop.wait(self.retry_min_seconds)
+
+    def _persist(self, batch: List[ReportItem]):
+        if self._spooled or time.monotonic() < self._next_attempt:
+            # 数据库不可用或仍有未补写的报告，追加到缓冲文件以保持写入顺序
+            self._spool(batch)
+            return
+        rest = self._write(batch)
+        if rest:
+            self._spool(rest)
+
+    def _drain(self, block: bool) -> List[ReportItem]:
+        """
+        取出一批报告；block 为 True 时最多等待一秒
+        """
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=1))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        GAUGE_PERSIST_QUEUE.set(self._queue.qsize())
+        return batch
+
+    def _commit(self, batch: List[ReportItem]) -> Optional[Exception]:
+        """
+        在一个事务中写入一批报告
+        :return: 成功返回None，失败返回异常
+        """
+        started = time.perf_counter()
+        error = None
+        try:
+            session = self.session_factory()
+            try:
+                WatcherDao(session).batch_create_reports_with_lost_files(batch)
+            finally:
+                session.close()
+        except Exception as e:
+            error = e
+        HISTOGRAM_PERSIST_BATCH.observe(time.perf_counter() - started)
+        if error is None:
+            for report_data, lost_files_list in batch:
+                pipeline = report_data.get("pipeline", "default")
+                COUNTER_DB_ROWS.labels(pipeline=pipeline, table="reports").inc()
+                COUNTER_DB_ROWS.labels(pipeline=pipeline, table="lost_files").inc(len(lost_files_list))
+        return error
+
+    def _write(self, batch: List[ReportItem]) -> List[ReportItem]:
+        """
+        写入一批报告：
+        - 暂时性错误时进入退避，整批返回给调用方写入缓冲文件
+        - 数据错误时逐条重写，有问题的报告移入死信文件，其余照常写入
+        :return: 因暂时性错误尚未写入的报告（保持原顺序），全部处理完返回空列表
+        """
+        error = self._commit(batch)
+        if error is None:
+            self._backoff = 0.0
+            return []
+        if is_permanent_error(error):
+            if len(batch) == 1:
+                self._dead_letter(batch[0], error)
+                return []
+            logger.warning(f"Batch of {len(batch)} reports rejected ({error}), writing them one by one")
+            for i, item in enumerate(batch):
+                if self._write([item]):
+                    return batch[i:]
+            return []
+        COUNTER_PERSIST_FAILURES.inc()
+        self._backoff = min(max(self._backoff * 2, self.retry_min_seconds), self.retry_max_seconds)
+        self._next_attempt = time.monotonic() + self._backoff
+        logger.warning(f"Failed to write {len(batch)} reports, retrying in {self._backoff:.0f}s: {error}")
+        return batch
+
+    def _dead_letter(self, item: ReportItem, error: Exception):
+        """
+        将无法写入的报告追加到死信文件，便于人工检查后补录
+        """
+        report_data, lost_files_list = item
+        # 只保留驱动返回的错误信息，不记录整条 SQL 和参数
+        error = getattr(error, "orig", None) or error
+        COUNTER_PERSIST_DEAD_LETTERS.labels(reason="rejected").inc()
+        logger.error(f"Report of {report_data.get('pipeline')} window ending {report_data.get('audit_window_end')} "
+                     f"rejected by the database, moved to {self.dead_letter_path}: {error}")
+        self._append_dead_letters([{"report": report_data, "lost_files": lost_files_list, "error": str(error)}])
+
+    def _append_dead_letters(self, records: List[Dict[str, Any]]):
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _spool(self, batch: List[ReportItem]):
+        """
+        将报告追加到本地缓冲文件并落盘
+        """
+        with self._spool_lock:
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                for report_data, lost_files_list in batch:
+                    f.write(_encode(report_data, lost_files_list))
+                f.flush()
+                os.fsync(f.fileno())
+            self._spooled += len(batch)
+            GAUGE_PERSIST_SPOOLED.set(self._spooled)
+
+    def _replay_spool(self):
+        """
+        按顺序补写缓冲文件中的报告，失败时把未写入的部分写回缓冲文件；无法解析的行移入死信文件
+        """
+        replay_path = f"{self.spool_path}.replay"
+        with self._spool_lock:
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spool_path):
+                    self._spooled = 0
+                    GAUGE_PERSIST_SPOOLED.set(0)
+                    return
+                os.replace(self.spool_path, replay_path)
+        items, bad_lines = _read_spool(replay_path)
+        if bad_lines:
+            COUNTER_PERSIST_DEAD_LETTERS.labels(reason="unparseable").inc(len(bad_lines))
+            logger.warning(f"Moved {len(bad_lines)} unparseable spool lines to {self.dead_letter_path}")
+            self._append_dead_letters([{"raw": line, "error": "unparseable spool line"} for line in bad_lines])
+        written = 0
+        while written < len(items):
+            batch = items[written:written + self.batch_size]
+            rest = self._write(batch)
+            written += len(batch) - len(rest)
+            if rest:
+                break
+        # 未写入的部分放回缓冲文件头部，保持写入顺序
+        with self._spool_lock:
+            rest = items[written:]
+            if os.path.exists(self.spool_path):
+                with open(self.spool_path, encoding="utf-8", errors="replace") as f:
+                    newer = f.read()
+            else:
+                newer = ""
+            with open(f"{self.spool_path}.tmp", "w", encoding="utf-8") as f:
+                for report_data, lost_files_list in rest:
+                    f.write(_encode(report_data, lost_files_list))
+                f.write(newer)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f"{self.spool_path}.tmp", self.spool_path)
+            os.remove(replay_path)
+            self._spooled = self._count_spooled()
+            GAUGE_PERSIST_SPOOLED.set(self._spooled)
+        if written:
+            logger.info(f"Replayed {written} spooled reports, {len(rest)} still spooled")
+
+    def _terminate_torn_line(self):
+        """
+        上次进程在追加写入时崩溃会在缓冲文件末尾留下没有换行符的半行，
+        先补上换行，避免之后追加的报告与半行拼接成一行而一起无法解析
+        """
+        try:
+            with open(self.spool_path, "rb+") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    return
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    logger.warning(f"Spool file {self.spool_path} ends with a partial line, "
+                                   f"it will be moved to the dead letter file on replay")
+                    f.write(b"\n")
+        except FileNotFoundError:
+            pass
+
+    def _count_spooled(self) -> int:
+        count = 0
+        for path in (self.spool_path, f"{self.spool_path}.replay"):
+            try:
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    count += sum(1 for line in f if line.strip())
+            except FileNotFoundError:
+                pass
+        return count
@@ -0,0 +1,118 @@
+"""
+Pipeline definitions: which forward/process log streams the watcher reconciles.
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+# --- 默认流水线（与单分片部署一致） ---
+DEFAULT_FORWARD_QUERY = '{service="forward_svc"} |= "Rename trigger hard link"'
+DEFAULT_PROCESS_QUERY = '{service="process_svc"} |= "处理文件" |= "成功"'
+
+# Forward Service: Rename trigger hard link /cacheproxy/.../xxx.log to process
+DEFAULT_FORWARD_PATTERN = r"Rename trigger hard link ([\w/.-]+) to process"
+
+# Process Service: filePath=/cacheproxy/.../xxx.log成功
+DEFAULT_PROCESS_PATTERN = r"filePath=([\w/.-]+)成功"
+
+# 直读模式下的日志文件路径（watcher 容器内的挂载位置）与行过滤关键字（与 Alloy 过滤规则一致）
+DEFAULT_FORWARD_LOG_PATH = "/var/log/forwarder/forward.log"
+DEFAULT_PROCESS_LOG_PATH = "/var/log/processor/process.log"
+DEFAULT_FORWARD_KEYWORDS = ("Rename trigger hard link",)
+DEFAULT_PROCESS_KEYWORDS = ("处理文件", "成功")
+
+# 按关联ID对账时，ID在日志行中的位置标记（forward 为 JSON 字段，process 为行尾 cid=<数字>）
+DEFAULT_FORWARD_CID_MARKER = '"cid": '
+DEFAULT_PROCESS_CID_MARKER = "cid="
+# 关联ID低位序号的位数，高位为文件名时间戳对应的 epoch 微秒数（与 forwarder.utils.CID_SEQUENCE_BITS 一致）
+CID_SEQUENCE_BITS = 12
+
+# 文件名示例: 20260128101647964993_tz01_91458258_.log
+# 提取文件名中的时间戳 (前14位: YYYYMMDDHHmmss)
+DEFAULT_FILENAME_PATTERN = r"(\d{14})\d*_.+"
+
+
+class Pipeline:
+    """
+    一条需要对账的转发/处理流水线（一个分片或区域）
+    """
+
+    def __init__(self,
+                 name: str,
+                 shard: str = "",
+                 forward_query: str = DEFAULT_FORWARD_QUERY,
+                 process_query: str = DEFAULT_PROCESS_QUERY,
+                 forward_pattern: str = DEFAULT_FORWARD_PATTERN,
+                 process_pattern: str = DEFAULT_PROCESS_PATTERN,
+                 filename_pattern: str = DEFAULT_FILENAME_PATTERN,
+                 forward_log_path: str = DEFAULT_FORWARD_LOG_PATH,
+                 process_log_path: str = DEFAULT_PROCESS_LOG_PATH,
+                 forward_keywords: Sequence[str] = DEFAULT_FORWARD_KEYWORDS,
+                 process_keywords: Sequence[str] = DEFAULT_PROCESS_KEYWORDS,
+                 join_key: str = "file",
+                 forward_cid_marker: str = DEFAULT_FORWARD_CID_MARKER,
+                 process_cid_marker: str = DEFAULT_PROCESS_CID_MARKER):
+        """
+        :param name: 流水线名称，唯一，用作指标标签和报告的 pipeline 字段
+        :param shard: 分片/区域标签，例如 tz01，写入报告的 shard 字段和 log_audit_pipeline_info 指标
+        :param forward_query: 查询转发日志的 LogQL
+        :param process_query: 查询处理日志的 LogQL
+        :param forward_pattern: 从转发日志 msg 中提取文件路径的正则（第1组为路径）
+        :param process_pattern: 从处理日志行中提取文件路径的正则（第1组为路径）
+        :param filename_pattern: 从文件名中提取14位时间戳的正则（第1组为时间戳）
+        :param forward_log_path: 直读模式下转发日志文件路径
+        :param process_log_path: 直读模式下处理日志文件路径
+        :param forward_keywords: 直读模式下转发日志行必须包含的关键字
+        :param process_keywords: 直读模式下处理日志行必须包含的关键字
+        :param join_key: 对账关联方式：file 用正则从日志中提取文件名；cid 按日志中的数字关联ID关联，
+                         只对丢失文件解析文件名（要求两个服务都输出关联ID）
+        :param forward_cid_marker: 转发日志中关联ID前的标记
+        :param process_cid_marker: 处理日志中关联ID前的标记
+        """
+        if join_key not in ("file", "cid"):
+            raise ValueError(f"Unknown join_key {join_key!r} for pipeline {name}")
+        self.name = name
+        self.shard = shard
+        self.forward_query = forward_query
+        self.process_query = process_query
+        self.forward_pattern = re.compile(forward_pattern)
+        self.process_pattern = re.compile(process_pattern)
+        self.filename_pattern = re.compile(filename_pattern)
+        self.forward_log_path = forward_log_path
+        self.process_log_path = process_log_path
+        self.forward_keywords = tuple(forward_keywords)
+        self.process_keywords = tuple(process_keywords)
+        self.join_key = join_key
+        self.forward_cid_marker = forward_cid_marker
+        self.process_cid_marker = process_cid_marker
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Pipeline":
+        """
+        从配置字典构建流水线，未指定的字段使用默认值
+        """
+        if not data.get("name"):
+            raise ValueError(f"Pipeline definition without name: {data}")
+        return cls(**data)
+
+    def __repr__(self):
+        return f"Pipeline(name={self.name!r}, shard={self.shard!r})"
+
+
+def load_pipelines(path: Optional[str]) -> List[Pipeline]:
+    """
+    从 JSON 文件加载流水线列表，未配置时返回单条默认流水线
+    文件格式：[{"name": "tz01", "shard": "tz01", "forward_query": "...", ...}, ...]
+    :param path: 配置文件路径
+    :return: 流水线列表
+    """
+    if not path:
+        return [Pipeline(name="default")]
+    with open(path, encoding="utf-8") as f:
+        definitions = json.load(f)
+    pipelines = [Pipeline.from_dict(item) for item in definitions]
+    names = [pipeline.name for pipeline in pipelines]
+    if not pipelines or len(set(names)) != len(names):
+        raise ValueError(f"Pipeline names must be non-empty and unique: {names}")
+    return pipelines
@@ -0,0 +1,178 @@
+"""
+Startup readiness probes with exponential backoff, replacing fixed sleeps and retry counts.
+"""
+
+import logging
+import random
+import time
+from typing import Callable, Dict, List, TypeVar
+
+import requests
+from sqlalchemy import BigInteger, Column, Integer, MetaData, Table, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateColumn
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def wait_until_ready(probe: Callable[[], T], name: str, timeout_seconds: float,
+                     initial_delay: float = 0.2, max_delay: float = 5.0) -> T:
+    """
+    反复调用 probe 直到成功，失败后按指数退避（带抖动）等待
+    :param probe: 探测函数，失败时抛出异常
+    :param name: 依赖名称，用于日志
+    :param timeout_seconds: 最长等待时间，超时后抛出最后一次的异常
+    :param initial_delay: 首次重试前的等待时间
+    :param max_delay: 单次等待时间上限
+    :return: probe 的返回值
+    """
+    started = time.monotonic()
+    delay = initial_delay
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            result = probe()
+            logger.info(f"{name} is ready after {attempt} attempts ({time.monotonic() - started:.1f}s)")
+            return result
+        except Exception as e:
+            elapsed = time.monotonic() - started
+            if elapsed >= timeout_seconds:
+                logger.error(f"{name} not ready after {elapsed:.1f}s, giving up: {e}")
+                raise
+            logger.warning(f"{name} not ready (attempt {attempt}): {e}")
+            time.sleep(min(delay * random.uniform(0.5, 1.0), timeout_seconds - elapsed))
+            delay = min(delay * 2, max_delay)
+
+
+def probe_database(engine: Engine):
+    """
+    数据库就绪探测：能建立连接并执行 SELECT 1
+    """
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+def probe_loki(loki_url: str):
+    """
+    Loki 就绪探测：/ready 返回 200
+    """
+    response = requests.get(f"{loki_url}/ready", timeout=5)
+    response.raise_for_status()
+
+
+def _column_ddl(column: Column, dialect) -> str:
+    """
+    生成 ALTER TABLE ADD COLUMN 的列定义；模型中的标量默认值转为 DEFAULT 子句，
+    使已有的行在 NOT NULL 列上取得该默认值
+    """
+    server_default = column.server_default
+    if server_default is None and column.default is not None and column.default.is_scalar:
+        value = column.default.arg
+        server_default = value if isinstance(value, str) else text(str(value))
+    definition = Column(column.name, column.type, nullable=column.nullable,
+                        server_default=server_default, comment=column.comment)
+    # 列定义需要挂在表上才能编译
+    Table(column.table.name, MetaData(), definition)
+    return str(CreateColumn(definition).compile(dialect=dialect))
+
+
+def _missing_columns(inspector, metadata: MetaData) -> Dict[str, List[Column]]:
+    existing = set(inspector.get_table_names())
+    missing = {}
+    for name, table in metadata.tables.items():
+        if name not in existing:
+            continue
+        columns = {column["name"] for column in inspector.get_columns(name)}
+        absent = [column for column in table.columns if column.name not in columns]
+        if absent:
+            missing[name] = absent
+    return missing
+
+
+def _narrow_columns(inspector, metadata: MetaData) -> Dict[str, List[Column]]:
+    """
+    模型中为 BIGINT、数据库中仍为 INTEGER 的列（例如旧版本建表的 lost_files.file_id）
+    """
+    existing = set(inspector.get_table_names())
+    narrow = {}
+    for name, table in metadata.tables.items():
+        if name not in existing:
+            continue
+        types = {column["name"]: column["type"] for column in inspector.get_columns(name)}
+        columns = [column for column in table.columns
+                   if isinstance(column.type, BigInteger) and column.name in types
+                   and isinstance(types[column.name], Integer) and not isinstance(types[column.name], BigInteger)]
+        if columns:
+            narrow[name] = columns
+    return narrow
+
+
+def ensure_schema(engine: Engine, metadata: MetaData, migrate: bool = True) -> List[str]:
+    """
+    检查并迁移表结构（幂等，表结构已是最新时只做检查）：
+    - 缺少的表用 create_all 创建
+    - 已有的表缺少的列用 ALTER TABLE ADD COLUMN 补齐，再创建缺少的索引
+    - INTEGER 列加宽为模型中的 BIGINT（ALTER TABLE MODIFY COLUMN；SQLite 的整数本身为 64 位，跳过）
+    迁移后仍缺少列时抛出 RuntimeError 拒绝启动：否则每次写入报告都会失败，报告只会堆积在本地缓冲文件中
+    :param migrate: False 时只检查，不修改表结构
+    :return: 本次新增或加宽的列，形如 reports.bucket
+    """
+    inspector = inspect(engine)
+    existing = set(inspector.get_table_names())
+    missing_tables = [name for name in metadata.tables if name not in existing]
+    missing_columns = _missing_columns(inspector, metadata)
+    if not migrate:
+        if missing_tables or missing_columns:
+            raise RuntimeError(
+                f"Database schema is out of date (missing tables {missing_tables}, missing columns "
+                f"{ {name: [column.name for column in columns] for name, columns in missing_columns.items()} }) "
+                f"and schema migration is disabled")
+        narrow = _narrow_columns(inspector, metadata)
+        if narrow and engine.dialect.name != "sqlite":
+            logger.warning(
+                f"Columns still INTEGER instead of BIGINT (schema migration is disabled): "
+                f"{ {name: [column.name for column in columns] for name, columns in narrow.items()} }")
+        return []
+
+    if missing_tables:
+        logger.info(f"Creating missing tables: {missing_tables}")
+        metadata.create_all(engine)
+    added = []
+    preparer = engine.dialect.identifier_preparer
+    for name, columns in missing_columns.items():
+        with engine.begin() as conn:
+            for column in columns:
+                ddl = (f"ALTER TABLE {preparer.quote(name)} "
+                       f"ADD COLUMN {_column_ddl(column, engine.dialect)}")
+                logger.warning(f"Migrating schema: {ddl}")
+                conn.execute(text(ddl))
+                added.append(f"{name}.{column.name}")
+    if engine.dialect.name != "sqlite":
+        for name, columns in _narrow_columns(inspect(engine), metadata).items():
+            with engine.begin() as conn:
+                for column in columns:
+                    ddl = (f"ALTER TABLE {preparer.quote(name)} "
+                           f"MODIFY COLUMN {_column_ddl(column, engine.dialect)}")
+                    logger.warning(f"Migrating schema: {ddl}")
+                    conn.execute(text(ddl))
+                    added.append(f"{name}.{column.name}")
+    for name, table in metadata.tables.items():
+        if name in missing_tables:
+            continue
+        indexes = {index["name"] for index in inspector.get_indexes(name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                logger.warning(f"Migrating schema: creating index {index.name} on {name}")
+                index.create(engine)
+
+    still_missing = _missing_columns(inspect(engine), metadata)
+    if still_missing:
+        raise RuntimeError(
+            f"Database schema migration incomplete, missing columns "
+            f"{ {name: [column.name for column in columns] for name, columns in still_missing.items()} }")
+    if not missing_tables and not added:
+        logger.info("Database schema is up to date")
+    return added
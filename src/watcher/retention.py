@@ -0,0 +1,92 @@
+"""
+Retention policy of the watcher: daily rollups and bulk purge of expired report buckets.
+"""
+
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from dao import WatcherDao
+
+# 明细数据（reports / lost_files）保留天数，0 表示不清理
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30"))
+# 保留策略的执行间隔
+RETENTION_CHECK_INTERVAL_SECONDS = int(
+    os.getenv("RETENTION_CHECK_INTERVAL_SECONDS", "3600"))
+# 每批删除的行数，控制单个事务的大小
+RETENTION_PURGE_BATCH_SIZE = int(os.getenv("RETENTION_PURGE_BATCH_SIZE", "5000"))
+# 每次重新汇总最近多少天（不含今天），使补跑、重试和缓冲文件补写带来的迟到报告计入汇总
+RETENTION_REROLL_DAYS = int(os.getenv("RETENTION_REROLL_DAYS", "7"))
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionManager:
+    """
+    周期性执行保留策略：
+    1. 将已结束的天（今天之前）的报告汇总到 daily_rollups，最近 reroll_days 天每次都重新汇总
+    2. 按天分桶批量删除超过保留期的 lost_files 和 reports
+    汇总失败时不执行删除，保证删除的数据都已有汇总
+    """
+
+    def __init__(self,
+                 retention_days: int = RETENTION_DAYS,
+                 check_interval_seconds: int = RETENTION_CHECK_INTERVAL_SECONDS,
+                 batch_size: int = RETENTION_PURGE_BATCH_SIZE,
+                 reroll_days: int = RETENTION_REROLL_DAYS):
+        """
+        :param retention_days: 明细数据保留天数，0 表示只汇总不清理
+        :param check_interval_seconds: 两次执行之间的最小间隔（秒）
+        :param batch_size: 每批删除的行数
+        :param reroll_days: 每次重新汇总的最近天数，不超过保留天数（明细已清理的天不能重新汇总）
+        """
+        self.retention_days = retention_days
+        self.reroll_days = max(1, min(reroll_days, retention_days) if retention_days > 0 else reroll_days)
+        self.check_interval_seconds = check_interval_seconds
+        self.batch_size = batch_size
+        self._last_run: Optional[float] = None
+
+    def maybe_run(self, dao_handler: WatcherDao) -> bool:
+        """
+        距上次执行超过间隔时执行一次保留策略
+        :return: 本次是否执行
+        """
+        now = time.monotonic()
+        if self._last_run is not None and now - self._last_run < self.check_interval_seconds:
+            return False
+        self._last_run = now
+        self.run(dao_handler)
+        return True
+
+    def run(self, dao_handler: WatcherDao, today: Optional[datetime] = None):
+        """
+        执行一次汇总与清理
+        :param dao_handler: 数据库操作对象
+        :param today: 当前日期，默认取本地时间（与审计窗口的时间基准一致）
+        """
+        today = today or datetime.now()
+        today_bucket = int(today.strftime("%Y%m%d"))
+
+        # 从最新一个已汇总的天和最近 reroll_days 天中较早者开始重新汇总，迟到的报告（补跑的窗口、
+        # 重试成功的审计、故障后从缓冲文件补写的报告）即使属于更早的天也会计入汇总
+        since_bucket = dao_handler.get_latest_rollup_day()
+        if since_bucket is not None:
+            since_bucket = min(since_bucket, int((today - timedelta(days=self.reroll_days)).strftime("%Y%m%d")))
+        rolled = dao_handler.rollup_buckets(before_bucket=today_bucket,
+                                            since_bucket=since_bucket)
+        if rolled < 0:
+            logger.warning("Rollup failed, skip purging expired buckets")
+            return
+        logger.info(f"Rolled up {rolled} daily buckets before {today_bucket}")
+
+        if self.retention_days <= 0:
+            return
+        cutoff_bucket = int(
+            (today - timedelta(days=self.retention_days)).strftime("%Y%m%d"))
+        deleted = dao_handler.purge_buckets(before_bucket=cutoff_bucket,
+                                            batch_size=self.batch_size)
+        logger.info(
+            f"Purged buckets before {cutoff_bucket}: {deleted['reports']} reports, "
+            f"{deleted['lost_files']} lost files")
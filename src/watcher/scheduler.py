@@ -0,0 +1,263 @@
+"""
+Fixed-rate audit scheduler on an epoch-aligned window grid.
+"""
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from metrics import (
+    GAUGE_SCHEDULER_BEHIND,
+    GAUGE_SCHEDULER_PENDING,
+    GAUGE_SCHEDULER_RUNNING,
+    COUNTER_SCHEDULER_MISSED,
+    COUNTER_SCHEDULER_OVERRUNS,
+    COUNTER_SCHEDULER_FAILURES,
+    COUNTER_SCHEDULER_ABANDONED,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class WindowUnavailable(Exception):
+    """
+    日志来源已不再覆盖审计窗口（例如本地缓冲已裁剪掉窗口开始之前的日志行），重试也无法得到完整的结果
+    """
+
+
+class AuditScheduler:
+    """
+    固定速率的审计调度器：
+    - 审计窗口落在以 epoch 为起点、interval 为步长的固定网格上，窗口之间既不重叠也无缝隙
+    - 窗口结束时间 + offset 到达后窗口才就绪，就绪前不会审计
+    - 每个就绪窗口为每个 key（流水线）生成一个审计任务，同时执行的任务数不超过并发上限
+    - 调度不等待整批任务结束：任务完成即回收并提交下一个，补跑积压期间新就绪的窗口照常入队，
+      且最新的窗口优先执行，积压不会推迟最新窗口的审计
+    - 审计失败的任务按指数退避重试（每个任务独立计算），任何文件时间区间都不会被跳过；
+      只剩等待重试的任务时视为空闲，空闲回调照常执行
+    - 日志来源不再覆盖窗口时（审计函数抛出 WindowUnavailable）放弃该任务并记录错误，不写入报告
+    """
+
+    def __init__(self,
+                 audit_fn: Callable[[str, datetime, datetime], None],
+                 keys: Sequence[str],
+                 interval_seconds: int,
+                 offset_seconds: int,
+                 max_concurrency: int = 1,
+                 start_end_ts: Optional[float] = None,
+                 retry_delay_seconds: float = 5,
+                 retry_max_delay_seconds: float = 600,
+                 on_idle: Optional[Callable[[], None]] = None):
+        """
+        :param audit_fn: 审计函数，参数为 (key, window_start_dt, window_end_dt)，失败时抛出异常，
+                         日志来源不再覆盖窗口时抛出 WindowUnavailable
+        :param keys: 每个窗口需要审计的 key 列表（流水线名称）
+        :param interval_seconds: 窗口大小，同时也是调度间隔
+        :param offset_seconds: 窗口结束后需等待的秒数（留给日志上报）
+        :param max_concurrency: 同时执行的审计任务数上限
+        :param start_end_ts: 第一个待审计窗口的结束时间戳，None 表示从最新的就绪窗口开始
+        :param retry_delay_seconds: 任务第一次失败后的重试等待时间，之后每次失败翻倍
+        :param retry_max_delay_seconds: 重试等待时间的上限
+        :param on_idle: 没有可立即执行的任务（只剩等待重试的任务也算）、进入等待前调用的回调
+                        （例如执行保留策略），在调度线程中执行
+        """
+        self.audit_fn = audit_fn
+        self.keys = list(keys)
+        self.interval_seconds = interval_seconds
+        self.offset_seconds = offset_seconds
+        self.max_concurrency = max(1, max_concurrency)
+        self.retry_delay_seconds = retry_delay_seconds
+        self.retry_max_delay_seconds = max(retry_delay_seconds, retry_max_delay_seconds)
+        self.on_idle = on_idle
+        # 下一个尚未入队的窗口结束时间
+        self.next_end_ts = start_end_ts
+        # 已就绪但尚未提交的任务 (窗口结束时间, key)
+        self.pending: Set[Tuple[float, str]] = set()
+        # 正在执行的任务
+        self.running: Dict[Future, Tuple[float, str]] = {}
+        # 失败任务的连续失败次数与最早重试时间
+        self._attempts: Dict[Tuple[float, str], int] = {}
+        self._retry_at: Dict[Tuple[float, str], float] = {}
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                            thread_name_prefix="audit")
+
+    def resume(self, audited_by_key: Dict[str, Set[float]], first_end_by_key: Dict[str, float],
+               max_windows: int, now: Optional[float] = None) -> int:
+        """
+        按持久化的审计记录初始化队列：在最近 max_windows 个就绪窗口内，补跑每个 key 缺少报告的所有窗口
+        （不只是最新报告之后的窗口，中间的空洞也会补跑），不早于该 key 最早的报告；
+        没有历史记录的 key 只审计最新的就绪窗口
+        :param audited_by_key: key -> 补跑范围内已有报告的窗口结束时间戳
+        :param first_end_by_key: key -> 最早一份报告的窗口结束时间戳
+        :param max_windows: 每个 key 补跑范围的窗口数（含最新的就绪窗口）
+        :return: 入队的任务数
+        """
+        ready_end = self.latest_ready_end(now)
+        earliest_end = ready_end - (max(1, max_windows) - 1) * self.interval_seconds
+        jobs = []
+        for key in self.keys:
+            first_end = first_end_by_key.get(key)
+            if first_end is None:
+                end_ts = ready_end
+            else:
+                # 对齐到网格：最早的补跑窗口的开始时间不早于第一份报告的开始时间
+                end_ts = max(earliest_end,
+                             -(-first_end // self.interval_seconds) * self.interval_seconds)
+            audited = audited_by_key.get(key, set())
+            missing = []
+            while end_ts <= ready_end:
+                if end_ts not in audited:
+                    missing.append((end_ts, key))
+                end_ts += self.interval_seconds
+            if len(missing) > 1:
+                logger.info(f"[{key}] {len(missing)} windows in the last {max_windows} have no report, catching up")
+            jobs.extend(missing)
+        self.pending.update(jobs)
+        self.next_end_ts = ready_end + self.interval_seconds
+        self._update_backlog_metrics(now)
+        if jobs:
+            logger.info(f"Resuming {len(jobs)} audit jobs up to window ending {datetime.fromtimestamp(ready_end)}")
+        return len(jobs)
+
+    def latest_ready_end(self, now: Optional[float] = None) -> float:
+        """
+        计算当前已就绪的最新窗口的结束时间戳（对齐到网格）
+        """
+        now = time.time() if now is None else now
+        return (now - self.offset_seconds) // self.interval_seconds * self.interval_seconds
+
+    def enqueue_ready_windows(self, now: Optional[float] = None) -> int:
+        """
+        将所有已就绪的窗口加入队列
+        :return: 本次新入队的窗口数
+        """
+        ready_end = self.latest_ready_end(now)
+        if self.next_end_ts is None:
+            self.next_end_ts = ready_end
+        added = 0
+        while self.next_end_ts <= ready_end:
+            self.pending.update((self.next_end_ts, key) for key in self.keys)
+            self.next_end_ts += self.interval_seconds
+            added += 1
+        if added > 1:
+            # 正常情况下每个间隔只会就绪一个窗口，多出的即为调度线程未能及时入队而错过的窗口
+            COUNTER_SCHEDULER_MISSED.inc(added - 1)
+            logger.warning(f"Detected {added - 1} missed audit windows, catching up")
+        return added
+
+    def run_once(self, now: Optional[float] = None) -> int:
+        """
+        一轮非阻塞调度：入队就绪窗口，回收已完成的任务，再按空闲的并发额度提交可执行的任务（最新的窗口优先）
+        :return: 本轮回收到的失败任务数
+        """
+        now = time.time() if now is None else now
+        self.enqueue_ready_windows(now)
+        failed = self._collect(now)
+        self._submit(now)
+        self._update_backlog_metrics(now)
+        return failed
+
+    def wait(self, now: Optional[float] = None):
+        """
+        阻塞到下一次需要调度的时刻：有任务完成、下一个窗口就绪或（有空闲额度时）最早的重试到期
+        """
+        now = time.time() if now is None else now
+        wake_at = self.next_end_ts + self.offset_seconds
+        if len(self.running) < self.max_concurrency and self._retry_at:
+            wake_at = min(wake_at, min(self._retry_at.values()))
+        timeout = max(0.0, wake_at - now)
+        if self.running:
+            wait(list(self.running), timeout=timeout, return_when=FIRST_COMPLETED)
+        elif timeout > 0:
+            time.sleep(timeout)
+
+    def run_forever(self):
+        """
+        调度主循环：提交任务后等待任务完成、窗口就绪或重试到期，没有可立即执行的任务时执行空闲回调
+        """
+        logger.info(
+            f"Audit scheduler started. Interval: {self.interval_seconds}s, "
+            f"offset: {self.offset_seconds}s, concurrency: {self.max_concurrency}")
+        while True:
+            self.run_once()
+            if not self.running and not self._ready_jobs(time.time()) and self.on_idle is not None:
+                try:
+                    self.on_idle()
+                except Exception as e:
+                    logger.error(f"Scheduler idle callback failed: {e}")
+                # 空闲回调可能耗时较长，先入队期间就绪的窗口
+                self.run_once()
+            self.wait()
+
+    def _ready_jobs(self, now: float) -> List[Tuple[float, str]]:
+        """
+        可立即提交的任务，最新的窗口在前
+        """
+        return sorted((job for job in self.pending if self._retry_at.get(job, now) <= now),
+                      key=lambda job: (-job[0], job[1]))
+
+    def _submit(self, now: float):
+        slots = self.max_concurrency - len(self.running)
+        if slots <= 0:
+            return
+        for job in self._ready_jobs(now)[:slots]:
+            self.pending.discard(job)
+            self._retry_at.pop(job, None)
+            self.running[self._executor.submit(self._audit_window, *job)] = job
+
+    def retry_delay(self, attempts: int) -> float:
+        """
+        第 attempts 次连续失败后的重试等待时间：retry_delay_seconds * 2^(attempts-1)，不超过上限
+        """
+        return min(self.retry_max_delay_seconds, self.retry_delay_seconds * 2 ** min(attempts - 1, 32))
+
+    def _collect(self, now: float) -> int:
+        failed = 0
+        for future in [future for future in self.running if future.done()]:
+            job = self.running.pop(future)
+            if future.result():
+                self._attempts.pop(job, None)
+                continue
+            failed += 1
+            attempts = self._attempts.get(job, 0) + 1
+            self._attempts[job] = attempts
+            self.pending.add(job)
+            self._retry_at[job] = now + self.retry_delay(attempts)
+        return failed
+
+    def _audit_window(self, end_ts: float, key: str) -> bool:
+        window_start_dt = datetime.fromtimestamp(end_ts - self.interval_seconds)
+        window_end_dt = datetime.fromtimestamp(end_ts)
+        started = time.monotonic()
+        try:
+            self.audit_fn(key, window_start_dt, window_end_dt)
+            return True
+        except WindowUnavailable as e:
+            # 覆盖范围只会向后推移，重试不会成功；放弃该窗口，不能当作没有丢失文件写入报告
+            COUNTER_SCHEDULER_ABANDONED.inc()
+            logger.error(
+                f"[{key}] Window {window_start_dt} to {window_end_dt} can no longer be audited, abandoned: {e}")
+            return True
+        except Exception as e:
+            COUNTER_SCHEDULER_FAILURES.inc()
+            logger.error(
+                f"[{key}] Audit of window {window_start_dt} to {window_end_dt} failed, will retry: {e}")
+            return False
+        finally:
+            elapsed = time.monotonic() - started
+            if elapsed > self.interval_seconds:
+                COUNTER_SCHEDULER_OVERRUNS.inc()
+                logger.warning(
+                    f"[{key}] Audit of window {window_start_dt} to {window_end_dt} took {elapsed:.1f}s, "
+                    f"longer than the {self.interval_seconds}s interval")
+
+    def _update_backlog_metrics(self, now: Optional[float] = None):
+        unfinished = [*self.pending, *self.running.values()]
+        GAUGE_SCHEDULER_PENDING.set(len(unfinished))
+        GAUGE_SCHEDULER_RUNNING.set(len(self.running))
+        if unfinished:
+            GAUGE_SCHEDULER_BEHIND.set(self.latest_ready_end(now) - min(unfinished)[0])
+        else:
+            GAUGE_SCHEDULER_BEHIND.set(0)
@@ -0,0 +1,389 @@
+"""
+Direct log-tail ingestion: reads the service log files without going through Alloy and Loki.
+"""
+
+import json
+import logging
+import math
+import mmap
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from metrics import COUNTER_TAIL_BYTES, COUNTER_TAIL_ROTATIONS
+from scheduler import WindowUnavailable
+
+# 单次 mmap 切片读取的字节数
+TAIL_CHUNK_BYTES = int(os.getenv("TAIL_CHUNK_BYTES", str(8 * 1024 * 1024)))
+# 轮询日志文件的间隔
+TAIL_POLL_SECONDS = float(os.getenv("TAIL_POLL_SECONDS", "1"))
+# 读取位置持久化文件，重启后从仍在保留期内的最早位置继续读取
+TAIL_STATE_PATH = os.getenv("TAIL_STATE_PATH", "/data/reports/tail_state.json")
+
+logger = logging.getLogger(__name__)
+
+
+def parse_line_ts(line: str) -> Optional[float]:
+    """
+    解析日志行自带的时间戳
+    - Forward Service（JSON）: {"ts": "2026-01-28T10:16:47.964+08:00", ...}（旧版本输出的整秒时间同样可解析）
+    - Process Service（文本）: 2026-01-28 10:16:47.964 [Log-Producer] ...
+    :return: Unix 时间戳（秒），无法解析返回None
+    """
+    try:
+        if line.startswith("{"):
+            start = line.index('"ts": "') + 7
+            return datetime.fromisoformat(line[start:line.index('"', start)]).timestamp()
+        return datetime.strptime(line[:23], "%Y-%m-%d %H:%M:%S.%f").timestamp()
+    except ValueError:
+        return None
+
+
+class TailCoverageError(WindowUnavailable):
+    """
+    查询的时间范围早于内存中完整保留的日志行（已被裁剪、进程启动前或轮转文件丢失），结果不完整
+    """
+
+
+class TailChunk:
+    """
+    一次读取得到的日志行，记录所在文件的 inode、起始偏移和时间范围，便于按时间裁剪和按区间查询
+    """
+
+    __slots__ = ("inode", "start_offset", "min_ts", "max_ts", "entries")
+
+    def __init__(self, inode: int, start_offset: int, entries: List[Tuple[float, str]]):
+        self.inode = inode
+        self.start_offset = start_offset
+        self.entries = entries
+        self.min_ts = min(ts for ts, _ in entries)
+        self.max_ts = max(ts for ts, _ in entries)
+
+
+class FileTailer:
+    """
+    跟踪单个日志文件：
+    - 以 mmap 方式按大块读取新增内容，只保留包含全部关键字的行（与 Alloy 的过滤规则一致）
+    - 检测文件轮转（inode 变化）和截断（文件变小），轮转时先读完旧文件再切换
+    - 内存中只保留 retention_seconds 内的日志行
+    - 重启时先按 inode 在同目录下找到轮转后的旧文件（包括停机期间轮转走的上次正在读取的文件），
+      从持久化的位置读完，再继续读取当前文件，轮转前后仍在保留期内的日志行都能恢复；
+      旧文件已被删除或压缩时其中的日志行无法恢复
+    - 记录完整覆盖的起点 covered_from：不早于它的日志行都在内存中。裁剪、首次启动、截断和轮转文件丢失时向后推移，
+      查询更早的时间范围时抛出 TailCoverageError，而不是返回不完整的结果
+    """
+
+    def __init__(self, path: str, keywords: Sequence[str], retention_seconds: float,
+                 inode: Optional[int] = None, offset: int = 0,
+                 rotated: Sequence[Dict[str, int]] = (), covered_from: Optional[float] = None):
+        """
+        :param path: 日志文件路径
+        :param keywords: 需保留的日志行必须包含的关键字
+        :param retention_seconds: 日志行在内存中的保留时长
+        :param inode: 上次持久化的 inode，与当前文件一致时从 offset 继续读取
+        :param offset: 上次持久化的起始读取位置
+        :param rotated: 上次持久化的轮转前旧文件 [{"inode": ..., "low_offset": ...}]，按轮转先后排列
+        :param covered_from: 上次持久化的完整覆盖起点，None 表示没有记录（首次启动）
+        """
+        self.path = path
+        self.keywords = [keyword.encode("utf-8") for keyword in keywords]
+        self.retention_seconds = retention_seconds
+        self.chunks: Deque[TailChunk] = deque()
+        self._lock = threading.Lock()
+        self._file = None
+        self.inode = None
+        self.offset = 0
+        # 没有记录时，覆盖起点取首次读到的第一行日志的时间（更早的日志行不在已读取的文件中）
+        self.covered_from = float("-inf") if covered_from is None else covered_from
+        self._coverage_gap = covered_from is None
+        try:
+            current_inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            current_inode = None
+        if inode is not None and inode != current_inode:
+            # 停机期间发生了轮转：上次正在读取的文件同样从持久化的位置读完
+            rotated = [*rotated, {"inode": inode, "low_offset": offset}]
+        self._drain_rotated(rotated, current_inode=current_inode)
+        self._open(resume_inode=inode, resume_offset=offset)
+
+    def _find_inode(self, inode: int) -> Optional[str]:
+        """
+        在日志文件所在目录中查找指定 inode 的文件（轮转后的旧文件通常被重命名到同一目录）
+        """
+        directory = os.path.dirname(self.path) or "."
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.inode() == inode:
+                        return entry.path
+        except OSError:
+            return None
+        return None
+
+    def _drain_rotated(self, rotated: Sequence[Dict[str, int]], current_inode: Optional[int]):
+        """
+        从持久化的位置读完轮转前的旧文件，恢复其中仍在保留期内的日志行
+        """
+        for item in rotated:
+            if item.get("inode") is None or item["inode"] == current_inode:
+                continue
+            path = self._find_inode(item["inode"])
+            if path is None:
+                logger.warning(
+                    f"Rotated file of {self.path} (inode {item['inode']}) not found, "
+                    f"lines after offset {item.get('low_offset', 0)} are not restored")
+                # 覆盖起点推移到之后读到的第一行日志
+                self._coverage_gap = True
+                continue
+            try:
+                with open(path, "rb") as f:
+                    if os.fstat(f.fileno()).st_ino != item["inode"]:
+                        continue
+                    self._read_file(f, item["inode"], item.get("low_offset", 0))
+                logger.info(f"Restored lines of {self.path} from rotated file {path}")
+            except OSError as e:
+                logger.warning(f"Failed to read rotated file {path}: {e}")
+
+    def _open(self, resume_inode: Optional[int] = None, resume_offset: int = 0):
+        try:
+            self._file = open(self.path, "rb")
+        except FileNotFoundError:
+            self._file = None
+            self.inode = None
+            self.offset = 0
+            return
+        self.inode = os.fstat(self._file.fileno()).st_ino
+        self.offset = resume_offset if resume_inode == self.inode else 0
+
+    def poll(self):
+        """
+        读取新增内容，处理轮转与截断，并裁剪过期的日志行
+        """
+        polled_at = time.time()
+        if self._file is None:
+            self._open()
+            if self._file is None:
+                return
+
+        self._read_available()
+        try:
+            current_inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            current_inode = None
+        if current_inode is not None and current_inode != self.inode:
+            # 文件已轮转：旧文件已读完，切换到新文件从头读取
+            COUNTER_TAIL_ROTATIONS.labels(path=self.path).inc()
+            logger.info(f"Log file {self.path} rotated, reopening")
+            self._file.close()
+            self._open()
+            self._read_available()
+        elif os.fstat(self._file.fileno()).st_size < self.offset:
+            # 文件被截断，从头读取；截断前未读取的日志行已丢失
+            logger.info(f"Log file {self.path} truncated, reading from start")
+            self.offset = 0
+            self._coverage_gap = True
+            self._read_available()
+        if self._coverage_gap:
+            # 没有读到新的日志行：此后写入的日志行都会被读取
+            with self._lock:
+                self.covered_from = max(self.covered_from, polled_at)
+                self._coverage_gap = False
+        self._prune()
+
+    def _read_available(self):
+        self.offset = self._read_file(self._file, self.inode, self.offset)
+
+    def _read_file(self, file, inode: int, offset: int) -> int:
+        """
+        从 offset 读取文件中完整的新增行
+        :return: 下次读取的起始位置
+        """
+        size = os.fstat(file.fileno()).st_size
+        if size <= offset:
+            return offset
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = offset
+            while pos < size:
+                end = min(pos + TAIL_CHUNK_BYTES, size)
+                newline = mm.rfind(b"\n", pos, end)
+                if newline < 0:
+                    # 单行超过切片大小时向后找行尾；最后一行未写完则等待下次读取
+                    newline = mm.find(b"\n", end, size)
+                    if newline < 0:
+                        break
+                self._ingest(mm[pos:newline + 1], inode, pos)
+                COUNTER_TAIL_BYTES.labels(path=self.path).inc(newline + 1 - pos)
+                pos = newline + 1
+        return pos
+
+    def _ingest(self, data: bytes, inode: int, start_offset: int):
+        read_ts = time.time()
+        entries = []
+        for raw in data.split(b"\n"):
+            if not raw or not all(keyword in raw for keyword in self.keywords):
+                continue
+            line = raw.decode("utf-8", errors="replace")
+            ts = parse_line_ts(line)
+            entries.append((read_ts if ts is None else ts, line))
+        with self._lock:
+            if self._coverage_gap:
+                first_ts = parse_line_ts(data[:data.find(b"\n")].decode("utf-8", errors="replace"))
+                self.covered_from = max(self.covered_from, read_ts if first_ts is None else first_ts)
+                self._coverage_gap = False
+            if entries:
+                self.chunks.append(TailChunk(inode, start_offset, entries))
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            while self.chunks and self.chunks[0].max_ts < cutoff:
+                # 不晚于被裁剪的日志行的时间不再完整
+                self.covered_from = max(self.covered_from, math.nextafter(self.chunks.popleft().max_ts, math.inf))
+
+    def low_offset(self) -> int:
+        """
+        当前文件中仍在内存中保留的最早日志行所在的偏移，重启后从这里重新读取以恢复缓冲
+        """
+        with self._lock:
+            for chunk in self.chunks:
+                if chunk.inode == self.inode:
+                    return chunk.start_offset
+            return self.offset
+
+    def rotated_offsets(self) -> List[Dict[str, int]]:
+        """
+        轮转前的旧文件中仍在内存中保留的最早日志行所在的偏移，按轮转先后排列
+        """
+        offsets: Dict[int, int] = {}
+        with self._lock:
+            for chunk in self.chunks:
+                if chunk.inode != self.inode and chunk.inode not in offsets:
+                    offsets[chunk.inode] = chunk.start_offset
+        return [{"inode": inode, "low_offset": offset} for inode, offset in offsets.items()]
+
+    def coverage(self) -> Optional[float]:
+        """
+        用于持久化的完整覆盖起点，尚未确定时返回None
+        """
+        with self._lock:
+            return None if self._coverage_gap else self.covered_from
+
+    def query(self, start_ts: float, end_ts: float) -> List[Tuple[float, str]]:
+        """
+        查询时间戳落在 [start_ts, end_ts] 内的日志行
+        :raises TailCoverageError: start_ts 早于完整覆盖的起点，部分日志行已不在内存中
+        """
+        with self._lock:
+            if self._coverage_gap or start_ts < self.covered_from:
+                covered = "unknown" if self._coverage_gap else datetime.fromtimestamp(self.covered_from)
+                raise TailCoverageError(
+                    f"{self.path}: lines from {datetime.fromtimestamp(start_ts)} are no longer buffered "
+                    f"(complete from {covered})")
+            return [
+                entry
+                for chunk in self.chunks
+                if chunk.max_ts >= start_ts and chunk.min_ts <= end_ts
+                for entry in chunk.entries
+                if start_ts <= entry[0] <= end_ts
+            ]
+
+
+class TailSource:
+    """
+    管理多个 FileTailer，在后台线程中轮询，并持久化读取位置
+    """
+
+    def __init__(self, retention_seconds: float, state_path: str = TAIL_STATE_PATH,
+                 poll_seconds: float = TAIL_POLL_SECONDS):
+        """
+        :param retention_seconds: 日志行在内存中的保留时长，应覆盖一个审计窗口及其扩展和偏移
+        :param state_path: 读取位置持久化文件
+        :param poll_seconds: 轮询间隔
+        """
+        self.retention_seconds = retention_seconds
+        self.state_path = state_path
+        self.poll_seconds = poll_seconds
+        self.tailers: Dict[Tuple[str, Tuple[str, ...]], FileTailer] = {}
+        self._state = self._load_state()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, path: str, keywords: Sequence[str]) -> FileTailer:
+        """
+        注册需要跟踪的文件（相同路径和关键字只跟踪一次）
+        """
+        key = (path, tuple(keywords))
+        if key not in self.tailers:
+            saved = self._state.get(self._state_key(key), {})
+            self.tailers[key] = FileTailer(path, keywords, self.retention_seconds,
+                                           inode=saved.get("inode"),
+                                           offset=saved.get("low_offset", 0),
+                                           rotated=saved.get("rotated", ()),
+                                           covered_from=saved.get("covered_from"))
+        return self.tailers[key]
+
+    def query(self, path: str, keywords: Sequence[str], start_ts: float,
+              end_ts: float) -> List[Tuple[int, str]]:
+        """
+        以与 Loki 查询相同的 (日志时间戳纳秒, 文本) 形式返回日志行，便于复用审计逻辑
+        :raises TailCoverageError: 内存中已不再完整保留 start_ts 之后的日志行
+        """
+        # 文件需在 start() 之前通过 add() 注册，查询线程不修改 tailers
+        entries = self.tailers[(path, tuple(keywords))].query(start_ts, end_ts)
+        return [(int(ts * 1e9), line) for ts, line in entries]
+
+    def start(self):
+        """
+        启动后台轮询线程
+        """
+        self._thread = threading.Thread(target=self._run, name="tail", daemon=True)
+        self._thread.start()
+
+    def poll_all(self):
+        for tailer in list(self.tailers.values()):
+            try:
+                tailer.poll()
+            except OSError as e:
+                logger.error(f"Error tailing {tailer.path}: {e}")
+        self._save_state()
+
+    def _run(self):
+        while True:
+            self.poll_all()
+            time.sleep(self.poll_seconds)
+
+    @staticmethod
+    def _state_key(key: Tuple[str, Tuple[str, ...]]) -> str:
+        return "|".join((key[0],) + key[1])
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable tail state {self.state_path}: {e}")
+            return {}
+
+    def _save_state(self):
+        state = {
+            self._state_key(key): {
+                "inode": tailer.inode,
+                "offset": tailer.offset,
+                "low_offset": tailer.low_offset(),
+                "rotated": tailer.rotated_offsets(),
+                "covered_from": tailer.coverage(),
+            }
+            for key, tailer in self.tailers.items()
+        }
+        # 先写临时文件再原子替换，避免写入中途崩溃导致状态文件损坏
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logger.warning(f"Failed to persist tail state: {e}")
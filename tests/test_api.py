@@ -0,0 +1,121 @@
+"""
+Behaviour tests of the /lost_files lookup API: parameter validation, lookups by name and time range, caching.
+"""
+
+import json
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from api import LookupCache, WatcherRequestHandler, set_session_factory, start_api_server
+from dao import Base, WatcherDao
+
+PARSED = "20260128101047964993_tz01_91458258_.log"
+# 文件名解析不出时间戳：cid 关联且转发行中没有文件名，以及其他 filename_pattern 的文件名
+UNPARSED = ["cid=7131415161718192021", "upload-2026-01-28-0001.bin"]
+# 超出 BIGINT 范围的文件ID
+HUGE_ID = "20260128101147000000_tz01_99999999999999999999_.log"
+
+
+def _report(window_start: str) -> dict:
+    return {
+        "pipeline": "default",
+        "audit_window_start": window_start,
+        "audit_window_end": window_start,
+        "forward_count": 4,
+        "process_count": 0,
+        "lost_count": 4,
+    }
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    # HTTP 线程与测试线程使用不同的连接，使用文件数据库
+    engine = create_engine(f"sqlite:///{tmp_path / 'watcher.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    session = factory()
+    WatcherDao(session).create_report_with_lost_files(_report("2026-01-28T10:10:00"),
+                                                      [PARSED, HUGE_ID, *UNPARSED])
+    session.close()
+
+    monkeypatch.setattr(WatcherRequestHandler, "cache", LookupCache(16, 60))
+    monkeypatch.setattr(WatcherRequestHandler, "session_factory", None)
+    http = start_api_server(0)
+    yield http, factory
+    http.shutdown()
+    http.server_close()
+
+
+def _get(http, query: str):
+    url = f"http://127.0.0.1:{http.server_address[1]}/lost_files?{query}"
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def _names(body: dict) -> list:
+    return [item["file_name"] for item in body["items"]]
+
+
+def test_lookup_by_name_including_unparsable_names(server):
+    http, factory = server
+    assert _get(http, f"name={PARSED}")[0] == 503
+    set_session_factory(factory)
+
+    for name in [PARSED, HUGE_ID, *UNPARSED]:
+        status, body = _get(http, f"name={name}")
+        assert status == 200 and _names(body) == [name]
+    assert _get(http, "name=20260128101047964993_tz01_1_.log")[1] == {"count": 0, "items": []}
+
+
+def test_lookup_by_range_accepts_mixed_timezones(server):
+    http, factory = server
+    set_session_factory(factory)
+    start = datetime(2026, 1, 28, 10, 10).astimezone().astimezone(timezone.utc).isoformat()
+
+    status, body = _get(http, f"start={start.replace('+', '%2B')}&end=2026-01-28T10:11:00")
+
+    assert status == 200 and _names(body) == [PARSED]
+
+
+@pytest.mark.parametrize("query", [
+    "", "limit=0", "start=2026-01-28T10:11:00&end=2026-01-28T10:10:00", "start=yesterday&end=today",
+])
+def test_invalid_parameters_are_rejected(server, query):
+    http, factory = server
+    set_session_factory(factory)
+
+    status, body = _get(http, query)
+
+    assert status == 400 and "error" in body
+
+
+def test_results_are_cached_and_failures_are_not(server, monkeypatch):
+    http, factory = server
+    set_session_factory(factory)
+    calls = []
+    lookup = WatcherRequestHandler._lookup
+
+    def counting_lookup(self, *key):
+        calls.append(key)
+        return lookup(self, *key)
+
+    monkeypatch.setattr(WatcherRequestHandler, "_lookup", counting_lookup)
+    assert _names(_get(http, f"name={PARSED}")[1]) == [PARSED]
+    assert _names(_get(http, f"name={PARSED}")[1]) == [PARSED]
+    assert len(calls) == 1
+
+    def broken_factory():
+        raise RuntimeError("database is down")
+
+    set_session_factory(broken_factory)
+    assert _get(http, f"name={UNPARSED[0]}") == (503, {"error": "database unavailable"})
+    set_session_factory(factory)
+    assert _names(_get(http, f"name={UNPARSED[0]}")[1]) == [UNPARSED[0]]
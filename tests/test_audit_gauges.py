@@ -0,0 +1,28 @@
+"""
+Behaviour tests of the per-pipeline audit gauges when catch-up windows finish after newer ones.
+"""
+
+from prometheus_client import REGISTRY
+
+import main as watcher
+
+INTERVAL = 300
+READY_END = 1_000_000 * INTERVAL
+
+
+def _gauge(name: str, pipeline: str) -> float:
+    return REGISTRY.get_sample_value(name, {"pipeline": pipeline})
+
+
+def test_older_windows_do_not_overwrite_the_latest_results():
+    pipeline = "gauges"
+
+    assert watcher.update_window_gauges(pipeline, READY_END, 100, 98, 2)
+    # 补跑的旧窗口在新窗口之后完成
+    assert not watcher.update_window_gauges(pipeline, READY_END - INTERVAL, 50, 50, 0)
+    assert _gauge("log_audit_lost_files_count", pipeline) == 2
+    assert _gauge("log_audit_forward_count", pipeline) == 100
+    assert _gauge("log_audit_process_count", pipeline) == 98
+
+    assert watcher.update_window_gauges(pipeline, READY_END + INTERVAL, 10, 10, 0)
+    assert _gauge("log_audit_lost_files_count", pipeline) == 0
@@ -0,0 +1,71 @@
+"""
+Behaviour tests of the forwarder's AIMD capacity search against a simulated processor capacity.
+"""
+
+import asyncio
+
+from main_forwarder import LoadTester, StepStats
+
+STEP_SECONDS = 10
+
+
+def _tester(start_tps: int, capacity: float, client_max_tps: float = float("inf")):
+    """
+    用模拟的阶梯结果代替真实发送：超过 capacity 时 p99 延迟升到 2s，发送端最多达到 client_max_tps
+    """
+    tester = LoadTester("http://processor.invalid/receive", start_tps)
+    targets = []
+
+    async def run_step(rate, seconds):
+        targets.append(rate)
+        stats = StepStats(rate)
+        stats.finished = stats.started + seconds
+        stats.sent = int(min(rate, client_max_tps) * seconds)
+        stats.latencies = [0.1 if rate <= capacity else 2.0] * stats.sent
+        return stats
+
+    tester._run_step = run_step
+    return tester, targets
+
+
+def _search(tester: LoadTester, max_tps: float = 1000, max_backoffs: int = 2) -> dict:
+    return asyncio.run(tester.search_capacity(
+        step_tps=10, max_tps=max_tps, step_seconds=STEP_SECONDS, backoff=0.5, max_backoffs=max_backoffs,
+        p99_ms=1000, error_rate=0.01, timeout_rate=0.001))
+
+
+def test_additive_increase_and_multiplicative_backoff_find_the_capacity():
+    tester, targets = _tester(10, capacity=45)
+
+    result = _search(tester)
+
+    assert targets == [10, 20, 30, 40, 50, 25, 35, 45, 55]
+    assert [step["healthy"] for step in result["steps"]] == [True] * 4 + [False] + [True] * 3 + [False]
+    assert result["max_sustainable_tps"] == 45 and not result["client_limited"]
+
+
+def test_backoff_never_drops_below_the_start_rate():
+    tester, targets = _tester(40, capacity=30)
+
+    result = _search(tester, max_backoffs=3)
+
+    assert targets == [40, 40, 40]
+    assert result["max_sustainable_tps"] == 0
+
+
+def test_search_stops_at_max_tps():
+    tester, targets = _tester(10, capacity=10_000)
+
+    result = _search(tester, max_tps=30)
+
+    assert targets == [10, 20, 30]
+    assert result["max_sustainable_tps"] == 30
+
+
+def test_search_stops_when_the_load_generator_falls_behind():
+    tester, targets = _tester(10, capacity=10_000, client_max_tps=25)
+
+    result = _search(tester)
+
+    assert targets == [10, 20, 30]
+    assert result["client_limited"] and result["max_sustainable_tps"] == 20
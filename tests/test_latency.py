@@ -0,0 +1,46 @@
+"""
+Behaviour tests of the fixed-memory latency digest: percentile error bounds and Prometheus export buckets.
+"""
+
+import pytest
+
+from latency import DIGEST_BASE_SECONDS, EXPORT_BUCKET_BOUNDS, LatencyDigest
+
+
+def test_percentiles_are_bucket_upper_bounds_within_the_relative_error():
+    digest = LatencyDigest()
+    samples = [i / 1000 for i in range(1, 1001)]  # 1ms ~ 1s
+    for seconds in samples:
+        digest.add(seconds)
+
+    assert digest.count == 1000 and digest.total == pytest.approx(sum(samples))
+    for q in (0.5, 0.9, 0.99):
+        exact = samples[int(q * 1000) - 1]
+        # 分桶上界比真实值大，误差不超过一个分桶（2^(1/8) 倍）
+        assert exact <= digest.percentile(q) <= exact * 2 ** (1 / 8)
+    assert digest.percentile(1.0) == digest.max == 1.0
+
+
+def test_edge_samples():
+    digest = LatencyDigest()
+    assert digest.percentile(0.5) is None
+
+    digest.add(-0.2)  # 时钟偏差
+    digest.add(DIGEST_BASE_SECONDS / 2)
+    digest.add(10 * 3600)  # 超出最大分桶
+    # 不超过 1ms 的样本（含负值）都落在第一个分桶
+    assert digest.percentile(0.5) == DIGEST_BASE_SECONDS
+    assert digest.percentile(1.0) == 10 * 3600
+
+
+def test_export_buckets_are_cumulative_counts_at_the_export_bounds():
+    digest = LatencyDigest()
+    for seconds in (0.0005, 0.001, 0.0011, 0.003, 0.5, 300):
+        digest.add(seconds)
+
+    exported = digest.export_buckets()
+
+    assert len(exported) == len(EXPORT_BUCKET_BOUNDS)
+    assert exported == [sum(1 for seconds in (0.0005, 0.001, 0.0011, 0.003, 0.5, 300) if seconds <= bound)
+                        for bound in EXPORT_BUCKET_BOUNDS]
+    assert exported[-1] == 5 and digest.count == 6
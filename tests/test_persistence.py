@@ -0,0 +1,96 @@
+"""
+Behaviour tests of the report writer: spool replay with torn lines and dead-lettering rejected reports.
+"""
+
+import json
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from dao import Base, LostFiles, Reports
+from persistence import ReportWriter, _encode
+
+
+def _report(window_end: str, pipeline: str = "default") -> dict:
+    return {
+        "pipeline": pipeline,
+        "audit_window_start": window_end,
+        "audit_window_end": window_end,
+        "forward_count": 2,
+        "process_count": 1,
+        "lost_count": 1,
+    }
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    # 写入线程与测试线程使用不同的连接，使用文件数据库
+    engine = create_engine(f"sqlite:///{tmp_path / 'watcher.db'}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def _writer(tmp_path, session_factory) -> ReportWriter:
+    return ReportWriter(session_factory,
+                        spool_path=str(tmp_path / "spool.jsonl"),
+                        dead_letter_path=str(tmp_path / "dead_letter.jsonl"),
+                        retry_min_seconds=0.1, retry_max_seconds=0.1)
+
+
+def _wait_for_reports(session_factory, count: int, timeout: float = 10) -> list:
+    deadline = time.monotonic() + timeout
+    while True:
+        session = session_factory()
+        try:
+            ends = sorted(end for end, in session.query(Reports.audit_window_end))
+        finally:
+            session.close()
+        if len(ends) >= count or time.monotonic() > deadline:
+            return ends
+        time.sleep(0.05)
+
+
+def _dead_letters(tmp_path) -> list:
+    with open(tmp_path / "dead_letter.jsonl", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_replay_quarantines_torn_lines_and_keeps_writing(tmp_path, session_factory):
+    torn = '{"report": {"pipeline": "default", "audit_window_'
+    with open(tmp_path / "spool.jsonl", "w", encoding="utf-8") as f:
+        f.write(_encode(_report("2026-01-28T10:05:00"), ["20260128100447000000_tz01_00000001_.log"]))
+        # 中间的损坏行，以及进程崩溃时末尾写了一半、没有换行符的行
+        f.write("not json\n")
+        f.write(_encode(_report("2026-01-28T10:10:00"), []))
+        f.write(torn)
+
+    writer = _writer(tmp_path, session_factory)
+    writer.submit(_report("2026-01-28T10:15:00"), [])
+    writer.start()
+    try:
+        ends = _wait_for_reports(session_factory, 3)
+    finally:
+        writer.close()
+
+    assert ends == ["2026-01-28T10:05:00", "2026-01-28T10:10:00", "2026-01-28T10:15:00"]
+    assert [record["raw"] for record in _dead_letters(tmp_path)] == ["not json", torn]
+    assert (tmp_path / "spool.jsonl").read_text(encoding="utf-8") == ""
+    session = session_factory()
+    assert session.query(LostFiles).count() == 1
+    session.close()
+
+
+def test_rejected_report_is_dead_lettered_without_blocking_the_batch(tmp_path, session_factory):
+    writer = _writer(tmp_path, session_factory)
+    writer.submit(_report("2026-01-28T10:05:00"), [])
+    # audit_window_start 为空违反 NOT NULL 约束，重试也无法写入
+    writer.submit({**_report("2026-01-28T10:10:00"), "audit_window_start": None}, [])
+    writer.submit(_report("2026-01-28T10:15:00"), [])
+
+    assert writer.write_pending()
+
+    assert _wait_for_reports(session_factory, 2, timeout=0) == ["2026-01-28T10:05:00", "2026-01-28T10:15:00"]
+    dead = _dead_letters(tmp_path)
+    assert [record["report"]["audit_window_end"] for record in dead] == ["2026-01-28T10:10:00"]
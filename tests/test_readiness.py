@@ -0,0 +1,74 @@
+"""
+Behaviour tests of the startup schema migration against tables created by an older watcher.
+"""
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+from dao import Base, LostFiles, WatcherDao
+from readiness import _narrow_columns, ensure_schema
+
+
+@pytest.fixture
+def old_engine(tmp_path):
+    """
+    最初版本的表结构：没有 pipeline / shard / latency_* / bucket / file_ts / file_id 列，也没有 daily_rollups
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'watcher.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE reports (id CHAR(36) PRIMARY KEY, audit_window_start VARCHAR(50) NOT NULL, "
+            "audit_window_end VARCHAR(50) NOT NULL, forward_count INTEGER NOT NULL, "
+            "process_count INTEGER NOT NULL, lost_count INTEGER NOT NULL)"))
+        conn.execute(text(
+            "CREATE TABLE lost_files (id CHAR(36) PRIMARY KEY, "
+            "report_id CHAR(36) NOT NULL REFERENCES reports(id), file_name VARCHAR(100) NOT NULL, "
+            "created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL)"))
+        conn.execute(text(
+            "INSERT INTO reports VALUES ('r1', '2026-01-28T10:10:00', '2026-01-28T10:15:00', 2, 1, 1)"))
+        conn.execute(text(
+            "INSERT INTO lost_files VALUES ('l1', 'r1', '20260128101047964993_tz01_91458258_.log', "
+            "'2026-01-28 10:20:00', '2026-01-28 10:20:00')"))
+    return engine
+
+
+def test_refuses_to_start_on_old_schema_without_migration(old_engine):
+    with pytest.raises(RuntimeError, match="out of date"):
+        ensure_schema(old_engine, Base.metadata, migrate=False)
+
+
+def test_migrates_old_tables_idempotently_and_backfills(old_engine):
+    added = ensure_schema(old_engine, Base.metadata)
+
+    assert "reports.pipeline" in added and "lost_files.file_ts" in added
+    assert ensure_schema(old_engine, Base.metadata) == []
+    inspector = inspect(old_engine)
+    assert "daily_rollups" in inspector.get_table_names()
+    assert {index["name"] for index in inspector.get_indexes("lost_files")} >= {
+        "ix_lost_files_bucket", "ix_lost_files_file_ts_file_id", "ix_lost_files_file_name"}
+
+    dao = WatcherDao(sessionmaker(bind=old_engine)())
+    assert dao.backfill_derived_columns() == {
+        "reports.bucket": 1, "lost_files.bucket": 1, "lost_files.file_ts": 1}
+    assert dao.backfill_derived_columns() == {
+        "reports.bucket": 0, "lost_files.bucket": 0, "lost_files.file_ts": 0}
+    with old_engine.connect() as conn:
+        assert conn.execute(text("SELECT pipeline, bucket FROM reports")).one() == ("default", 20260128)
+        assert conn.execute(text("SELECT bucket, file_id FROM lost_files")).one() == (20260128, 91458258)
+    lost = dao.find_lost_files(file_name="20260128101047964993_tz01_91458258_.log")
+    assert [item["report_id"] for item in lost] == ["r1"]
+
+
+def test_reports_integer_file_id_columns_to_widen(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'watcher.db'}")
+    Base.metadata.create_all(engine)
+    assert _narrow_columns(inspect(engine), Base.metadata) == {}
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE lost_files"))
+        conn.execute(text(
+            "CREATE TABLE lost_files (id CHAR(36) PRIMARY KEY, report_id CHAR(36) NOT NULL, "
+            "file_name VARCHAR(100) NOT NULL, file_ts DATETIME, file_id INTEGER, bucket INTEGER, "
+            "created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL)"))
+
+    assert _narrow_columns(inspect(engine), Base.metadata) == {"lost_files": [LostFiles.__table__.c.file_id]}
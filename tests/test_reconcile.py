@@ -0,0 +1,109 @@
+"""
+Behaviour tests of the exact and partitioned reconcile modes against synthetic Loki streams and duplicated lines.
+"""
+
+from datetime import datetime
+
+import pytest
+
+import main as watcher
+from loki_stub import LokiStub, _file_name, _forward_line, _process_line, synthesize_streams
+from pipelines import Pipeline
+
+WINDOW_START = datetime(2026, 1, 28, 10, 0, 0)
+WINDOW_END = datetime(2026, 1, 28, 10, 5, 0)
+FILES = 5000
+
+
+@pytest.fixture
+def loki(monkeypatch):
+    """
+    用 LokiStub 代替 Loki 的 query_range，审计走真实的分页查询逻辑
+    """
+    stub = LokiStub(synthesize_streams(FILES, WINDOW_START.timestamp(), loss_rate=0.02, seed=7))
+
+    def get_loki_logs(query, start_ns, end_ns, limit=watcher.LOKI_QUERY_LIMIT, pipeline="default",
+                      stream="unknown"):
+        return stub.query_range(query, start_ns, end_ns, limit, "FORWARD")["data"]["result"]
+
+    monkeypatch.setattr(watcher, "get_loki_logs", get_loki_logs)
+    monkeypatch.setattr(watcher, "INGEST_BACKEND", "loki")
+    return stub
+
+
+def _reconcile(reconcile, pipeline: Pipeline):
+    return reconcile(pipeline, WINDOW_START, WINDOW_END,
+                     WINDOW_START.timestamp() - watcher.WINDOW_EXTEND_SECONDS,
+                     WINDOW_END.timestamp() + watcher.WINDOW_EXTEND_SECONDS)
+
+
+def test_file_and_cid_joins_report_the_same_lost_files(loki):
+    by_file = _reconcile(watcher.reconcile_exact, Pipeline(name="test-file"))
+    by_cid = _reconcile(watcher.reconcile_exact, Pipeline(name="test-cid", join_key="cid"))
+
+    forward_count, process_count, lost_count, lost, latency = by_file
+    assert forward_count == FILES
+    assert 0 < lost_count == len(lost) < FILES
+    assert process_count == FILES - lost_count
+    # 合成数据的处理延迟为 50~500ms
+    assert latency.count == process_count
+    assert 0.05 <= latency.percentile(0.01) and latency.max <= 0.5
+    assert by_cid[:4] == by_file[:4]
+    assert by_cid[4].export_buckets() == latency.export_buckets()
+
+
+@pytest.mark.parametrize("join_key", ["file", "cid"])
+def test_duplicate_lines_are_counted_once_and_timed_from_the_first(monkeypatch, join_key):
+    start_us = int(WINDOW_START.timestamp()) * 1_000_000
+    base_ns = start_us * 1000
+    # 文件 0 转发和处理各重试一次，文件 1 丢失，文件 2 只有处理日志
+    names = [_file_name(start_us + i * 1_000_000, i) for i in range(3)]
+    cids = [(start_us + i * 1_000_000) << watcher.CID_SEQUENCE_BITS for i in range(3)]
+    forward = [(base_ns, _forward_line(base_ns, names[0], cids[0])),
+               (base_ns + 10**9, _forward_line(base_ns + 10**9, names[1], cids[1])),
+               (base_ns + 2 * 10**9, _forward_line(base_ns + 2 * 10**9, names[0], cids[0]))]
+    process = [(base_ns + 3 * 10**8, _process_line(base_ns + 3 * 10**8, names[0], 300, True, cids[0])),
+               (base_ns + 4 * 10**9, _process_line(base_ns + 4 * 10**9, names[2], 300, True, cids[2])),
+               (base_ns + 5 * 10**9, _process_line(base_ns + 5 * 10**9, names[0], 300, True, cids[0]))]
+    monkeypatch.setattr(watcher, "iter_logs",
+                        lambda pipeline, stream, start_ts, end_ts: iter(forward if stream == "forward" else process))
+
+    forward_count, process_count, lost_count, lost, latency = _reconcile(
+        watcher.reconcile_exact, Pipeline(name=f"dup-{join_key}", join_key=join_key))
+
+    assert (forward_count, process_count, lost_count, lost) == (2, 2, 1, {names[1]})
+    assert latency.count == 1 and latency.max == pytest.approx(0.3)
+
+
+@pytest.mark.parametrize("join_key", ["file", "cid"])
+def test_partitioned_matches_exact_with_bounded_keys_per_pass(loki, monkeypatch, join_key):
+    pipeline = Pipeline(name=f"partitioned-{join_key}", join_key=join_key)
+    forward_count, process_count, lost_count, lost, latency = _reconcile(watcher.reconcile_exact, pipeline)
+    # 第一个窗口没有可参考的键数，从 1 个分区开始，超出上限后加倍重新对账
+    monkeypatch.setattr(watcher, "RECONCILE_PARTITION_KEYS", FILES // 3)
+    peak = [0]
+    join_window = watcher._join_window
+
+    def measured_join_window(*args, **kwargs):
+        result = join_window(*args, **kwargs)
+        peak[0] = max(peak[0], result[1] + len(result[2]))
+        return result
+
+    monkeypatch.setattr(watcher, "_join_window", measured_join_window)
+
+    result = _reconcile(watcher.reconcile_partitioned, pipeline)
+
+    assert result[:4] == (forward_count, process_count, lost_count, lost)
+    assert result[4].export_buckets() == latency.export_buckets() and result[4].max == latency.max
+    assert 0 < peak[0] <= FILES // 3
+    assert watcher._expected_partition_keys[pipeline.name] == FILES
+
+
+def test_partitioned_keeps_the_lost_count_exact_when_names_are_capped(loki, monkeypatch):
+    pipeline = Pipeline(name="partitioned-capped")
+    monkeypatch.setattr(watcher, "RECONCILE_MAX_LOST_NAMES", 10)
+
+    forward_count, process_count, lost_count, lost, _ = _reconcile(watcher.reconcile_partitioned, pipeline)
+
+    assert forward_count == FILES and lost_count == FILES - process_count > 10
+    assert len(lost) == 10
@@ -0,0 +1,88 @@
+"""
+Behaviour tests of the retention policy: daily rollups, re-rolling late reports and the batched purge.
+"""
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from dao import Base, DailyRollups, LostFiles, Reports, WatcherDao
+from retention import RetentionManager
+
+TODAY = datetime(2026, 2, 10, 8, 0, 0)
+
+
+def _report(day: int, lost: int = 1) -> dict:
+    start = f"2026-02-{day:02d}T10:00:00"
+    return {
+        "pipeline": "default",
+        "audit_window_start": start,
+        "audit_window_end": start,
+        "forward_count": 10,
+        "process_count": 10 - lost,
+        "lost_count": lost,
+    }
+
+
+def _lost(day: int, count: int) -> list:
+    return [f"202602{day:02d}100000000000_tz01_{i}_.log" for i in range(count)]
+
+
+@pytest.fixture
+def dao():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield WatcherDao(session)
+    session.close()
+
+
+def _rollups(dao: WatcherDao) -> dict:
+    return {row.day: (row.report_count, row.forward_count, row.lost_count)
+            for row in dao.db_session.query(DailyRollups)}
+
+
+def test_rolls_up_finished_days_and_purges_expired_buckets(dao):
+    for day in (1, 1, 5, 9, 10):
+        dao.create_report_with_lost_files(_report(day, lost=2), _lost(day, 2))
+
+    RetentionManager(retention_days=5, batch_size=3).run(dao, today=TODAY)
+
+    # 今天的报告还在增加，不汇总
+    assert _rollups(dao) == {20260201: (2, 20, 4), 20260205: (1, 10, 2), 20260209: (1, 10, 2)}
+    # 分多批删除 2 月 5 日之前的明细，汇总保留
+    assert sorted(bucket for bucket, in dao.db_session.query(Reports.bucket)) == [20260205, 20260209, 20260210]
+    assert dao.db_session.query(LostFiles).count() == 6
+
+
+def test_late_reports_within_the_reroll_range_reach_the_rollups(dao):
+    dao.create_report(_report(9))
+    manager = RetentionManager(retention_days=30, reroll_days=3)
+    manager.run(dao, today=TODAY)
+
+    # 补跑的窗口和从缓冲文件补写的报告晚于汇总到达
+    dao.create_report(_report(7))
+    dao.create_report(_report(9))
+    dao.create_report(_report(2))
+    manager.run(dao, today=TODAY)
+
+    # 超出重新汇总范围的天不再更新
+    assert _rollups(dao) == {20260207: (1, 10, 1), 20260209: (2, 20, 2)}
+
+
+def test_nothing_is_purged_when_the_rollup_fails(dao, monkeypatch):
+    dao.create_report(_report(1))
+    monkeypatch.setattr(dao, "rollup_buckets", lambda *args, **kwargs: -1)
+
+    RetentionManager(retention_days=1).run(dao, today=TODAY)
+
+    assert dao.db_session.query(Reports).count() == 1
+
+
+def test_maybe_run_respects_the_check_interval(dao):
+    manager = RetentionManager(retention_days=0, check_interval_seconds=3600)
+
+    assert manager.maybe_run(dao)
+    assert not manager.maybe_run(dao)
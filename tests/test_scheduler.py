@@ -0,0 +1,148 @@
+"""
+Behaviour tests of the audit scheduler: resume with gaps, bounded in-flight jobs and retry backoff.
+"""
+
+import threading
+from concurrent.futures import wait
+
+from scheduler import AuditScheduler, WindowUnavailable
+
+INTERVAL = 300
+OFFSET = 300
+# 最新就绪窗口的结束时间为 READY_END
+READY_END = 1_000_000 * INTERVAL
+NOW = READY_END + OFFSET + 10
+
+
+def _ago(windows: int) -> float:
+    return READY_END - windows * INTERVAL
+
+
+def _drain(scheduler: AuditScheduler, now: float):
+    """
+    在固定的时间点反复调度，直到没有可立即执行或正在执行的任务
+    """
+    while True:
+        scheduler.run_once(now)
+        if not scheduler.running:
+            return
+        wait(list(scheduler.running))
+
+
+def test_resume_queues_holes_below_the_latest_report():
+    scheduler = AuditScheduler(lambda *args: None, ["a"], INTERVAL, OFFSET)
+    audited = {"a": {_ago(0), _ago(1), _ago(3), _ago(4), _ago(7)}}
+
+    queued = scheduler.resume(audited, {"a": _ago(7)}, max_windows=10, now=NOW)
+
+    assert queued == 3
+    assert scheduler.pending == {(_ago(2), "a"), (_ago(5), "a"), (_ago(6), "a")}
+
+
+def test_resume_is_bounded_by_horizon_and_first_report():
+    scheduler = AuditScheduler(lambda *args: None, ["old", "new", "fresh"], INTERVAL, OFFSET)
+
+    scheduler.resume({}, {"old": _ago(100), "new": _ago(1)}, max_windows=3, now=NOW)
+
+    assert scheduler.pending == {
+        # 只补跑最近 3 个窗口
+        (_ago(2), "old"), (_ago(1), "old"), (_ago(0), "old"),
+        # 不早于第一份报告
+        (_ago(1), "new"), (_ago(0), "new"),
+        # 没有历史记录时只审计最新的就绪窗口
+        (_ago(0), "fresh"),
+    }
+
+
+def test_in_flight_jobs_are_bounded_and_newest_windows_run_first():
+    release = threading.Event()
+    lock = threading.Lock()
+    started = []
+    running = [0]
+    peak = [0]
+
+    def audit(key, window_start_dt, window_end_dt):
+        with lock:
+            started.append(window_end_dt.timestamp())
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        release.wait(5)
+        with lock:
+            running[0] -= 1
+
+    scheduler = AuditScheduler(audit, ["a"], INTERVAL, OFFSET, max_concurrency=2)
+    scheduler.resume({}, {"a": _ago(5)}, max_windows=10, now=NOW)
+    scheduler.run_once(NOW)
+    assert len(scheduler.running) == 2
+    assert len(scheduler.pending) == 4
+
+    # 补跑积压期间新就绪的窗口照常入队，并排在积压之前执行
+    scheduler.run_once(NOW + INTERVAL)
+    assert (READY_END + INTERVAL, "a") in scheduler.pending
+    release.set()
+    _drain(scheduler, NOW + INTERVAL)
+
+    # 同时提交的两个任务的开始顺序不确定，按批比较
+    assert peak[0] == 2
+    assert set(started[:2]) == {_ago(1), _ago(0)}
+    assert set(started[2:4]) == {READY_END + INTERVAL, _ago(2)}
+    assert set(started[4:]) == {_ago(3), _ago(4), _ago(5)}
+
+
+def test_failed_jobs_back_off_exponentially_until_success():
+    failures = [4]
+
+    def audit(key, window_start_dt, window_end_dt):
+        if failures[0]:
+            failures[0] -= 1
+            raise RuntimeError("loki unavailable")
+
+    scheduler = AuditScheduler(audit, ["a"], INTERVAL, OFFSET,
+                               retry_delay_seconds=5, retry_max_delay_seconds=12)
+    scheduler.resume({}, {}, max_windows=1, now=NOW)
+    job = (READY_END, "a")
+
+    now = NOW
+    delays = []
+    while failures[0]:
+        _drain(scheduler, now)
+        retry_at = scheduler._retry_at[job]
+        delays.append(retry_at - now)
+        # 重试时间之前不会再次提交
+        scheduler.run_once(retry_at - 0.1)
+        assert not scheduler.running and job in scheduler.pending
+        now = retry_at
+
+    assert delays == [5, 10, 12, 12]
+    _drain(scheduler, now)
+    assert not scheduler.pending and not scheduler._retry_at and not scheduler._attempts
+
+
+def test_idle_callback_runs_while_only_retries_are_pending():
+    idle = threading.Event()
+
+    def audit(key, window_start_dt, window_end_dt):
+        raise RuntimeError("loki unavailable")
+
+    scheduler = AuditScheduler(audit, ["a"], INTERVAL, OFFSET,
+                               retry_delay_seconds=3600, on_idle=idle.set)
+    scheduler.resume({}, {}, max_windows=1)
+    threading.Thread(target=scheduler.run_forever, daemon=True).start()
+
+    assert idle.wait(5)
+    assert len(scheduler.pending) == 1
+
+
+def test_windows_the_source_no_longer_covers_are_abandoned_without_retry():
+    calls = []
+
+    def audit(key, window_start_dt, window_end_dt):
+        calls.append(key)
+        raise WindowUnavailable("lines are no longer buffered")
+
+    scheduler = AuditScheduler(audit, ["a"], INTERVAL, OFFSET, retry_delay_seconds=5)
+    scheduler.resume({}, {}, max_windows=1, now=NOW)
+    _drain(scheduler, NOW)
+
+    assert calls == ["a"]
+    assert not scheduler.pending and not scheduler._retry_at
@@ -0,0 +1,71 @@
+"""
+Behaviour tests of the processor simulator: model configuration, validation and the failure models.
+"""
+
+import random
+import statistics
+
+import pytest
+
+from processor.simulation import BernoulliFailure, MarkovFailure, Simulator
+
+
+def test_defaults_and_partial_reconfiguration():
+    simulator = Simulator.from_config({}, seed=1)
+    assert simulator.describe()["latency"] == {
+        "type": "uniform", "cap_ms": 30000, "load_knee": 0, "min_ms": 50, "max_ms": 500}
+    assert simulator.describe()["failure"] == {"type": "bernoulli", "rate": 0.2}
+
+    failure = simulator.failure
+    simulator.configure({"latency": {"type": "lognormal", "median_ms": 120, "sigma": 0.8}})
+
+    assert simulator.latency.describe()["type"] == "lognormal"
+    # 只给出 latency 时失败模型（及其状态）保持不变
+    assert simulator.failure is failure
+
+
+@pytest.mark.parametrize("config", [
+    [],
+    {"latency": {"type": "gamma"}},
+    {"latency": {"type": "uniform", "min_ms": 500, "max_ms": 50}},
+    {"latency": {"type": "pareto", "alpha": "2"}},
+    {"latency": {"type": "lognormal", "sigma": True}},
+    {"failure": {"type": "bernoulli", "rate": 1.5}},
+    {"failure": "markov"},
+    # latency 合法、failure 不合法时两者都不替换
+    {"latency": {"type": "pareto"}, "failure": {"type": "markov", "bad_rate": -1}},
+])
+def test_invalid_configs_are_rejected_and_leave_the_models_unchanged(config):
+    simulator = Simulator.from_config({}, seed=1)
+    before = simulator.describe()
+
+    with pytest.raises(ValueError):
+        simulator.configure(config)
+
+    assert simulator.describe() == before
+
+
+def test_latency_is_capped_and_grows_past_the_load_knee():
+    simulator = Simulator.from_config(
+        {"latency": {"type": "uniform", "min_ms": 100, "max_ms": 100, "load_knee": 2, "cap_ms": 250}}, seed=1)
+
+    delays = [simulator.begin() for _ in range(4)]
+
+    # 在途 1、2 个请求时不受负载影响，之后按 在途数/load_knee 增长，第 5 个请求达到上限
+    assert delays == [100, 100, 150, 200]
+    assert simulator.in_flight == 4
+    assert simulator.begin() == 250
+
+
+def test_failure_models_match_their_long_run_rates():
+    rng = random.Random(3)
+    bernoulli = BernoulliFailure({"rate": 0.1})
+    assert statistics.fmean(bernoulli.failed(rng) for _ in range(50000)) == pytest.approx(0.1, abs=0.01)
+
+    markov = MarkovFailure({"good_rate": 0.0, "bad_rate": 1.0, "p_enter_bad": 0.01, "p_exit_bad": 0.04})
+    samples = [markov.failed(rng) for _ in range(200000)]
+    assert markov.stationary_rate() == pytest.approx(0.2)
+    assert statistics.fmean(samples) == pytest.approx(0.2, abs=0.03)
+    # 故障期连续失败，平均持续约 1 / p_exit_bad 个请求
+    runs = "".join("1" if failed else "0" for failed in samples).split("0")
+    assert statistics.fmean(len(run) for run in runs if run) == pytest.approx(25, rel=0.2)
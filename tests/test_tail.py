@@ -0,0 +1,134 @@
+"""
+Behaviour tests of direct log tailing: rotation, truncation, restoring the buffer after a restart and coverage.
+"""
+
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+from tail import FileTailer, TailCoverageError, TailSource
+
+KEYWORDS = ["keep"]
+RETENTION = 3600
+
+
+def _line(ts: float, text: str) -> str:
+    return f"{datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S.%f')[:23]} [Log-Producer] {text}\n"
+
+
+def _write(path, *lines: str, mode: str = "a"):
+    with open(path, mode, encoding="utf-8") as f:
+        f.writelines(lines)
+
+
+def _texts(entries) -> list:
+    return [line.split("] ", 1)[1] for _, line in entries]
+
+
+@pytest.fixture
+def now() -> float:
+    # 日志行的时间戳精确到毫秒，取整秒使查询边界与日志行时间一致
+    return float(int(time.time()))
+
+
+def test_rotation_reads_the_rest_of_the_old_file_first(tmp_path, now):
+    log = tmp_path / "process.log"
+    _write(log, _line(now - 50, "keep 1"), _line(now - 49, "drop 2"))
+    tailer = FileTailer(str(log), KEYWORDS, RETENTION)
+    tailer.poll()
+
+    # 轮转前最后写入、尚未读取的日志行
+    _write(log, _line(now - 40, "keep 3"))
+    os.rename(log, tmp_path / "process.log.1")
+    _write(log, _line(now - 30, "keep 4"))
+    tailer.poll()
+
+    assert _texts(tailer.query(now - 45, now)) == ["keep 3", "keep 4"]
+
+
+def test_truncation_moves_the_coverage_to_the_new_content(tmp_path, now):
+    log = tmp_path / "process.log"
+    _write(log, _line(now - 50, "keep 1"), _line(now - 40, "keep 2"))
+    tailer = FileTailer(str(log), KEYWORDS, RETENTION)
+    tailer.poll()
+    assert _texts(tailer.query(now - 45, now)) == ["keep 2"]
+
+    # copytruncate：截断前写入但尚未读取的日志行已丢失
+    _write(log, _line(now - 20, "keep 3"), mode="w")
+    tailer.poll()
+
+    with pytest.raises(TailCoverageError):
+        tailer.query(now - 45, now)
+    assert _texts(tailer.query(now - 20, now)) == ["keep 3"]
+
+
+def test_pruned_and_unread_lines_are_reported_as_not_covered(tmp_path, now):
+    log = tmp_path / "process.log"
+    _write(log, _line(now - 100, "keep 1"))
+    tailer = FileTailer(str(log), KEYWORDS, retention_seconds=50)
+    tailer.poll()
+    _write(log, _line(now - 10, "keep 2"))
+
+    # 首次启动时文件中最早的日志行之前的日志不在已读取的文件中，裁剪掉的日志行的时间也不再完整
+    tailer.poll()
+    with pytest.raises(TailCoverageError):
+        tailer.query(now - 200, now)
+    with pytest.raises(TailCoverageError):
+        tailer.query(now - 100, now)
+    assert _texts(tailer.query(now - 99, now)) == ["keep 2"]
+
+
+def test_empty_file_is_covered_from_the_first_poll(tmp_path, now):
+    log = tmp_path / "process.log"
+    log.touch()
+    tailer = FileTailer(str(log), KEYWORDS, RETENTION)
+    with pytest.raises(TailCoverageError):
+        tailer.query(now - 10, now)
+
+    tailer.poll()
+    _write(log, _line(now + 5, "keep 1"))
+    tailer.poll()
+
+    assert _texts(tailer.query(now + 2, now + 10)) == ["keep 1"]
+
+
+def test_restart_restores_lines_and_coverage_across_a_rotation_during_downtime(tmp_path, now):
+    log = tmp_path / "process.log"
+    state = str(tmp_path / "tail_state.json")
+    _write(log, _line(now - 50, "keep 1"))
+    source = TailSource(RETENTION, state_path=state)
+    source.add(str(log), KEYWORDS)
+    source.poll_all()
+
+    # 停机期间旧文件继续写入后被轮转
+    _write(log, _line(now - 40, "keep 2"))
+    os.rename(log, tmp_path / "process.log.1")
+    _write(log, _line(now - 30, "keep 3"))
+    restarted = TailSource(RETENTION, state_path=state)
+    restarted.add(str(log), KEYWORDS)
+    restarted.poll_all()
+
+    entries = restarted.query(str(log), KEYWORDS, now - 50, now)
+    assert _texts(entries) == ["keep 1", "keep 2", "keep 3"]
+
+
+def test_restart_without_the_rotated_file_is_not_covered_before_the_current_file(tmp_path, now):
+    log = tmp_path / "process.log"
+    state = str(tmp_path / "tail_state.json")
+    _write(log, _line(now - 50, "keep 1"))
+    source = TailSource(RETENTION, state_path=state)
+    source.add(str(log), KEYWORDS)
+    source.poll_all()
+
+    # 轮转后的旧文件在停机期间被压缩删除
+    os.remove(log)
+    _write(log, _line(now - 30, "keep 2"))
+    restarted = TailSource(RETENTION, state_path=state)
+    restarted.add(str(log), KEYWORDS)
+    restarted.poll_all()
+
+    with pytest.raises(TailCoverageError):
+        restarted.query(str(log), KEYWORDS, now - 50, now)
+    assert _texts(restarted.query(str(log), KEYWORDS, now - 30, now)) == ["keep 2"]